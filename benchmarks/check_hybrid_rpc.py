@@ -0,0 +1,198 @@
+import os
+import re
+import sys
+import asyncio
+import logging
+import argparse
+from typing import Dict, List
+
+# Add parent directory to path to import from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+for _key in ('PUBLIC_SUPABASE_URL', 'SUPABASE_SERVICE_ROLE_KEY', 'GEMINI_API_KEY', 'OPENAI_API_KEY'):
+    os.environ.setdefault(_key, 'offline-benchmark')
+
+import numpy as np
+
+from src.services.db_service import DatabaseService
+from src.services.local_db_service import LocalDatabaseService
+from src.services.screen_service import ScreenService
+from src.types.screen import ScreenType, SearchOptions, ScreenAnalysis
+from src.utils.similarity import rank_hybrid
+from benchmarks.local_supabase import LocalSupabase, format_vector
+from benchmarks.synthetic_corpus import generate_relative_screen_rows
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MIGRATION = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migration.txt')
+
+# (search_layout, search_color) combinations that must agree
+CASES = [(True, True), (True, False), (False, True)]
+
+
+def _overlap(expected: List[int], actual: List[int]) -> float:
+    return len(set(expected) & set(actual)) / max(1, len(expected))
+
+
+def add_relabeled_copies(rows: List[Dict], targets: List[Dict]) -> Dict[int, int]:
+    """
+    A re-labeled copy (same img_url and embeddings, new id) of every target,
+    keyed by target id. Searches for a target must never return its copy.
+    """
+    next_id = max(r['id'] for r in rows) + 1
+    copy_ids = {}
+    for offset, target in enumerate(targets):
+        rows.append({**target, 'id': next_id + offset})
+        copy_ids[target['id']] = next_id + offset
+    return copy_ids
+
+
+async def check_backend(db_service, section: ScreenType, targets: List[Dict], limit: int, candidate_count: int,
+                        copy_ids: Dict[int, int]) -> bool:
+    """Server-side ranking must return the in-Python ranking when every row is a candidate"""
+    service = ScreenService(section, db_service=db_service)
+    ok = True
+    for search_layout, search_color in CASES:
+        worst = 1.0
+        for target in targets:
+            target_screen = ScreenAnalysis(**{
+                **target,
+                "layout_embedding": np.asarray(target['layout_embedding']).tolist(),
+                "color_embedding": np.asarray(target['color_embedding']).tolist(),
+            })
+            options = SearchOptions(
+                search_layout=search_layout, search_color=search_color,
+                weight_layout=0.7, weight_color=0.3, limit=limit, candidate_count=candidate_count
+            )
+            expected = [r.screen.id for r in (await service.search_similar(target_screen, options))[:limit]]
+            options.server_side = True
+            actual = [r.screen.id for r in await service.search_similar(target_screen, options)]
+            worst = min(worst, _overlap(expected, actual))
+            if copy_ids[target['id']] in actual:
+                logger.error(f"Target {target['id']}: server-side results include a copy of its screenshot")
+                ok = False
+        logger.info(f"layout={search_layout} color={search_color}: worst top-{limit} overlap {worst:.2f}")
+        ok = ok and worst == 1.0
+    return ok
+
+
+def _function_sql() -> str:
+    with open(MIGRATION) as f:
+        text = f.read()
+    match = re.search(r"create or replace function match_relative_screens.*?\$\$;", text, re.S)
+    return match.group(0)
+
+
+def check_postgres(dsn: str, rows: List[Dict], section: ScreenType, targets: List[Dict], limit: int, candidate_count: int,
+                   copy_ids: Dict[int, int]) -> bool:
+    """Load the corpus into a scratch Postgres+pgvector schema and compare the RPC with rank_hybrid"""
+    try:
+        import psycopg
+    except ImportError:
+        logger.error("Checking against Postgres needs psycopg (pip install 'psycopg[binary]')")
+        return False
+
+    dims = len(rows[0]['layout_embedding'])
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute("create extension if not exists vector")
+        conn.execute("create schema if not exists hybrid_rpc_check")
+        conn.execute("set search_path to hybrid_rpc_check, public")
+        conn.execute("drop table if exists relative_screen")
+        conn.execute(f"""
+            create table relative_screen (
+                id bigint primary key,
+                section text not null,
+                img_url text,
+                layout_embedding vector({dims}),
+                color_embedding vector(512)
+            )
+        """)
+        with conn.cursor() as cur:
+            cur.executemany(
+                "insert into relative_screen values (%s, %s, %s, %s::vector, %s::vector)",
+                [(r['id'], r['section'], r['img_url'], format_vector(r['layout_embedding']), format_vector(r['color_embedding'])) for r in rows]
+            )
+        conn.execute("create index on relative_screen using ivfflat (layout_embedding vector_cosine_ops) with (lists = 10)")
+        conn.execute(_function_sql())
+
+        section_rows = [r for r in rows if r['section'] == section.value]
+        ok = True
+        for search_layout, search_color in CASES:
+            worst = 1.0
+            for target in targets:
+                others = [r for r in section_rows if r['id'] != target['id']]
+                expected = [m['id'] for m in rank_hybrid(
+                    [r['id'] for r in others],
+                    np.stack([r['layout_embedding'] for r in others]),
+                    np.stack([r['color_embedding'] for r in others]),
+                    target['layout_embedding'] if search_layout else None,
+                    target['color_embedding'] if search_color else None,
+                    0.7, 0.3, limit, candidate_count,
+                    img_urls=[r['img_url'] for r in others], exclude_img_url=target['img_url']
+                )]
+                actual = [row[0] for row in conn.execute(
+                    "select id from match_relative_screens(%s::vector, %s::vector, %s, 0.7, 0.3, %s, %s, %s, %s)",
+                    (
+                        format_vector(target['layout_embedding']) if search_layout else None,
+                        format_vector(target['color_embedding']) if search_color else None,
+                        section.value, limit, candidate_count, target['id'], target['img_url']
+                    )
+                ).fetchall()]
+                worst = min(worst, _overlap(expected, actual))
+                if copy_ids[target['id']] in actual:
+                    logger.error(f"Target {target['id']}: RPC results include a copy of its screenshot")
+                    ok = False
+            # ivfflat is approximate, so layout-driven cases may miss a few rows at low probes
+            logger.info(f"postgres layout={search_layout} color={search_color}: worst top-{limit} overlap {worst:.2f}")
+            ok = ok and worst >= 0.8
+        conn.execute("drop schema hybrid_rpc_check cascade")
+    return ok
+
+
+def main(args) -> int:
+    section = ScreenType.FOOTER
+    rows = generate_relative_screen_rows(args.scale, seed=args.seed)
+    targets = [r for r in rows if r['section'] == section.value][:args.queries]
+    copy_ids = add_relabeled_copies(rows, targets)
+    # Every row of the section is a candidate, so results must match exactly
+    candidate_count = args.scale
+
+    ok = True
+    for name in args.backends.split(','):
+        if name == 'standin':
+            db_service = DatabaseService(LocalSupabase({'relative_screen': rows}))
+        elif name == 'sqlite':
+            db_service = LocalDatabaseService(':memory:')
+            db_service.insert('relative_screen', rows)
+        else:
+            raise ValueError(f"Unknown backend: {name}")
+        logger.info(f"Checking match_relative_screens on {name}")
+        ok = asyncio.run(check_backend(db_service, section, targets, args.limit, candidate_count, copy_ids)) and ok
+
+    if args.dsn:
+        logger.info("Checking match_relative_screens on Postgres")
+        ok = check_postgres(args.dsn, rows, section, targets, args.limit, candidate_count, copy_ids) and ok
+
+    logger.info("OK" if ok else "MISMATCH")
+    return 0 if ok else 1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Check server-side hybrid ranking against the in-Python search')
+    parser.add_argument('--backends', default='standin,sqlite',
+                       help='Comma-separated offline backends to check (default: standin,sqlite)')
+    parser.add_argument('--dsn', default=os.getenv('PGVECTOR_DSN'),
+                       help='Postgres+pgvector connection string for a local database (default: $PGVECTOR_DSN)')
+    parser.add_argument('--scale', type=int, default=1100,
+                       help='Synthetic relative_screen rows (default: 1100)')
+    parser.add_argument('--queries', type=int, default=10,
+                       help='Target screens per case (default: 10)')
+    parser.add_argument('--limit', type=int, default=5,
+                       help='Top-k compared (default: 5)')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
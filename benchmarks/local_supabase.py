@@ -0,0 +1,268 @@
+import copy
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional
+
+from src.utils.similarity import rank_hybrid
+from src.utils.vector_index import VECTOR_INDEXES
+
+
+def format_vector(vec: np.ndarray) -> str:
+    """Render a vector the way PostgREST returns pgvector columns"""
+    return '[' + ','.join(f"{x:.7g}" for x in vec.tolist()) + ']'
+
+
+class LocalResponse:
+    def __init__(self, data: Any, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+class _NegatedFilters:
+    """Implements the `query.not_.eq(...)` chain"""
+    def __init__(self, query: 'LocalQuery'):
+        self._query = query
+
+    def eq(self, column: str, value: Any) -> 'LocalQuery':
+        return self._query._filter(lambda row: row.get(column) != value)
+
+
+class LocalQuery:
+    """Subset of the postgrest query builder used by this project"""
+
+    def __init__(self, client: 'LocalSupabase', table: str):
+        self._client = client
+        self._table = table
+        self._columns: Optional[List[str]] = None
+        self._filters: List[Callable[[Dict], bool]] = []
+        self._order: Optional[tuple] = None
+        self._limit: Optional[int] = None
+        self._offset = 0
+        self._single = False
+        self._update: Optional[Dict] = None
+        self._insert: Optional[Any] = None
+
+    def _filter(self, predicate: Callable[[Dict], bool]) -> 'LocalQuery':
+        self._filters.append(predicate)
+        return self
+
+    @property
+    def not_(self) -> _NegatedFilters:
+        return _NegatedFilters(self)
+
+    def select(self, columns: str = '*') -> 'LocalQuery':
+        if columns.strip() != '*':
+            self._columns = [c.strip() for c in columns.split(',')]
+        return self
+
+    def eq(self, column: str, value: Any) -> 'LocalQuery':
+        return self._filter(lambda row: row.get(column) == value)
+
+    def neq(self, column: str, value: Any) -> 'LocalQuery':
+        return self._filter(lambda row: row.get(column) != value)
+
+    def gt(self, column: str, value: Any) -> 'LocalQuery':
+        return self._filter(lambda row: row.get(column) is not None and row.get(column) > value)
+
+    def gte(self, column: str, value: Any) -> 'LocalQuery':
+        return self._filter(lambda row: row.get(column) is not None and row.get(column) >= value)
+
+    def lt(self, column: str, value: Any) -> 'LocalQuery':
+        return self._filter(lambda row: row.get(column) is not None and row.get(column) < value)
+
+    def lte(self, column: str, value: Any) -> 'LocalQuery':
+        return self._filter(lambda row: row.get(column) is not None and row.get(column) <= value)
+
+    def in_(self, column: str, values: List[Any]) -> 'LocalQuery':
+        allowed = set(values)
+        return self._filter(lambda row: row.get(column) in allowed)
+
+    def order(self, column: str, desc: bool = False) -> 'LocalQuery':
+        self._order = (column, desc)
+        return self
+
+    def limit(self, count: int) -> 'LocalQuery':
+        self._limit = count
+        return self
+
+    def range(self, start: int, end: int) -> 'LocalQuery':
+        self._offset = start
+        self._limit = end - start + 1
+        return self
+
+    def single(self) -> 'LocalQuery':
+        self._single = True
+        return self
+
+    def update(self, values: Dict) -> 'LocalQuery':
+        self._update = values
+        return self
+
+    def insert(self, values: Any) -> 'LocalQuery':
+        self._insert = values
+        return self
+
+    def execute(self) -> LocalResponse:
+        rows = self._client.tables.setdefault(self._table, [])
+
+        if self._insert is not None:
+            inserted = [self._client.insert_row(self._table, values)
+                        for values in (self._insert if isinstance(self._insert, list) else [self._insert])]
+            return LocalResponse([self._client.render(self._table, row) for row in inserted])
+
+        matched = [row for row in rows if all(f(row) for f in self._filters)]
+
+        if self._update is not None:
+            for row in matched:
+                row.update(copy.deepcopy(self._update))
+                self._client.invalidate(self._table, row)
+            return LocalResponse([self._client.render(self._table, row) for row in matched])
+
+        if self._order:
+            column, desc = self._order
+            matched.sort(key=lambda row: row.get(column) or 0, reverse=desc)
+        matched = matched[self._offset:]
+        if self._limit is not None:
+            matched = matched[:self._limit]
+
+        data = [self._client.render(self._table, row, self._columns) for row in matched]
+        if self._single:
+            if len(data) != 1:
+                raise Exception(f"JSON object requested, multiple (or no) rows returned ({len(data)})")
+            return LocalResponse(data[0])
+        return LocalResponse(data)
+
+
+class LocalRpc:
+    def __init__(self, client: 'LocalSupabase', name: str, params: Dict):
+        self._client = client
+        self._name = name
+        self._params = params
+
+    def execute(self) -> LocalResponse:
+        handler = getattr(self._client, f"_rpc_{self._name}", None)
+        if handler is None:
+            raise Exception(f"Could not find the function public.{self._name}")
+        return LocalResponse(handler(**self._params))
+
+
+class LocalSupabase:
+    """
+    In-process stand-in for the Supabase client used by the benchmarks.
+    Vector columns are held as float32 arrays and rendered to pgvector text
+    on first read, so callers pay the same parsing cost as against PostgREST.
+    """
+
+    VECTOR_COLUMNS = {
+        'relative_screen': ('layout_embedding', 'color_embedding'),
+        'screen_analysis': ('embedding',),
+    }
+
+    def __init__(self, tables: Optional[Dict[str, List[Dict]]] = None):
+        self.tables: Dict[str, List[Dict]] = {}
+        self._rendered: Dict[tuple, str] = {}
+        self._next_id: Dict[str, int] = {}
+        for table, rows in (tables or {}).items():
+            for row in rows:
+                self.insert_row(table, row)
+
+    def table(self, name: str) -> LocalQuery:
+        return LocalQuery(self, name)
+
+    def rpc(self, name: str, params: Optional[Dict] = None) -> LocalRpc:
+        return LocalRpc(self, name, params or {})
+
+    def insert_row(self, table: str, values: Dict) -> Dict:
+        row = dict(values)
+        for column in self.VECTOR_COLUMNS.get(table, ()):
+            if row.get(column) is not None:
+                row[column] = np.asarray(row[column], dtype=np.float32)
+        if row.get('id') is None:
+            row['id'] = self._next_id.get(table, 1)
+        self._next_id[table] = max(self._next_id.get(table, 1), row['id'] + 1)
+        self.tables.setdefault(table, []).append(row)
+        return row
+
+    def invalidate(self, table: str, row: Dict):
+        for column in self.VECTOR_COLUMNS.get(table, ()):
+            self._rendered.pop((table, column, row['id']), None)
+            if isinstance(row.get(column), list):
+                row[column] = np.asarray(row[column], dtype=np.float32)
+
+    def render(self, table: str, row: Dict, columns: Optional[List[str]] = None) -> Dict:
+        vector_columns = self.VECTOR_COLUMNS.get(table, ())
+        out = {}
+        for column in (columns or row.keys()):
+            value = row.get(column)
+            if column in vector_columns and value is not None:
+                key = (table, column, row['id'])
+                if key not in self._rendered:
+                    self._rendered[key] = format_vector(value)
+                value = self._rendered[key]
+            elif isinstance(value, (list, dict)):
+                value = copy.deepcopy(value)
+            out[column] = value
+        return out
+
+    def _rpc_match_screen_embeddings(self, query_embedding, match_threshold: float, match_count: int, section_type: str,
+                                     search_effort: float = 1.0) -> List[Dict]:
+        # Exact scan: there are no index probes to scale down
+        rows = [row for row in self.tables.get('screen_analysis', [])
+                if row.get('embedding') is not None and row.get('section') == section_type]
+        if not rows:
+            return []
+        matrix = np.stack([row['embedding'] for row in rows])
+        query = np.asarray(query_embedding, dtype=np.float32)
+        similarity = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query))
+        order = np.argsort(-similarity)
+        return [
+            {"screen_id": rows[i]['screen_id'], "webp_url": rows[i]['webp_url'], "similarity": float(similarity[i])}
+            for i in order if similarity[i] > match_threshold
+        ][:match_count]
+
+    def _rpc_match_relative_screens(
+        self,
+        query_layout,
+        query_color,
+        section_type: str,
+        weight_layout: float = 0.5,
+        weight_color: float = 0.5,
+        match_count: int = 5,
+        candidate_count: int = 200,
+        exclude_id: Optional[int] = None,
+        exclude_img_url: Optional[str] = None
+    ) -> List[Dict]:
+        rows = [
+            row for row in self.tables.get('relative_screen', [])
+            if row.get('section') == section_type
+            and (exclude_id is None or row['id'] != exclude_id)
+            and (exclude_img_url is None or row.get('img_url') != exclude_img_url)
+            and (query_layout is None or row.get('layout_embedding') is not None)
+            and (query_color is None or row.get('color_embedding') is not None)
+        ]
+        return rank_hybrid(
+            [row['id'] for row in rows],
+            np.stack([row['layout_embedding'] for row in rows]) if rows and query_layout is not None else None,
+            np.stack([row['color_embedding'] for row in rows]) if rows and query_color is not None else None,
+            query_layout,
+            query_color,
+            weight_layout,
+            weight_color,
+            match_count,
+            candidate_count
+        )
+
+    def _rpc_vector_index_stats(self) -> List[Dict]:
+        # The stand-in scans exactly, so there is never an index
+        return [
+            {
+                "table_name": table,
+                "column_name": column,
+                "row_count": sum(1 for row in self.tables.get(table, []) if row.get(column) is not None),
+                "index_name": None,
+                "index_method": None,
+                "index_definition": None,
+                "probes": None,
+                "ef_search": None,
+            }
+            for table, column in VECTOR_INDEXES
+        ]
@@ -0,0 +1,417 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import subprocess
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# Add parent directory to path to import from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The scripts validate credentials and build API clients on startup.
+# Offline runs never reach the network, so placeholder values are enough.
+for _key in ('PUBLIC_SUPABASE_URL', 'SUPABASE_SERVICE_ROLE_KEY', 'GEMINI_API_KEY', 'OPENAI_API_KEY'):
+    os.environ.setdefault(_key, 'offline-benchmark')
+
+import numpy as np
+
+import search
+import update
+from src.services.base_db_service import BaseDatabaseService
+from src.services.db_service import DatabaseService
+from src.services.local_db_service import LocalDatabaseService
+from src.services.gemini_service import GeminiService
+from src.services.service_factory import ServiceFactory
+from src.types.screen import ScreenType
+from src.utils.color_histogram import get_color_histogram_embedding
+from src.utils.similarity import calculate_cosine_similarity, calculate_histogram_similarity
+from src.utils.sparse_histogram import to_sparse, sparse_histogram_similarity
+from benchmarks.local_supabase import LocalSupabase
+from benchmarks.synthetic_corpus import (
+    generate_layout_embeddings,
+    generate_color_histograms,
+    generate_relative_screen_rows,
+    generate_screen_analysis_rows,
+    generate_screenshots,
+)
+
+logger = logging.getLogger(__name__)
+
+SEARCH_SECTION = ScreenType.FOOTER
+
+
+def _summarize(latencies: List[float], items_per_call: int, peak_bytes: int) -> Dict:
+    latencies_ms = np.asarray(latencies) * 1000
+    total = float(np.sum(latencies))
+    return {
+        "calls": len(latencies),
+        "latency_ms": {
+            "mean": float(latencies_ms.mean()),
+            "p50": float(np.percentile(latencies_ms, 50)),
+            "p95": float(np.percentile(latencies_ms, 95)),
+            "max": float(latencies_ms.max()),
+        },
+        "throughput_per_s": (len(latencies) * items_per_call) / total if total > 0 else None,
+        "peak_memory_mb": peak_bytes / (1024 * 1024),
+    }
+
+
+def measure(run: Callable[[int], Awaitable[None]], calls: int, items_per_call: int = 1) -> Dict:
+    """
+    Time `calls` invocations of run(i), then repeat the first one under
+    tracemalloc to record peak Python heap usage (numpy buffers included).
+    tracemalloc slows allocation-heavy code, so it is kept out of the timings.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        latencies = []
+        for i in range(calls):
+            start = time.perf_counter()
+            loop.run_until_complete(run(i))
+            latencies.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            loop.run_until_complete(run(0))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    finally:
+        loop.close()
+    return _summarize(latencies, items_per_call, peak)
+
+
+class ImageServer:
+    """Serves synthetic screenshots over HTTP so the histogram path runs unchanged"""
+
+    def __init__(self, images: Dict[str, bytes]):
+        images_by_path = {f"/{path}": data for path, data in images.items()}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                data = images_by_path.get(self.path)
+                if data is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/webp')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self) -> 'ImageServer':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def bench_similarity(pairs: int, seed: int) -> Dict[str, Dict]:
+    """Pairwise scoring functions used inside search_similar"""
+    rng = np.random.default_rng(seed)
+    layout = generate_layout_embeddings(pairs + 1, rng).tolist()
+    color = generate_color_histograms(pairs + 1, rng).tolist()
+
+    async def cosine(_):
+        for i in range(pairs):
+            calculate_cosine_similarity(layout[i], layout[i + 1])
+
+    async def histogram(_):
+        for i in range(pairs):
+            calculate_histogram_similarity(color[i], color[i + 1])
+
+    # Stored form: histograms are decoded to sparse once, as search does
+    sparse = [to_sparse(hist) for hist in color]
+
+    async def histogram_sparse(_):
+        for i in range(pairs):
+            sparse_histogram_similarity(sparse[i], sparse[i + 1])
+
+    return {
+        "cosine_similarity": measure(cosine, calls=5, items_per_call=pairs),
+        "histogram_similarity": measure(histogram, calls=5, items_per_call=pairs),
+        "histogram_similarity_sparse": measure(histogram_sparse, calls=5, items_per_call=pairs),
+    }
+
+
+def bench_histogram(num_images: int, seed: int) -> Dict[str, Dict]:
+    """get_color_histogram_embedding against a local HTTP server"""
+    images = generate_screenshots(num_images, np.random.default_rng(seed))
+    paths = list(images)
+    with ImageServer(images) as server:
+        async def run(i):
+            await get_color_histogram_embedding(f"{server.base_url}/{paths[i % len(paths)]}")
+
+        return {"color_histogram": measure(run, calls=len(paths))}
+
+
+def bench_image_prep(num_images: int, seed: int) -> Dict[str, Dict]:
+    """Gemini upload preparation (re-encode vs passthrough): latency, per-image CPU time and payload size"""
+    rng = np.random.default_rng(seed)
+    images = list(generate_screenshots(num_images, rng).values()) + \
+        list(generate_screenshots(num_images, rng, ext='.jpg').values())
+    api_key = os.environ['GEMINI_API_KEY']
+    services = {
+        "quality": GeminiService(api_key),
+        "passthrough": GeminiService(api_key, passthrough_max_bytes=300 * 1024),
+    }
+
+    results = {}
+    for name, service in services.items():
+        cpu_ms, payload_kb = [], []
+        for data in images:
+            start = time.process_time()
+            payload, _ = service.prepare_payload(data)
+            cpu_ms.append((time.process_time() - start) * 1000)
+            payload_kb.append(len(payload) / 1024)
+
+        async def run(i):
+            service.prepare_payload(images[i % len(images)])
+
+        stats = measure(run, calls=len(images))
+        stats["cpu_ms"] = {"mean": float(np.mean(cpu_ms)), "p50": float(np.median(cpu_ms)), "max": float(np.max(cpu_ms))}
+        stats["payload_kb"] = {"mean": float(np.mean(payload_kb)), "max": float(np.max(payload_kb))}
+        results[f"image_prep_{name}"] = stats
+    return results
+
+
+def build_db_service(storage: str, scale: int, seed: int, pending: int) -> BaseDatabaseService:
+    """
+    Seed a storage backend with a synthetic corpus.
+    "standin" exercises the Supabase code path (vectors returned as text),
+    "sqlite" the local backend (vectors stored as float32 blobs).
+    """
+    tables = {
+        'relative_screen': generate_relative_screen_rows(scale, seed=seed, pending=pending),
+        'screen_analysis': generate_screen_analysis_rows(scale, seed=seed, pending=pending * len(ScreenType)),
+    }
+    if storage == 'sqlite':
+        db_service = LocalDatabaseService(':memory:')
+        for table, rows in tables.items():
+            db_service.insert(table, rows)
+        return db_service
+    return DatabaseService(LocalSupabase(tables))
+
+
+def bench_search(storage: str, scale: int, queries: int, seed: int) -> Dict[str, Dict]:
+    """search.py specific and general paths over one section"""
+    db_service = build_db_service(storage, scale, seed, pending=0)
+    ServiceFactory._services.clear()
+    service = ServiceFactory.get_service(
+        SEARCH_SECTION,
+        gemini_service=GeminiService(os.environ['GEMINI_API_KEY']),
+        db_service=db_service
+    )
+
+    loop = asyncio.new_event_loop()
+    try:
+        targets = loop.run_until_complete(db_service.get_analyses_by_type(SEARCH_SECTION.value))
+    finally:
+        loop.close()
+    analysis_targets = [
+        row for row in generate_screen_analysis_rows(scale, seed=seed)
+        if row['section'] == SEARCH_SECTION.value
+    ]
+
+    async def specific(i):
+        await search.search_similar_sections(
+            db_service, service, targets[i % len(targets)]['img_url'], SEARCH_SECTION.value,
+            weight_layout=0.7, weight_color=0.3, limit=5
+        )
+
+    async def specific_server_side(i):
+        await search.search_similar_sections(
+            db_service, service, targets[i % len(targets)]['img_url'], SEARCH_SECTION.value,
+            weight_layout=0.7, weight_color=0.3, limit=5, server_side=True
+        )
+
+    async def specific_color(i):
+        # Color-only query scored on the rows sharing a dominant color bin
+        await search.search_similar_sections(
+            db_service, service, targets[i % len(targets)]['img_url'], SEARCH_SECTION.value,
+            search_layout=False, limit=5, candidate_source='color'
+        )
+
+    async def specific_deadline(i):
+        # A 5 ms budget: partial scans past it, marked degraded
+        await search.search_similar_sections(
+            db_service, service, targets[i % len(targets)]['img_url'], SEARCH_SECTION.value,
+            weight_layout=0.7, weight_color=0.3, limit=5, deadline_ms=5
+        )
+
+    async def specific_all_sections(i):
+        # Every section at once, one pass over the cross-section index
+        await search.search_similar_sections(
+            db_service, service, targets[i % len(targets)]['img_url'], SEARCH_SECTION.value,
+            weight_layout=0.7, weight_color=0.3, limit=5, sections=['all']
+        )
+
+    async def general(i):
+        await search.search_similar_sections_general(
+            db_service, analysis_targets[i % len(analysis_targets)]['webp_url'], SEARCH_SECTION.value, limit=5
+        )
+
+    return {
+        f"search_specific@{scale}": measure(specific, calls=queries),
+        f"search_specific_server_side@{scale}": measure(specific_server_side, calls=queries),
+        f"search_specific_color@{scale}": measure(specific_color, calls=queries),
+        f"search_specific_deadline@{scale}": measure(specific_deadline, calls=queries),
+        f"search_specific_all_sections@{scale}": measure(specific_all_sections, calls=queries),
+        f"search_general@{scale}": measure(general, calls=queries),
+    }
+
+
+def bench_update(storage: str, scale: int, records: int, seed: int) -> Dict[str, Dict]:
+    """update.py in both modes, over `records` rows that still lack related ids"""
+    pending = max(1, records // len(ScreenType))
+    results = {}
+    for mode in ('specific', 'general'):
+        calls = 3
+        # Each run consumes its pending rows, so every call (and the memory run) gets a fresh corpus
+        db_services = [build_db_service(storage, scale, seed, pending) for _ in range(calls + 1)]
+
+        async def run(_):
+            ServiceFactory._services.clear()
+            await update.update_related_screens(
+                mode=mode, weight_layout=0.5, weight_color=0.5, limit=5, db_service=db_services.pop()
+            )
+
+        results[f"update_{mode}@{scale}"] = measure(run, calls=calls, items_per_call=pending * len(ScreenType))
+    return results
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Return a line per benchmark that got slower or heavier than the baseline"""
+    regressions = []
+    for name, stats in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        latency_ratio = stats['latency_ms']['p50'] / max(base['latency_ms']['p50'], 1e-9)
+        memory_ratio = stats['peak_memory_mb'] / max(base['peak_memory_mb'], 1e-9)
+        logger.info(f"{name}: p50 x{latency_ratio:.2f}, peak memory x{memory_ratio:.2f}")
+        if latency_ratio > 1 + tolerance:
+            regressions.append(f"{name}: p50 latency {latency_ratio:.2f}x baseline")
+        if memory_ratio > 1 + tolerance:
+            regressions.append(f"{name}: peak memory {memory_ratio:.2f}x baseline")
+    return regressions
+
+
+def main(args) -> int:
+    scales = [int(s) for s in args.scales.split(',')]
+    paths = set(args.paths.split(','))
+    results: Dict[str, Dict] = {}
+
+    if 'similarity' in paths:
+        logger.info("Benchmarking similarity functions")
+        results.update(bench_similarity(args.pairs, args.seed))
+    if 'histogram' in paths:
+        logger.info(f"Benchmarking color histogram on {args.images} screenshots")
+        results.update(bench_histogram(args.images, args.seed))
+    if 'image_prep' in paths:
+        logger.info(f"Benchmarking Gemini image preparation on {args.images} WebP + {args.images} JPEG screenshots")
+        results.update(bench_image_prep(args.images, args.seed))
+    for scale in scales:
+        if 'search' in paths:
+            logger.info(f"Benchmarking search at {scale} rows")
+            results.update(bench_search(args.storage, scale, args.queries, args.seed))
+        if 'update' in paths:
+            logger.info(f"Benchmarking update at {scale} rows")
+            results.update(bench_update(args.storage, scale, args.update_records, args.seed))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": args.seed,
+            "storage": args.storage,
+        },
+        "results": results,
+    }
+
+    for name, stats in results.items():
+        logger.info(
+            f"{name}: p50 {stats['latency_ms']['p50']:.2f} ms, p95 {stats['latency_ms']['p95']:.2f} ms, "
+            f"{stats['throughput_per_s'] or 0:.1f}/s, peak {stats['peak_memory_mb']:.1f} MB"
+        )
+        if 'cpu_ms' in stats:
+            logger.info(
+                f"{name}: cpu {stats['cpu_ms']['mean']:.2f} ms/image, payload {stats['payload_kb']['mean']:.1f} KB mean"
+            )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Wrote results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for line in regressions:
+            logger.error(f"Regression: {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Offline benchmarks over a synthetic corpus')
+    parser.add_argument('--scales', type=str, default='1000,10000',
+                       help='Comma-separated corpus sizes (default: 1000,10000; 100000 is supported but slow)')
+    parser.add_argument('--paths', type=str, default='similarity,histogram,image_prep,search,update',
+                       help='Comma-separated paths to run (default: all)')
+    parser.add_argument('--storage', choices=['standin', 'sqlite'], default='standin',
+                       help='Storage backend: Supabase stand-in or local SQLite (default: standin)')
+    parser.add_argument('--queries', type=int, default=20,
+                       help='Search queries per scale (default: 20)')
+    parser.add_argument('--update-records', type=int, default=11,
+                       help='Rows without related ids per update run (default: 11)')
+    parser.add_argument('--images', type=int, default=40,
+                       help='Synthetic screenshots for the histogram path (default: 40)')
+    parser.add_argument('--pairs', type=int, default=10000,
+                       help='Vector pairs for the similarity micro-benchmarks (default: 10000)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    parser.add_argument('--output', type=str, help='Write machine-readable results to this JSON file')
+    parser.add_argument('--baseline', type=str, help='Compare against a previous results JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                       help='Allowed relative slowdown before flagging a regression (default: 0.2)')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # Keep the per-record progress logs of search.py/update.py out of the timings
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+    sys.exit(main(args))
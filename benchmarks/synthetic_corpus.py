@@ -0,0 +1,159 @@
+import numpy as np
+import cv2
+from typing import Dict, List, Optional
+
+from src.types.screen import ScreenType
+
+LAYOUT_DIM = 1536
+COLOR_BINS = (8, 8, 8)
+COLOR_DIM = COLOR_BINS[0] * COLOR_BINS[1] * COLOR_BINS[2]
+
+LAYOUT_TEMPLATE = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>Screen Analysis</title>
+</head>
+<body>
+    <main>
+        <section data-section-type="{section}">
+{blocks}
+        </section>
+    </main>
+</body>
+</html>'''
+
+BLOCK_TEMPLATE = '''            <div data-position="{position}">
+                <h2>Heading {idx}</h2>
+                <p>Synthetic paragraph {idx} describing the section content.</p>
+                <a href="#">Call to action {idx}</a>
+            </div>'''
+
+
+def generate_layout_embeddings(n: int, rng: np.random.Generator, clusters: int = 32) -> np.ndarray:
+    """Generate unit-norm layout vectors grouped around a few centroids"""
+    centroids = rng.standard_normal((clusters, LAYOUT_DIM)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centroids[labels] + 0.5 * rng.standard_normal((n, LAYOUT_DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def generate_color_histograms(n: int, rng: np.random.Generator, max_colors: int = 12) -> np.ndarray:
+    """Generate sparse 8x8x8 HSV histograms, L2-normalized like cv2.normalize"""
+    hists = np.zeros((n, COLOR_DIM), dtype=np.float32)
+    for row in range(n):
+        num_colors = int(rng.integers(2, max_colors + 1))
+        bins = rng.choice(COLOR_DIM, size=num_colors, replace=False)
+        hists[row, bins] = rng.dirichlet(np.full(num_colors, 0.5)).astype(np.float32)
+    hists /= np.linalg.norm(hists, axis=1, keepdims=True)
+    return hists
+
+
+def generate_layout_html(section: str, rng: np.random.Generator) -> str:
+    """Generate an HTML document shaped like the Gemini layout output"""
+    positions = ['left', 'center', 'right']
+    blocks = [
+        BLOCK_TEMPLATE.format(position=positions[int(rng.integers(0, 3))], idx=idx)
+        for idx in range(int(rng.integers(2, 8)))
+    ]
+    return LAYOUT_TEMPLATE.format(section=section, blocks='\n'.join(blocks))
+
+
+def generate_screenshot(
+    rng: np.random.Generator,
+    width: int = 1440,
+    height: int = 900,
+    quality: int = 80,
+    ext: str = '.webp'
+) -> bytes:
+    """Generate a WebP (or `ext`) screenshot made of flat color bands and boxes"""
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:] = rng.integers(0, 256, size=3, dtype=np.uint8)
+
+    # Horizontal bands emulate stacked page sections
+    y = 0
+    while y < height:
+        band = int(rng.integers(height // 12, height // 3 + 1))
+        img[y:y + band] = rng.integers(0, 256, size=3, dtype=np.uint8)
+        y += band
+
+    # Boxes emulate cards, buttons and images
+    for _ in range(int(rng.integers(5, 20))):
+        x0, y0 = int(rng.integers(0, width - 40)), int(rng.integers(0, height - 20))
+        x1 = min(width, x0 + int(rng.integers(40, width // 3)))
+        y1 = min(height, y0 + int(rng.integers(20, height // 4)))
+        img[y0:y1, x0:x1] = rng.integers(0, 256, size=3, dtype=np.uint8)
+
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if ext in ('.jpg', '.jpeg') else [cv2.IMWRITE_WEBP_QUALITY, quality]
+    ok, buf = cv2.imencode(ext, img, params)
+    if not ok:
+        raise RuntimeError("Failed to encode synthetic screenshot")
+    return buf.tobytes()
+
+
+def generate_screenshots(
+    n: int,
+    rng: np.random.Generator,
+    tall_ratio: float = 0.25,
+    ext: str = '.webp'
+) -> Dict[str, bytes]:
+    """Generate n screenshots keyed by relative img_url, a share of them full-page tall"""
+    images = {}
+    for idx in range(n):
+        height = 4000 if rng.random() < tall_ratio else 900
+        images[f"synthetic{idx % 97}.com/screenshot_{idx}{ext}"] = generate_screenshot(rng, height=height, ext=ext)
+    return images
+
+
+def generate_relative_screen_rows(
+    n: int,
+    seed: int = 0,
+    sections: Optional[List[ScreenType]] = None,
+    pending: int = 0
+) -> List[Dict]:
+    """
+    Generate relative_screen rows with vectors kept as numpy arrays.
+    The first `pending` rows of every section keep screen_related_ids == [].
+    """
+    rng = np.random.default_rng(seed)
+    sections = sections or list(ScreenType)
+    layout = generate_layout_embeddings(n, rng)
+    color = generate_color_histograms(n, rng)
+
+    rows = []
+    per_section = {section: 0 for section in sections}
+    for idx in range(n):
+        section = sections[idx % len(sections)]
+        site = f"synthetic{idx // len(sections)}.com"
+        rows.append({
+            "id": idx + 1,
+            "screen_id": 100000 + idx,
+            "section": section.value,
+            "site_url": site,
+            "img_url": f"{site}/{section.value.replace(' ', '_')}_{idx}.webp",
+            "layout_embedding": layout[idx],
+            "color_embedding": color[idx],
+            "layout_data": generate_layout_html(section.value, rng),
+            "screen_related_ids": [] if per_section[section] < pending else [1, 2, 3, 4, 5],
+        })
+        per_section[section] += 1
+    return rows
+
+
+def generate_screen_analysis_rows(n: int, seed: int = 0, pending: int = 0) -> List[Dict]:
+    """Generate screen_analysis rows for the general-mode RPC, the first `pending` without related ids"""
+    rng = np.random.default_rng(seed + 1)
+    sections = list(ScreenType)
+    embeddings = generate_layout_embeddings(n, rng)
+    return [
+        {
+            "id": idx + 1,
+            "screen_id": 200000 + idx,
+            "section": sections[idx % len(sections)].value,
+            "webp_url": f"synthetic{idx}.com/analysis_{idx}.webp",
+            "embedding": embeddings[idx],
+            "screen_related_ids": [] if idx < pending else [1, 2, 3, 4, 5],
+        }
+        for idx in range(n)
+    ]
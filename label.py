@@ -1,16 +1,21 @@
 import os
 import sys
+import asyncio
 import logging
 from dotenv import load_dotenv
-from supabase import create_client
-from typing import Optional, Union
+from typing import Awaitable, Callable, Optional, Union
 import argparse
 import traceback
 
-from src.services.db_service import DatabaseService
+from src.services.base_db_service import BaseDatabaseService
 from src.services.gemini_service import GeminiService
 from src.services.screen_service import ScreenService
+from src.services.service_factory import ServiceFactory
+from src.services.site_index_service import SiteIndexService
+from src.utils.image_features import FeatureExtractor
 from src.types.screen import ScreenType
+from src.config.storage import storage_configured
+from src.config.rate_limits import MAX_CONCURRENCY
 
 # Configure logging
 logging.basicConfig(
@@ -23,23 +28,89 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 # Configuration
-PUBLIC_SUPABASE_URL = os.getenv('PUBLIC_SUPABASE_URL')
-SUPABASE_SERVICE_ROLE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
-if not all([PUBLIC_SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, GEMINI_API_KEY, OPENAI_API_KEY]):
+if not all([storage_configured(), GEMINI_API_KEY, OPENAI_API_KEY]):
     logger.error("Missing required environment variables. Please check .env file")
     sys.exit(1)
 
-async def process_section(section: str, db_service: DatabaseService, gemini_service: GeminiService, max_items: Optional[int] = None):
+async def process_item(service: ScreenService, db_service: BaseDatabaseService, section: str, item: dict):
+    """Analyze one screenshot and store the result"""
+    try:
+        analysis = await service.analyzeAndStore(
+            img_url=item["img_url"],
+            site_url=item["site_url"]
+        )
+        if analysis:
+            row = await db_service.mark_as_processed(
+                item["screen_id"],
+                {
+                    "section": section,
+                    "site_url": item["site_url"],
+                    "img_url": item["original_img_url"],
+                    "layout_embedding": analysis.layout_embedding,
+                    "color_embedding": analysis.color_embedding,
+                    "color_histogram": analysis.color_histogram,
+                    "layout_data": analysis.layout_data,
+                    "layout_minhash": analysis.layout_minhash,
+                    "image_hash": analysis.image_hash,
+                    "provenance": analysis.provenance
+                }
+            )
+            service.register_image_hash(row['id'], analysis.image_hash, analysis.site_url)
+            if analysis.duplicate_of is not None:
+                logger.info(f"✓ Processed {item['original_img_url']} (layout reused from row {analysis.duplicate_of})")
+            else:
+                logger.info(f"✓ Processed {item['original_img_url']}")
+        else:
+            logger.error(f"✗ Failed to analyze {item['original_img_url']}")
+    except Exception as e:
+        logger.error(f"✗ Error processing {item['original_img_url']}: {str(e)}")
+        logger.debug(traceback.format_exc())
+
+async def process_concurrently(data: list, handle: Callable[[int, dict], Awaitable[None]]):
+    """
+    Run handle(idx, item) for every item with up to MAX_CONCURRENCY in flight.
+    The Gemini/OpenAI schedulers decide how many API calls actually run at once.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    async def worker(idx: int, item: dict):
+        async with semaphore:
+            await handle(idx, item)
+
+    await asyncio.gather(*(worker(idx, item) for idx, item in enumerate(data, 1)))
+
+async def refresh_site_index(site_index: Optional[SiteIndexService], data: list):
+    """Rebuild the site vectors of the sites whose sections were just labeled"""
+    if site_index is None or not data:
+        return
+    try:
+        count = await site_index.refresh_sites(item["site_url"] for item in data)
+        logger.info(f"Updated {count} site vectors")
+    except Exception as e:
+        # Labeled rows are stored either way; scripts/build_site_index.py catches up
+        logger.warning(f"Site index not updated: {str(e)}")
+
+async def process_section(
+    section: str,
+    db_service: BaseDatabaseService,
+    gemini_service: GeminiService,
+    max_items: Optional[int] = None,
+    dedupe_distance: Optional[int] = None,
+    feature_extractor: Optional[FeatureExtractor] = None,
+    site_index: Optional[SiteIndexService] = None
+):
     """Process a single section"""
     try:
         # Initialize screen service directly
         service = ScreenService(
             section=section,  # Pass section as string directly
             gemini_service=gemini_service,
-            db_service=db_service
+            db_service=db_service,
+            duplicate_max_distance=dedupe_distance,
+            feature_extractor=feature_extractor
         )
 
         # Get unprocessed screenshots
@@ -52,39 +123,30 @@ async def process_section(section: str, db_service: DatabaseService, gemini_serv
         logger.info(f"Found {len(data)} unprocessed screenshots for section: {section}")
         
         # Process screenshots
-        for idx, item in enumerate(data, 1):
-            try:
-                logger.info(f"Processing {idx}/{len(data)}: {item['img_url']}")
-                analysis = await service.analyzeAndStore(
-                    img_url=item["img_url"],
-                    site_url=item["site_url"]
-                )
-                if analysis:
-                    await db_service.mark_as_processed(
-                        item["screen_id"],
-                        {
-                            "section": section,
-                            "site_url": item["site_url"],
-                            "img_url": item["original_img_url"],
-                            "layout_embedding": analysis.layout_embedding,
-                            "color_embedding": analysis.color_embedding,
-                            "layout_data": analysis.layout_data
-                        }
-                    )
-                    logger.info(f"✓ Processed {item['original_img_url']}")
-                else:
-                    logger.error(f"✗ Failed to analyze {item['original_img_url']}")
-            except Exception as e:
-                logger.error(f"✗ Error processing {item['original_img_url']}: {str(e)}")
-                logger.debug(traceback.format_exc())
+        async def handle(idx: int, item: dict):
+            logger.info(f"Processing {idx}/{len(data)}: {item['img_url']}")
+            await process_item(service, db_service, section, item)
+
+        await process_concurrently(data, handle)
+        await refresh_site_index(site_index, data)
 
     except Exception as e:
         logger.error(f"Error processing section {section}: {str(e)}")
         logger.debug(traceback.format_exc())
 
-async def process_unprocessed_screens(db_service: DatabaseService, gemini_service: GeminiService, max_items: Optional[int] = None):
+async def process_unprocessed_screens(
+    db_service: BaseDatabaseService,
+    gemini_service: GeminiService,
+    max_items: Optional[int] = None,
+    dedupe_distance: Optional[int] = None,
+    feature_extractor: Optional[FeatureExtractor] = None,
+    site_index: Optional[SiteIndexService] = None
+):
     """Process all unprocessed screens regardless of section"""
     try:
+        # One service per section, so its duplicate index is built once
+        services = {}
+
         # Get all unprocessed screenshots without filtering by section
         data = await db_service.get_all_unprocessed_screenshots(max_items)
         
@@ -95,51 +157,54 @@ async def process_unprocessed_screens(db_service: DatabaseService, gemini_servic
         logger.info(f"Found {len(data)} unprocessed screenshots")
         
         # Process screenshots
-        for idx, item in enumerate(data, 1):
-            try:
-                section = item["section"]
-                logger.info(f"Processing {idx}/{len(data)}: {item['img_url']} (Section: {section})")
-                
-                service = ScreenService(
+        async def handle(idx: int, item: dict):
+            section = item["section"]
+            logger.info(f"Processing {idx}/{len(data)}: {item['img_url']} (Section: {section})")
+            
+            if section not in services:
+                services[section] = ScreenService(
                     section=section,
                     gemini_service=gemini_service,
-                    db_service=db_service
-                )
-                
-                analysis = await service.analyzeAndStore(
-                    img_url=item["img_url"],
-                    site_url=item["site_url"]
+                    db_service=db_service,
+                    duplicate_max_distance=dedupe_distance,
+                    feature_extractor=feature_extractor
                 )
-                if analysis:
-                    await db_service.mark_as_processed(
-                        item["screen_id"],
-                        {
-                            "section": section,
-                            "site_url": item["site_url"],
-                            "img_url": item["original_img_url"],
-                            "layout_embedding": analysis.layout_embedding,
-                            "color_embedding": analysis.color_embedding,
-                            "layout_data": analysis.layout_data
-                        }
-                    )
-                    logger.info(f"✓ Processed {item['original_img_url']}")
-                else:
-                    logger.error(f"✗ Failed to analyze {item['original_img_url']}")
-            except Exception as e:
-                logger.error(f"✗ Error processing {item['original_img_url']}: {str(e)}")
-                logger.debug(traceback.format_exc())
+            await process_item(services[section], db_service, section, item)
+
+        await process_concurrently(data, handle)
+        await refresh_site_index(site_index, data)
 
     except Exception as e:
         logger.error(f"Error processing unprocessed screens: {str(e)}")
         logger.debug(traceback.format_exc())
 
-async def main(section: str, max_items: Union[int, str] = 5):
+async def main(
+    section: str,
+    max_items: Union[int, str] = 5,
+    passthrough_max_kb: int = 0,
+    dedupe_distance: Optional[int] = None,
+    feature_workers: Optional[int] = None,
+    gemini_batch_size: int = 1,
+    gemini_stream: bool = True,
+    gemini_deadline: Optional[float] = 120,
+    update_site_index: bool = True
+):
     """Main execution function"""
     try:
-        # Initialize clients and services
-        supabase = create_client(PUBLIC_SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-        db_service = DatabaseService(supabase)
-        gemini_service = GeminiService(GEMINI_API_KEY)
+        # "all" means no limit
+        max_items = None if str(max_items).lower() == 'all' else int(max_items)
+
+        # Initialize services
+        db_service = ServiceFactory.create_db_service()
+        gemini_service = GeminiService(
+            GEMINI_API_KEY,
+            passthrough_max_bytes=passthrough_max_kb * 1024,
+            batch_size=gemini_batch_size,
+            stream=gemini_stream,
+            deadline=gemini_deadline or None
+        )
+        feature_extractor = FeatureExtractor(feature_workers)
+        site_index = SiteIndexService(db_service) if update_site_index else None
 
         # Create table if needed
         if not db_service.create_screen_section_analysis_table():
@@ -150,7 +215,10 @@ async def main(section: str, max_items: Union[int, str] = 5):
             await process_unprocessed_screens(
                 db_service,
                 gemini_service,
-                max_items
+                max_items,
+                dedupe_distance,
+                feature_extractor,
+                site_index
             )
         else:
             # Process specific section
@@ -158,7 +226,10 @@ async def main(section: str, max_items: Union[int, str] = 5):
                 section,
                 db_service,
                 gemini_service,
-                max_items
+                max_items,
+                dedupe_distance,
+                feature_extractor,
+                site_index
             )
 
     except Exception as e:
@@ -172,9 +243,36 @@ def parse_args():
                        help='Section type to process (any section name or "all")')
     parser.add_argument('--max-items', type=str, default='all',
                        help='Maximum number of screenshots to analyze (default: all)')
+    parser.add_argument('--passthrough-max-kb', type=int, default=0,
+                       help='Send source images up to this size unchanged (default: 0, disabled)')
+    parser.add_argument('--dedupe', action='store_true',
+                       help='Reuse the layout of a labeled screenshot of the same site instead of calling Gemini and OpenAI '
+                            'when their perceptual hashes are within --dedupe-distance (default: off)')
+    parser.add_argument('--dedupe-distance', type=int, default=4,
+                       help='Maximum Hamming distance of a near-duplicate with --dedupe (default: 4)')
+    parser.add_argument('--feature-workers', type=int,
+                       help='Processes decoding screenshots for the histogram, hash and Gemini payload '
+                            '(default: $FEATURE_WORKERS or CPU count; 0 decodes on a thread)')
+    parser.add_argument('--gemini-batch-size', type=int, default=1,
+                       help='Screenshots of a section sent to Gemini in one request (default: 1, no batching)')
+    parser.add_argument('--gemini-deadline', type=float, default=120,
+                       help='Seconds allowed per Gemini call before the screenshot counts as failed (default: 120, 0 disables)')
+    parser.add_argument('--no-stream', action='store_true',
+                       help='Wait for complete Gemini answers instead of stopping the stream at </html>')
+    parser.add_argument('--no-site-index', action='store_true',
+                       help='Do not refresh the site vectors of labeled sites (scripts/build_site_index.py)')
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = parse_args()
-    import asyncio
-    asyncio.run(main(section=args.section, max_items=args.max_items)) 
\ No newline at end of file
+    asyncio.run(main(
+        section=args.section,
+        max_items=args.max_items,
+        passthrough_max_kb=args.passthrough_max_kb,
+        dedupe_distance=args.dedupe_distance if args.dedupe else None,
+        feature_workers=args.feature_workers,
+        gemini_batch_size=args.gemini_batch_size,
+        gemini_stream=not args.no_stream,
+        gemini_deadline=args.gemini_deadline,
+        update_site_index=not args.no_site_index
+    )) 
\ No newline at end of file
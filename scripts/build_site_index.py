@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import logging
+from dotenv import load_dotenv
+import asyncio
+import argparse
+
+# Add parent directory to path to import from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.service_factory import ServiceFactory
+from src.services.site_index_service import SiteIndexService
+from src.config.storage import storage_configured
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+if not storage_configured():
+    logger.error("Missing required environment variables")
+    sys.exit(1)
+
+async def main(args):
+    try:
+        db_service = ServiceFactory.create_db_service()
+        # Configured by the SITE_* environment variables, shared with label.py and search.py
+        site_index = SiteIndexService(db_service)
+        builder = site_index.builder
+        logger.info(f"Site vectors: {builder.dims} dimensions ({builder.config})")
+
+        start = time.perf_counter()
+        if args.sites:
+            count = await site_index.refresh_sites(args.sites.split(','))
+        else:
+            count = await site_index.rebuild(page_size=args.page_size)
+        logger.info(f"Stored {count} site vectors in {time.perf_counter() - start:.1f}s")
+
+    except Exception as e:
+        logger.error(f"Error building site index: {str(e)}")
+        sys.exit(1)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Build the site-level aggregate index used by search.py --mode sites')
+    parser.add_argument('--sites', type=str,
+                       help='Comma-separated site URLs to refresh (default: every site)')
+    parser.add_argument('--page-size', type=int, default=1000,
+                       help='Rows read per request while listing sites (default: 1000)')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,102 @@
+import os
+import sys
+import logging
+from dotenv import load_dotenv
+import asyncio
+from typing import Optional, Union
+import argparse
+
+# Add parent directory to path to import from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils.embeddings import EmbeddingProcessor
+from src.utils.layout_canonical import canonicalize_layout, canonical_hash
+from src.utils.layout_fingerprint import get_layout_minhash
+from src.utils.provenance import build_provenance, current_config
+from src.utils.rate_limiter import estimate_tokens
+from src.services.service_factory import ServiceFactory
+from src.config.storage import storage_configured
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+if not storage_configured():
+    logger.error("Missing required environment variables")
+    sys.exit(1)
+
+async def canonicalize_layouts(max_items: Union[int, str] = 'all', section: Optional[str] = None, dry_run: bool = False):
+    """Rewrite stored layout_data in canonical form and re-embed it, without calling Gemini"""
+    try:
+        db_service = ServiceFactory.create_db_service()
+        embedding_processor = EmbeddingProcessor()
+
+        limit = None if max_items == 'all' else int(max_items)
+        # Rows whose embedding predates the current canonicalization (or without provenance)
+        records = await db_service.get_stale_analyses(
+            'layout_embedding', current_config('layout_embedding', None), section=section,
+            columns='id, img_url, section, layout_data, provenance', limit=limit
+        )
+        records = [record for record in records if record.get('layout_data')]
+        if not records:
+            logger.info("No records found to update")
+            return
+
+        logger.info(f"Found {len(records)} records to update")
+        raw_tokens = canonical_tokens = 0
+        for idx, record in enumerate(records, 1):
+            try:
+                layout_data = canonicalize_layout(record['layout_data'])
+                raw_tokens += estimate_tokens(record['layout_data'])
+                canonical_tokens += estimate_tokens(embedding_processor.layout_input(layout_data))
+                if dry_run:
+                    continue
+
+                # Identical canonical documents are embedded once (EmbeddingProcessor cache)
+                layout_embedding = await embedding_processor.get_layout_embedding(layout_data)
+                provenance = build_provenance(
+                    record['section'], ['layout_embedding', 'layout_minhash'], base=record.get('provenance')
+                )
+                provenance['layout_data'] = dict(provenance.get('layout_data') or {},
+                                                 canonical_sha256=canonical_hash(layout_data))
+                await db_service.update_layout_data(
+                    record['id'],
+                    layout_data,
+                    layout_embedding,
+                    get_layout_minhash(layout_data),
+                    provenance
+                )
+                logger.info(f"Updated {idx}/{len(records)}: {record['img_url']}")
+
+            except Exception as e:
+                logger.error(f"Error processing record {record['id']}: {str(e)}")
+                continue
+
+        logger.info(
+            f"Embedding input: {raw_tokens} -> {canonical_tokens} estimated tokens "
+            f"({100 * (1 - canonical_tokens / max(raw_tokens, 1)):.0f}% fewer)"
+        )
+
+    except Exception as e:
+        logger.error(f"Error canonicalizing layouts: {str(e)}")
+        sys.exit(1)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Canonicalize stored layout HTML and refresh its embeddings')
+    parser.add_argument('--max-items', type=str, default='all',
+                       help='Maximum number of records to update (default: all)')
+    parser.add_argument('--section', type=str,
+                       help='Only this section (default: every section)')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Only report the token savings')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(canonicalize_layouts(max_items=args.max_items, section=args.section, dry_run=args.dry_run))
@@ -0,0 +1,150 @@
+import os
+import sys
+import time
+import random
+import logging
+from dotenv import load_dotenv
+import asyncio
+import argparse
+
+# Add parent directory to path to import from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.base_db_service import BaseDatabaseService
+from src.services.service_factory import ServiceFactory
+from src.config.storage import LAYOUT_COMPRESSION, storage_configured
+from src.utils.layout_codec import DEFAULT_DICT_SIZE, LayoutCodec, train_layout_dictionary
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+if not storage_configured():
+    logger.error("Missing required environment variables")
+    sys.exit(1)
+
+COLUMNS = 'id, layout_data, layout_zstd'
+
+async def iter_layout_pages(db_service: BaseDatabaseService, page_size: int):
+    """Raw relative_screen pages (layouts as stored, nothing decompressed)"""
+    after_id = 0
+    while True:
+        page = await db_service.get_rows_page('relative_screen', after_id=after_id, limit=page_size, columns=COLUMNS)
+        if not page:
+            return
+        yield page
+        after_id = page[-1]['id']
+
+async def train(db_service: BaseDatabaseService, samples: int, dict_size: int, page_size: int):
+    """Train a dictionary on a random sample of stored layouts and make it the active one"""
+    codec = await db_service.get_layout_codec()
+    # Reservoir sample over every row, compressed ones included
+    reservoir, seen = [], 0
+    async for page in iter_layout_pages(db_service, page_size):
+        for row in page:
+            html = row['layout_data'] or (codec.decompress(row['layout_zstd']) if row.get('layout_zstd') else None)
+            if not html:
+                continue
+            seen += 1
+            if len(reservoir) < samples:
+                reservoir.append(html)
+            elif random.randrange(seen) < samples:
+                reservoir[random.randrange(samples)] = html
+    if not reservoir:
+        logger.error("No layouts to train on")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    dict_id, dictionary = train_layout_dictionary(reservoir, dict_size)
+    await db_service.store_layout_dictionary(dict_id, dictionary)
+    logger.info(f"Trained dictionary {dict_id} on {len(reservoir)}/{seen} layouts in {time.perf_counter() - start:.1f}s")
+
+async def convert(db_service: BaseDatabaseService, decompress: bool, recompress: bool, dry_run: bool, page_size: int):
+    """Move layouts between plain layout_data and layout_zstd frames"""
+    codec = await db_service.get_layout_codec(refresh=True)
+    if not decompress and codec.active_id is None:
+        logger.error("No layout dictionary yet; run with --train first")
+        sys.exit(1)
+
+    converted = plain_bytes = stored_bytes = 0
+    async for page in iter_layout_pages(db_service, page_size):
+        for row in page:
+            blob = row.get('layout_zstd')
+            try:
+                if decompress:
+                    if not blob or row['layout_data'] is not None:
+                        continue
+                    html = codec.decompress(blob)
+                    if not dry_run:
+                        await db_service.update_layout_storage(row['id'], html, None)
+                else:
+                    if blob and row['layout_data'] is None:
+                        if not recompress or codec.frame_dictionary(blob) == codec.active_id:
+                            continue
+                        html = codec.decompress(blob)
+                    elif row['layout_data']:
+                        html = row['layout_data']
+                    else:
+                        continue
+                    blob = codec.compress(html)
+                    # Never drop the plain HTML unless the frame reads back identically
+                    if codec.decompress(blob) != html:
+                        raise ValueError("Round trip mismatch")
+                    if not dry_run:
+                        await db_service.update_layout_storage(row['id'], None, blob)
+                converted += 1
+                plain_bytes += len(html.encode('utf-8'))
+                stored_bytes += len(blob)
+
+            except Exception as e:
+                logger.error(f"Error converting record {row['id']}: {str(e)}")
+                continue
+        logger.info(f"{converted} layouts {'to convert' if dry_run else 'converted'} so far (up to id {page[-1]['id']})")
+
+    if converted:
+        logger.info(
+            f"{converted} layouts: {plain_bytes / 1e6:.2f} MB plain, {stored_bytes / 1e6:.2f} MB compressed "
+            f"({plain_bytes / max(stored_bytes, 1):.1f}x)"
+        )
+
+async def main(args):
+    try:
+        if LAYOUT_COMPRESSION != 'zstd':
+            # Readers only fetch layout_zstd when compression is on
+            logger.error("Set LAYOUT_COMPRESSION=zstd (and keep it set for every reader) before converting layouts")
+            sys.exit(1)
+        db_service = ServiceFactory.create_db_service()
+        if args.train:
+            await train(db_service, args.samples, args.dict_size, args.page_size)
+        await convert(db_service, args.decompress, args.recompress, args.dry_run, args.page_size)
+
+    except Exception as e:
+        logger.error(f"Error compressing layouts: {str(e)}")
+        sys.exit(1)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Convert stored layout HTML to (or from) dictionary-compressed zstd frames')
+    parser.add_argument('--train', action='store_true',
+                       help='Train a new dictionary on the stored layouts first (it becomes the active one)')
+    parser.add_argument('--samples', type=int, default=2000,
+                       help='Layouts sampled for training (default: 2000)')
+    parser.add_argument('--dict-size', type=int, default=DEFAULT_DICT_SIZE,
+                       help=f'Dictionary size in bytes (default: {DEFAULT_DICT_SIZE})')
+    parser.add_argument('--recompress', action='store_true',
+                       help='Also rewrite frames compressed with an older dictionary')
+    parser.add_argument('--decompress', action='store_true',
+                       help='Restore plain layout_data for every compressed row')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Report sizes without writing')
+    parser.add_argument('--page-size', type=int, default=500,
+                       help='Rows read per request (default: 500)')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import logging
+from dotenv import load_dotenv
+import asyncio
+from typing import Dict, List, Optional
+import argparse
+
+# Add parent directory to path to import from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.base_db_service import BaseDatabaseService
+from src.services.service_factory import ServiceFactory
+from src.config.storage import storage_configured
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+try:
+    from src.utils.corpus_archive import ARCHIVE_TABLES, FORMATS, ArchiveWriter, iter_archive_rows
+except ImportError:
+    logger.error("Archives need pyarrow (pip install pyarrow)")
+    sys.exit(1)
+
+# Load environment variables
+load_dotenv()
+
+if not storage_configured():
+    logger.error("Missing required environment variables")
+    sys.exit(1)
+
+# Tables whose ids may be reassigned on import; screens keep theirs because screen_id points at them
+REASSIGNABLE_IDS = ('relative_screen', 'screen_analysis')
+
+async def read_page(db_service: BaseDatabaseService, table: str, after_id: int, page_size: int) -> List[Dict]:
+    page = await db_service.get_rows_page(table, after_id=after_id, limit=page_size)
+    if table == 'relative_screen':
+        # Archives carry plain layout_data, so they do not depend on the layout dictionaries
+        page = await db_service.unpack_layouts(page)
+    return page
+
+async def export_table(db_service: BaseDatabaseService, table: str, out_dir: str, fmt: str,
+                       page_size: int, sections: Optional[List[str]] = None) -> int:
+    """Page through a table by id and stream it into per-section files"""
+    page = await read_page(db_service, table, 0, page_size)
+    if not page:
+        logger.info(f"{table}: empty, skipped")
+        return 0
+
+    start = time.perf_counter()
+    extra_columns = [column for column in page[0] if column not in ARCHIVE_TABLES[table]]
+    if extra_columns:
+        logger.info(f"{table}: exporting unknown columns as JSON: {', '.join(extra_columns)}")
+
+    with ArchiveWriter(out_dir, table, fmt, row_group_size=page_size, extra_columns=extra_columns) as writer:
+        while page:
+            after_id = page[-1]['id']
+            if sections is not None:
+                page = [row for row in page if row.get('section') in sections]
+            writer.write_rows(page)
+            page = await read_page(db_service, table, after_id, page_size)
+
+    total = sum(writer.row_counts.values())
+    for section, count in sorted(writer.row_counts.items(), key=lambda item: str(item[0])):
+        logger.info(f"  {table} / {section}: {count} rows")
+    logger.info(f"{table}: exported {total} rows in {time.perf_counter() - start:.1f}s")
+    return total
+
+async def import_table(db_service: BaseDatabaseService, table: str, src_dir: str, batch_size: int,
+                       sections: Optional[List[str]] = None, new_ids: bool = False) -> int:
+    """Stream a table's partition files back into the database in batches"""
+    start = time.perf_counter()
+    total = 0
+    drop_ids = new_ids and table in REASSIGNABLE_IDS
+    for section, rows in iter_archive_rows(src_dir, table, batch_size, sections):
+        if drop_ids:
+            for row in rows:
+                row.pop('id', None)
+        total += await db_service.insert_rows(table, rows, upsert=not drop_ids)
+        logger.info(f"  {table} / {section}: {total} rows written")
+    logger.info(f"{table}: imported {total} rows in {time.perf_counter() - start:.1f}s")
+    return total
+
+async def main(args):
+    try:
+        db_service = ServiceFactory.create_db_service()
+        tables = args.tables.split(',')
+        unknown = [table for table in tables if table not in ARCHIVE_TABLES]
+        if unknown:
+            logger.error(f"Unknown tables: {', '.join(unknown)}")
+            sys.exit(1)
+        sections = args.sections.split(',') if args.sections else None
+
+        if args.command == 'export':
+            for table in tables:
+                await export_table(db_service, table, args.path, args.format, args.batch_size, sections)
+        else:
+            # Archive table order puts screens first, so screen_id references resolve
+            for table in [table for table in ARCHIVE_TABLES if table in tables]:
+                await import_table(db_service, table, args.path, args.batch_size, sections, args.new_ids)
+
+    except Exception as e:
+        logger.error(f"Error in {args.command}: {str(e)}")
+        sys.exit(1)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Export the labeled corpus to Parquet/Arrow files or import it back')
+    parser.add_argument('command', choices=['export', 'import'],
+                       help='export: database -> archive directory; import: archive directory -> database')
+    parser.add_argument('path', help='Archive directory (<path>/<table>/section=<section>/part-0.<ext>)')
+    parser.add_argument('--tables', default=','.join(ARCHIVE_TABLES),
+                       help=f"Comma-separated tables (default: {','.join(ARCHIVE_TABLES)})")
+    parser.add_argument('--sections', type=str,
+                       help='Comma-separated sections to export/import (default: all)')
+    parser.add_argument('--format', choices=list(FORMATS), default='parquet',
+                       help='Export file format: Parquet (zstd) or Arrow IPC (default: parquet)')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                       help='Rows per page, row group and insert batch (default: 1000)')
+    parser.add_argument('--new-ids', action='store_true',
+                       help='Let the database assign relative_screen/screen_analysis ids instead of upserting by id')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,186 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+from dotenv import load_dotenv
+import asyncio
+from typing import Dict, List, Optional
+import argparse
+import numpy as np
+
+# Add parent directory to path to import from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.base_db_service import BaseDatabaseService
+from src.services.service_factory import ServiceFactory
+from src.config import storage
+from src.config.storage import storage_configured
+from src.utils.vector_index import (
+    VECTOR_INDEXES,
+    recommend_index,
+    rebuild_statements,
+    exact_top_k,
+    recall_at_k,
+)
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+if not storage_configured():
+    logger.error("Missing required environment variables")
+    sys.exit(1)
+
+def _parse_vector(value) -> List[float]:
+    return json.loads(value) if isinstance(value, str) else value
+
+async def inspect_indexes(db_service: BaseDatabaseService, method: str, top_k: int) -> List[Dict]:
+    """Log row counts, current indexes and the recommended index per embedding column"""
+    stats = await db_service.get_vector_index_stats()
+    for stat in stats:
+        plan = recommend_index(stat['row_count'], method, top_k)
+        current = stat.get('index_definition') or 'no index (exact scan)'
+        logger.info(f"{stat['table_name']}.{stat['column_name']}: {stat['row_count']} rows")
+        logger.info(f"  current:     {current}")
+        if stat.get('probes') or stat.get('ef_search'):
+            logger.info(f"  query-time:  probes={stat.get('probes')} ef_search={stat.get('ef_search')}")
+        logger.info(f"  recommended: {plan}")
+        stat['plan'] = plan
+    return stats
+
+def rebuild_indexes(stats: List[Dict], dsn: Optional[str], iterative_scan: Optional[str] = None):
+    """Rebuild every index concurrently through a direct connection, or print the SQL"""
+    statements = []
+    for stat in stats:
+        table, column = stat['table_name'], stat['column_name']
+        statements += rebuild_statements(table, column, stat['plan'], VECTOR_INDEXES[(table, column)])
+        if iterative_scan and stat['plan']['method'] != 'none':
+            statements.append(
+                f"update vector_index_settings set iterative_scan = '{iterative_scan}' "
+                f"where table_name = '{table}' and column_name = '{column}'"
+            )
+
+    if not dsn:
+        # PostgREST cannot run DDL; hand the statements to psql
+        logger.info("No --dsn given; run these statements with psql (outside a transaction):")
+        for statement in statements:
+            print(f"{statement};")
+        return
+
+    try:
+        import psycopg
+    except ImportError:
+        logger.error("Rebuilding needs psycopg (pip install 'psycopg[binary]') or run without --dsn to print the SQL")
+        sys.exit(1)
+
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute("set maintenance_work_mem = '512MB'")
+        for statement in statements:
+            start = time.perf_counter()
+            conn.execute(statement)
+            logger.info(f"{time.perf_counter() - start:.1f}s  {statement}")
+
+def _summary(recalls: List[float], latencies: List[float]) -> str:
+    latencies_ms = np.asarray(latencies) * 1000
+    return (
+        f"recall@k mean {np.mean(recalls):.3f} min {np.min(recalls):.3f}, "
+        f"latency p50 {np.percentile(latencies_ms, 50):.1f} ms p95 {np.percentile(latencies_ms, 95):.1f} ms"
+    )
+
+async def report(db_service: BaseDatabaseService, queries: int, top_k: int, seed: int):
+    """Recall against an exact scan and latency of both RPCs on sampled queries"""
+    rng = random.Random(seed)
+
+    # General mode: match_screen_embeddings over screen_analysis
+    rows = [row for row in await db_service.get_screen_analyses(columns='screen_id, section, embedding') if row.get('embedding')]
+    if rows:
+        recalls, latencies = [], []
+        by_section: Dict[str, List[Dict]] = {}
+        for row in rows:
+            row['embedding'] = _parse_vector(row['embedding'])
+            by_section.setdefault(row['section'], []).append(row)
+        for row in rng.sample(rows, min(queries, len(rows))):
+            section_rows = by_section[row['section']]
+            expected = exact_top_k(
+                row['embedding'],
+                [r['screen_id'] for r in section_rows],
+                np.array([r['embedding'] for r in section_rows]),
+                top_k
+            )
+            start = time.perf_counter()
+            matches = await db_service.match_screen_embeddings(row['embedding'], row['section'], -1.0, top_k)
+            latencies.append(time.perf_counter() - start)
+            recalls.append(recall_at_k(expected, [m['screen_id'] for m in matches], top_k))
+        logger.info(f"screen_analysis.embedding ({len(recalls)} queries): {_summary(recalls, latencies)}")
+
+    # Specific mode: layout candidates of match_relative_screens
+    rows = [row for row in await db_service.get_analyses(columns='id, section, layout_embedding') if row.get('layout_embedding')]
+    if rows:
+        recalls, latencies = [], []
+        by_section = {}
+        for row in rows:
+            row['layout_embedding'] = _parse_vector(row['layout_embedding'])
+            by_section.setdefault(row['section'], []).append(row)
+        for row in rng.sample(rows, min(queries, len(rows))):
+            section_rows = [r for r in by_section[row['section']] if r['id'] != row['id']]
+            expected = exact_top_k(
+                row['layout_embedding'],
+                [r['id'] for r in section_rows],
+                np.array([r['layout_embedding'] for r in section_rows]),
+                top_k
+            )
+            start = time.perf_counter()
+            matches = await db_service.match_relative_screens(
+                query_layout=row['layout_embedding'],
+                query_color=None,
+                section_type=row['section'],
+                match_count=top_k,
+                candidate_count=top_k,
+                exclude_id=row['id']
+            )
+            latencies.append(time.perf_counter() - start)
+            recalls.append(recall_at_k(expected, [m['id'] for m in matches], top_k))
+        logger.info(f"relative_screen.layout_embedding ({len(recalls)} queries): {_summary(recalls, latencies)}")
+
+async def main(args):
+    db_service = ServiceFactory.create_db_service()
+    stats = await inspect_indexes(db_service, args.method, args.top_k)
+    if args.command == 'rebuild':
+        if storage.STORAGE_BACKEND == 'sqlite':
+            logger.info("The sqlite backend always scans exactly; nothing to rebuild")
+            return
+        rebuild_indexes(stats, args.dsn, args.iterative_scan)
+    # After a rebuild, measure the new indexes right away
+    if args.command == 'report' or (args.command == 'rebuild' and args.dsn):
+        await report(db_service, args.queries, args.top_k, args.seed)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Inspect, rebuild and evaluate the pgvector indexes')
+    parser.add_argument('command', choices=['inspect', 'rebuild', 'report'],
+                       help='inspect: row counts and recommended parameters; '
+                            'rebuild: rebuild concurrently (or print the SQL without --dsn); '
+                            'report: recall and latency of the RPCs on sampled queries')
+    parser.add_argument('--method', choices=['ivfflat', 'hnsw'], default='ivfflat',
+                       help='Index type to recommend and build (default: ivfflat)')
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'),
+                       help='Postgres connection string for the rebuild (default: $DATABASE_URL)')
+    parser.add_argument('--iterative-scan', choices=['relaxed_order', 'strict_order'],
+                       help='pgvector >= 0.8: keep scanning until section filters are satisfied')
+    parser.add_argument('--queries', type=int, default=50,
+                       help='Sampled queries for the report (default: 50)')
+    parser.add_argument('--top-k', type=int, default=10,
+                       help='Neighbours compared for recall (default: 10)')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,125 @@
+import os
+import sys
+import logging
+from dotenv import load_dotenv
+import asyncio
+from typing import List, Optional
+import argparse
+
+# Add parent directory to path to import from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.base_db_service import BaseDatabaseService
+from src.services.gemini_service import GeminiService
+from src.services.screen_service import ScreenService
+from src.services.service_factory import ServiceFactory
+from src.config.storage import storage_configured
+from src.types.screen import ScreenType
+from src.utils.color_histogram import download_image_bytes
+from src.utils.provenance import content_hash, current_config, is_stale
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+
+if not all([storage_configured(), GEMINI_API_KEY, OPENAI_API_KEY]):
+    logger.error("Missing required environment variables")
+    sys.exit(1)
+
+COLUMNS = 'id, img_url, site_url, section, provenance'
+
+async def find_stale_layouts(
+    db_service: BaseDatabaseService,
+    section: ScreenType,
+    max_items: Optional[int] = None,
+    check_source: bool = False
+) -> List[dict]:
+    """Rows of a section labeled with another Gemini model or prompt (or, with check_source, another image)"""
+    if not check_source:
+        return await db_service.get_stale_analyses(
+            'layout_data', current_config('layout_data', section), section=section, columns=COLUMNS, limit=max_items
+        )
+
+    stale = []
+    for row in await db_service.get_all_rows('relative_screen', columns=COLUMNS, section=section.value):
+        # Hashing the download is far cheaper than a Gemini call
+        data = await asyncio.to_thread(download_image_bytes, db_service.get_storage_url(row['img_url']))
+        if is_stale(row.get('provenance'), 'layout_data', section, content_hash(data)):
+            stale.append(row)
+            if max_items and len(stale) >= max_items:
+                break
+    return stale
+
+async def relabel_section(
+    db_service: BaseDatabaseService,
+    gemini_service: GeminiService,
+    section: ScreenType,
+    max_items: Optional[int] = None,
+    check_source: bool = False,
+    dry_run: bool = False
+):
+    """Re-run Gemini and every derived feature for the stale rows of a section"""
+    rows = await find_stale_layouts(db_service, section, max_items, check_source)
+    if not rows:
+        logger.info(f"{section.value}: nothing stale")
+        return
+    logger.info(f"{section.value}: {len(rows)} stale layouts")
+    if dry_run:
+        return
+
+    service = ScreenService(section, gemini_service=gemini_service, db_service=db_service)
+    for idx, row in enumerate(rows, 1):
+        try:
+            analysis = await service.analyze_new(db_service.get_storage_url(row['img_url']), row['site_url'])
+            await db_service.update_color_embedding(row['id'], analysis.color_embedding, analysis.color_histogram)
+            # Every feature was recomputed, so the new provenance replaces the old one
+            await db_service.update_layout_data(
+                row['id'],
+                analysis.layout_data,
+                analysis.layout_embedding,
+                analysis.layout_minhash,
+                analysis.provenance
+            )
+            logger.info(f"✓ Relabeled {idx}/{len(rows)}: {row['img_url']}")
+
+        except Exception as e:
+            logger.error(f"✗ Error relabeling {row['img_url']}: {str(e)}")
+            continue
+
+async def main(args):
+    try:
+        db_service = ServiceFactory.create_db_service()
+        gemini_service = GeminiService(GEMINI_API_KEY)
+        sections = [args.section] if args.section else list(ScreenType)
+        for section in sections:
+            await relabel_section(db_service, gemini_service, section, args.max_items, args.check_source, args.dry_run)
+
+    except Exception as e:
+        logger.error(f"Error relabeling stale layouts: {str(e)}")
+        sys.exit(1)
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Re-run Gemini for rows labeled with another GEMINI_MODEL or prompt'
+    )
+    parser.add_argument('--section', type=ScreenType,
+                       help='Only this section (default: all sections)')
+    parser.add_argument('--max-items', type=int,
+                       help='Maximum number of rows per section (optional)')
+    parser.add_argument('--check-source', action='store_true',
+                       help='Also relabel rows whose screenshot bytes changed (downloads every row)')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Only count stale rows per section')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
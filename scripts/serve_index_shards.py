@@ -0,0 +1,52 @@
+import os
+import sys
+import logging
+from dotenv import load_dotenv
+import argparse
+from multiprocessing.connection import Listener
+
+# Add parent directory to path to import from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.service_factory import ServiceFactory
+from src.services.shard_service import parse_address, serve_shards, shard_authkey
+from src.config.storage import storage_configured
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+if not storage_configured():
+    logger.error("Missing required environment variables")
+    sys.exit(1)
+
+def main(args):
+    """Serve index shards to one coordinator at a time (search.py --shard-hosts)"""
+    try:
+        authkey = shard_authkey()
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    with Listener(parse_address(args.listen), authkey=authkey) as listener:
+        logger.info(f"Serving index shards on {args.listen}")
+        while True:
+            with listener.accept() as conn:
+                logger.info(f"Coordinator connected from {listener.last_accepted}")
+                # Shards are loaded per connection, as assigned by the coordinator
+                serve_shards(conn, ServiceFactory.create_db_service)
+                logger.info("Coordinator disconnected")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Shard server of the sharded specific-mode index')
+    parser.add_argument('--listen', default='127.0.0.1:7355',
+                       help='host:port to listen on (default: 127.0.0.1:7355); requires SHARD_AUTHKEY on both sides')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -4,13 +4,15 @@ import logging
 import asyncio
 import argparse
 from dotenv import load_dotenv
-from supabase import create_client
 
 # Add parent directory to path to import from src
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.services.db_service import DatabaseService
+from src.services.base_db_service import BaseDatabaseService
+from src.services.service_factory import ServiceFactory
+from src.config.storage import storage_configured
 from src.utils.embeddings import EmbeddingProcessor
+from src.utils.provenance import build_provenance, current_config
 from src.types.screen import ScreenType
 
 # Configure logging
@@ -23,32 +25,39 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Configuration
-PUBLIC_SUPABASE_URL = os.getenv('PUBLIC_SUPABASE_URL')
-SUPABASE_SERVICE_ROLE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-
-if not all([PUBLIC_SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY]):
+if not storage_configured():
     logger.error("Missing required environment variables")
     sys.exit(1)
 
 async def update_above_fold_embeddings(
-    db_service: DatabaseService,
+    db_service: BaseDatabaseService,
     embedding_processor: EmbeddingProcessor,
-    max_items: int = None
+    max_items: int = None,
+    section: ScreenType = ScreenType.ABOVE_THE_FOLD,
+    update_all: bool = False
 ):
-    """Update layout embeddings for above the fold sections"""
+    """Update layout embeddings of a section (above the fold by default)"""
     try:
-        # Get all above the fold analyses
-        analyses = await db_service.get_analyses_by_type(
-            section_type=ScreenType.ABOVE_THE_FOLD,
-            limit=max_items
-        )
+        if update_all:
+            analyses = await db_service.get_analyses_by_type(
+                section_type=section,
+                limit=max_items
+            )
+        else:
+            # Only rows embedded with another model (or without provenance)
+            analyses = await db_service.get_stale_analyses(
+                'layout_embedding',
+                current_config('layout_embedding', section),
+                section=section,
+                columns='id, site_url, layout_data, provenance',
+                limit=max_items
+            )
         
         if not analyses:
-            logger.info("No above the fold analyses found")
+            logger.info(f"No {section.value} analyses to update")
             return
             
-        logger.info(f"Found {len(analyses)} above the fold analyses to update")
+        logger.info(f"Found {len(analyses)} {section.value} analyses to update")
         
         # Update each analysis
         for idx, analysis in enumerate(analyses, 1):
@@ -60,7 +69,8 @@ async def update_above_fold_embeddings(
                 # Update in database
                 await db_service.update_analysis_embedding(
                     analysis_id=analysis['id'],
-                    layout_embedding=new_embedding
+                    layout_embedding=new_embedding,
+                    provenance=build_provenance(section, ['layout_embedding'], base=analysis.get('provenance'))
                 )
                 
                 logger.info(f"✓ Updated embedding for analysis {idx}/{len(analyses)}: {analysis['site_url']}")
@@ -73,19 +83,20 @@ async def update_above_fold_embeddings(
         logger.error(f"Error updating above fold embeddings: {str(e)}")
         raise
 
-async def main(max_items: int = None):
+async def main(max_items: int = None, section: ScreenType = ScreenType.ABOVE_THE_FOLD, update_all: bool = False):
     """Main execution function"""
     try:
         # Initialize services
-        supabase = create_client(PUBLIC_SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-        db_service = DatabaseService(supabase)
+        db_service = ServiceFactory.create_db_service()
         embedding_processor = EmbeddingProcessor()
         
         # Update embeddings
         await update_above_fold_embeddings(
             db_service=db_service,
             embedding_processor=embedding_processor,
-            max_items=max_items
+            max_items=max_items,
+            section=section,
+            update_all=update_all
         )
         
     except Exception as e:
@@ -98,8 +109,12 @@ def parse_args():
     )
     parser.add_argument('--max-items', type=int,
                        help='Maximum number of items to update (optional)')
+    parser.add_argument('--section', type=ScreenType, default=ScreenType.ABOVE_THE_FOLD,
+                       help='Section to re-embed (default: above the fold)')
+    parser.add_argument('--all', action='store_true', dest='update_all',
+                       help='Re-embed every row, not only rows whose embedding model differs from EMBEDDING_MODEL')
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = parse_args()
-    asyncio.run(main(max_items=args.max_items)) 
\ No newline at end of file
+    asyncio.run(main(max_items=args.max_items, section=args.section, update_all=args.update_all))
\ No newline at end of file
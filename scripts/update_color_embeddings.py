@@ -2,7 +2,6 @@ import os
 import sys
 import logging
 from dotenv import load_dotenv
-from supabase import create_client
 import asyncio
 from typing import Optional, Union
 import argparse
@@ -10,8 +9,11 @@ import argparse
 # Add parent directory to path to import from src
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.utils.color_histogram import get_color_histogram_embedding
-from src.services.db_service import DatabaseService
+from src.utils.color_histogram import download_image_bytes, decode_image, compute_color_histogram
+from src.utils.sparse_histogram import to_sparse
+from src.utils.provenance import build_provenance, content_hash, current_config, is_stale
+from src.services.service_factory import ServiceFactory
+from src.config.storage import storage_configured
 
 # Configure logging
 logging.basicConfig(
@@ -23,48 +25,75 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-PUBLIC_SUPABASE_URL = os.getenv('PUBLIC_SUPABASE_URL')
-SUPABASE_SERVICE_ROLE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-
-if not all([PUBLIC_SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY]):
+if not storage_configured():
     logger.error("Missing required environment variables")
     sys.exit(1)
 
-async def update_color_embeddings(max_items: Union[int, str] = 'all'):
-    """Update color embeddings for all records"""
+async def update_color_embeddings(
+    max_items: Union[int, str] = 'all',
+    from_stored: bool = False,
+    update_all: bool = False,
+    check_source: bool = False
+):
+    """Update color embeddings of records whose histogram is stale (or of all records)"""
     try:
-        # Initialize Supabase client
-        supabase = create_client(PUBLIC_SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-        db_service = DatabaseService(supabase)
-        
-        # Get all records
-        query = supabase.table('relative_screen').select('id, img_url')
-        if max_items != 'all':
-            query = query.limit(int(max_items))
+        # Initialize storage
+        db_service = ServiceFactory.create_db_service()
+        limit = None if max_items == 'all' else int(max_items)
         
-        result = query.execute()
-        records = result.data
+        if from_stored:
+            records = await db_service.get_analyses(columns='id, img_url, color_embedding', limit=limit)
+        elif update_all or check_source:
+            # Image changes only show up after downloading, so every record is a candidate
+            records = await db_service.get_analyses(columns='id, img_url, section, provenance', limit=limit)
+        else:
+            # Only records computed with other histogram parameters (or without provenance)
+            records = await db_service.get_stale_analyses(
+                'color_histogram',
+                current_config('color_histogram', None),
+                columns='id, img_url, section, provenance',
+                limit=limit
+            )
         
         if not records:
             logger.info("No records found to update")
             return
             
         logger.info(f"Found {len(records)} records to update")
+        unchanged = 0
         
         # Process each record
         for idx, record in enumerate(records, 1):
             try:
+                if from_stored:
+                    # Only derive the sparse histogram from the stored dense one
+                    if not record.get('color_embedding'):
+                        continue
+                    color_histogram = to_sparse(record['color_embedding']).to_dict()
+                    await db_service.update_color_embedding(record['id'], None, color_histogram)
+                    logger.info(f"Updated {idx}/{len(records)}: {record['img_url']}")
+                    continue
+
                 # Get full image URL
                 img_url = db_service.get_storage_url(record['img_url'])
+                data = await asyncio.to_thread(download_image_bytes, img_url)
+                source_sha256 = content_hash(data)
+
+                provenance = record.get('provenance')
+                if check_source and not update_all and not is_stale(provenance, 'color_histogram', record['section'], source_sha256):
+                    unchanged += 1
+                    continue
                 
                 # Calculate new color embedding
-                color_embedding = await get_color_histogram_embedding(img_url)
+                color_embedding = compute_color_histogram(decode_image(data, img_url))
                 
                 # Update record
-                supabase.table('relative_screen')\
-                    .update({'color_embedding': color_embedding})\
-                    .eq('id', record['id'])\
-                    .execute()
+                await db_service.update_color_embedding(
+                    record['id'],
+                    color_embedding,
+                    to_sparse(color_embedding).to_dict(),
+                    provenance=build_provenance(record['section'], ['color_histogram'], source_sha256, base=provenance)
+                )
                     
                 logger.info(f"Updated {idx}/{len(records)}: {record['img_url']}")
                 
@@ -72,6 +101,9 @@ async def update_color_embeddings(max_items: Union[int, str] = 'all'):
                 logger.error(f"Error processing record {record['id']}: {str(e)}")
                 continue
 
+        if unchanged:
+            logger.info(f"{unchanged} records already match the current image and histogram parameters")
+
     except Exception as e:
         logger.error(f"Error updating color embeddings: {str(e)}")
         sys.exit(1)
@@ -80,8 +112,19 @@ def parse_args():
     parser = argparse.ArgumentParser(description='Update color embeddings for relative_screen records')
     parser.add_argument('--max-items', type=str, default='all',
                        help='Maximum number of records to update (default: all)')
+    parser.add_argument('--from-stored', action='store_true',
+                       help='Only fill color_histogram from the stored color_embedding, without downloading images')
+    parser.add_argument('--all', action='store_true', dest='update_all',
+                       help='Recompute every record, not only records with stale histogram parameters')
+    parser.add_argument('--check-source', action='store_true',
+                       help='Also recompute records whose screenshot bytes changed since their histogram was computed')
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = parse_args()
-    asyncio.run(update_color_embeddings(max_items=args.max_items)) 
\ No newline at end of file
+    asyncio.run(update_color_embeddings(
+        max_items=args.max_items,
+        from_stored=args.from_stored,
+        update_all=args.update_all,
+        check_source=args.check_source
+    )) 
\ No newline at end of file
@@ -35,11 +35,6 @@ def update_color_embedding_schema():
         
         # -- Then add the new color_embedding column with correct dimensions (8*8*8 = 512)
         # ALTER TABLE relative_screen ADD COLUMN color_embedding vector(512);
-        
-        # -- Create new index
-        # CREATE INDEX relative_screen_color_embedding_idx 
-        # ON relative_screen 
-        # USING ivfflat (color_embedding vector_cosine_ops);
         # """
         try:
             # Drop index if exists
@@ -59,16 +54,7 @@ def update_color_embedding_schema():
                 .alter('ALTER TABLE relative_screen ADD COLUMN color_embedding vector(512)')\
                 .execute()
             logger.info("Added new column")
-            
-            # Create optimized index for similarity search
-            supabase.table('relative_screen')\
-                .alter("""
-                    CREATE INDEX relative_screen_color_embedding_idx 
-                    ON relative_screen 
-                    USING ivfflat (color_embedding vector_cosine_ops)
-                """)\
-                .execute()
-            logger.info("Created new index")
+            # No index: color is scored by chi-square, never searched by <=> (see migration.txt)
             
             logger.info("Successfully updated color_embedding schema")
             return True
@@ -0,0 +1,80 @@
+import os
+import sys
+import logging
+from dotenv import load_dotenv
+import asyncio
+from typing import Union
+import argparse
+
+# Add parent directory to path to import from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils.color_histogram import download_image
+from src.utils.perceptual_hash import compute_phash, hash_to_hex
+from src.services.service_factory import ServiceFactory
+from src.config.storage import storage_configured
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+if not storage_configured():
+    logger.error("Missing required environment variables")
+    sys.exit(1)
+
+async def update_image_hashes(max_items: Union[int, str] = 'all', overwrite: bool = False):
+    """Compute perceptual image hashes for relative_screen records"""
+    try:
+        # Initialize storage
+        db_service = ServiceFactory.create_db_service()
+
+        # Get all records
+        records = await db_service.get_analyses(
+            columns='id, img_url, image_hash',
+            limit=None if max_items == 'all' else int(max_items)
+        )
+        if not overwrite:
+            records = [record for record in records if not record.get('image_hash')]
+
+        if not records:
+            logger.info("No records found to update")
+            return
+
+        logger.info(f"Found {len(records)} records to update")
+
+        # Hashes are computed locally from the stored screenshots, no API calls
+        for idx, record in enumerate(records, 1):
+            try:
+                # Get full image URL
+                img_url = db_service.get_storage_url(record['img_url'])
+
+                img = await asyncio.to_thread(download_image, img_url)
+                await db_service.update_image_hash(record['id'], hash_to_hex(compute_phash(img)))
+
+                logger.info(f"Updated {idx}/{len(records)}: {record['img_url']}")
+
+            except Exception as e:
+                logger.error(f"Error processing record {record['id']}: {str(e)}")
+                continue
+
+    except Exception as e:
+        logger.error(f"Error updating image hashes: {str(e)}")
+        sys.exit(1)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compute perceptual image hashes for relative_screen records')
+    parser.add_argument('--max-items', type=str, default='all',
+                       help='Maximum number of records to update (default: all)')
+    parser.add_argument('--overwrite', action='store_true',
+                       help='Recompute hashes that already exist')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(update_image_hashes(max_items=args.max_items, overwrite=args.overwrite))
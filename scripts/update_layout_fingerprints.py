@@ -0,0 +1,83 @@
+import os
+import sys
+import logging
+from dotenv import load_dotenv
+import asyncio
+from typing import Union
+import argparse
+
+# Add parent directory to path to import from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils.layout_fingerprint import get_layout_minhash
+from src.utils.provenance import build_provenance, current_config
+from src.services.service_factory import ServiceFactory
+from src.config.storage import storage_configured
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+if not storage_configured():
+    logger.error("Missing required environment variables")
+    sys.exit(1)
+
+async def update_layout_fingerprints(max_items: Union[int, str] = 'all', overwrite: bool = False):
+    """Compute layout MinHash signatures for relative_screen records"""
+    try:
+        # Initialize storage
+        db_service = ServiceFactory.create_db_service()
+
+        limit = None if max_items == 'all' else int(max_items)
+        columns = 'id, img_url, section, layout_data, provenance'
+        if overwrite:
+            records = await db_service.get_analyses(columns=columns, limit=limit)
+        else:
+            # Records without a signature from the current shingling (or without provenance)
+            records = await db_service.get_stale_analyses(
+                'layout_minhash', current_config('layout_minhash', None), columns=columns, limit=limit
+            )
+
+        if not records:
+            logger.info("No records found to update")
+            return
+
+        logger.info(f"Found {len(records)} records to update")
+
+        # Signatures are computed locally from the stored Gemini HTML, no API calls
+        for idx, record in enumerate(records, 1):
+            try:
+                layout_minhash = get_layout_minhash(record['layout_data'])
+                await db_service.update_layout_minhash(
+                    record['id'],
+                    layout_minhash,
+                    provenance=build_provenance(record['section'], ['layout_minhash'], base=record.get('provenance'))
+                )
+
+                logger.info(f"Updated {idx}/{len(records)}: {record['img_url']}")
+
+            except Exception as e:
+                logger.error(f"Error processing record {record['id']}: {str(e)}")
+                continue
+
+    except Exception as e:
+        logger.error(f"Error updating layout fingerprints: {str(e)}")
+        sys.exit(1)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compute layout MinHash fingerprints for relative_screen records')
+    parser.add_argument('--max-items', type=str, default='all',
+                       help='Maximum number of records to update (default: all)')
+    parser.add_argument('--overwrite', action='store_true',
+                       help='Recompute every signature, not only missing or stale ones')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(update_layout_fingerprints(max_items=args.max_items, overwrite=args.overwrite))
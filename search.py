@@ -1,18 +1,22 @@
 import os
 import sys
 import json
+import time
+import asyncio
 import logging
 from dotenv import load_dotenv
-from supabase import create_client
-from typing import Optional
+from typing import Dict, List, Optional
 import argparse
 import traceback
 
 from src.types.screen import SearchOptions, ScreenAnalysis
-from src.services.db_service import DatabaseService
+from src.services.base_db_service import BaseDatabaseService
 from src.services.gemini_service import GeminiService
 from src.services.service_factory import ServiceFactory
+from src.services.shard_service import ShardedIndexService
+from src.services.site_index_service import SiteIndexService
 from src.types.screen import ScreenType
+from src.config.storage import storage_configured
 
 # Configure logging
 logging.basicConfig(
@@ -25,16 +29,14 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 # Configuration
-PUBLIC_SUPABASE_URL = os.getenv('PUBLIC_SUPABASE_URL')
-SUPABASE_SERVICE_ROLE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
-if not all([PUBLIC_SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, GEMINI_API_KEY]):
+if not all([storage_configured(), GEMINI_API_KEY]):
     logger.error("Missing required environment variables. Please check .env file")
     sys.exit(1)
 
 async def search_similar_sections(
-    db_service: DatabaseService,
+    db_service: BaseDatabaseService,
     service,
     target_url: str,
     section: str,
@@ -42,7 +44,15 @@ async def search_similar_sections(
     search_color: bool = True,
     weight_layout: float = 0.5,
     weight_color: float = 0.5,
-    limit: int = 5
+    limit: int = 5,
+    candidate_source: str = 'all',
+    layout_similarity: str = 'embedding',
+    server_side: bool = False,
+    candidate_count: int = 200,
+    palette: Optional[List[str]] = None,
+    palette_match: str = 'any',
+    deadline_ms: Optional[float] = None,
+    sections: Optional[List[str]] = None
 ):
     """Search for similar sections"""
     try:
@@ -65,20 +75,35 @@ async def search_similar_sections(
             search_layout=search_layout,
             search_color=search_color,
             weight_layout=weight_layout,
-            weight_color=weight_color
+            weight_color=weight_color,
+            limit=limit,
+            candidate_source=candidate_source,
+            layout_similarity=layout_similarity,
+            server_side=server_side,
+            candidate_count=candidate_count,
+            palette=palette,
+            palette_match=palette_match,
+            deadline_ms=deadline_ms,
+            sections=sections
         )
         
         # Get similar screens
-        results = await service.search_similar(target_screen, options)
+        response = await service.search(target_screen, options)
+        results = response.results
         
         # Print results
         logger.info(f"\nResults for {target_url}:")
+        if response.degraded:
+            coverage = 'unknown' if response.coverage is None else f"{100 * response.coverage:.0f}%"
+            logger.info(f"Deadline reached: best results so far (coverage: {coverage})")
         logger.info("-" * 50)
         
         for idx, result in enumerate(results[:limit], 1):
             # Convert relative path to full URL for display
             img_url = db_service.get_storage_url(result.screen.img_url)
             logger.info(f"\n{idx}. {img_url}")
+            if sections:
+                logger.info(f"Section: {result.screen.section.value}")
             logger.info(f"Total Score: {result.score:.3f}")
             if result.layout_score:
                 logger.info(f"Layout Score: {result.layout_score:.3f}")
@@ -90,26 +115,33 @@ async def search_similar_sections(
         logger.debug(traceback.format_exc())
         raise
 
+# General mode under a deadline: share of the budget the exact RPC gets before the
+# approximate retry, and the probes / ef_search scale of that retry
+GENERAL_EXACT_BUDGET_SHARE = 0.7
+GENERAL_FALLBACK_EFFORT = 0.25
+
 async def search_similar_sections_general(
-    db_service: DatabaseService,
+    db_service: BaseDatabaseService,
     target_url: str,
     section: str,
-    limit: int = 5
-):
-    """Search for similar sections using screen analysis embeddings"""
+    limit: int = 5,
+    deadline_ms: Optional[float] = None
+) -> Optional[Dict]:
+    """
+    Search for similar sections using screen analysis embeddings.
+    Returns {'results', 'degraded', 'coverage'} like SearchResponse: past
+    GENERAL_EXACT_BUDGET_SHARE of the deadline the RPC is retried with fewer
+    index probes (approximate, coverage unknown); when that is late too the
+    results are empty with coverage 0.
+    """
     try:
         # Get target screen analysis from screen_analysis table
-        query = db_service.supabase.table('screen_analysis')\
-            .select('*')\
-            .eq('webp_url', target_url)\
-            .eq('section', section)\
-            .execute()
+        target_analysis = await db_service.get_screen_analysis(target_url, section)
             
-        if not query.data:
+        if not target_analysis:
             logger.error(f"Analysis not found for webp_url: {target_url} and section: {section}")
             return
             
-        target_analysis = query.data[0]
         
         # Get embedding from target analysis
         target_embedding = target_analysis.get('embedding')
@@ -122,23 +154,41 @@ async def search_similar_sections_general(
             target_embedding = json.loads(target_embedding)
 
         # Search for similar sections using vector similarity
-        query = db_service.supabase.rpc(
-            'match_screen_embeddings',
-            {
-                'query_embedding': target_embedding,
-                'section_type': section,
-                'match_threshold': 0.7,
-                'match_count': limit + 1  # Get one extra to skip the first match
-            }
-        ).execute()
-
-        results = query.data
+        def match(search_effort: float = 1.0):
+            return db_service.match_screen_embeddings(
+                query_embedding=target_embedding,
+                section_type=section,
+                match_threshold=0.7,
+                match_count=limit + 1,  # Get one extra to skip the first match
+                search_effort=search_effort
+            )
+
+        degraded, coverage = False, 1.0
+        if not deadline_ms:
+            results = await match()
+        else:
+            start = time.perf_counter()
+            try:
+                results = await asyncio.wait_for(match(), timeout=deadline_ms * GENERAL_EXACT_BUDGET_SHARE / 1000)
+            except asyncio.TimeoutError:
+                degraded, coverage = True, None
+                remaining = deadline_ms / 1000 - (time.perf_counter() - start)
+                try:
+                    results = await asyncio.wait_for(match(GENERAL_FALLBACK_EFFORT), timeout=max(remaining, 0))
+                except asyncio.TimeoutError:
+                    coverage = 0.0
+                    results = []
 
         # Print target URL
         storage_url = db_service.get_storage_url(target_url)
         logger.info(f"\nSearching similar sections for:")
         logger.info(f"URL: {storage_url}")
         logger.info(f"Section: {section}")
+        if degraded:
+            if coverage is None:
+                logger.info(f"Deadline reached: approximate results with reduced index probes (coverage: unknown)")
+            else:
+                logger.info(f"Deadline of {deadline_ms:g} ms reached before the database answered (coverage: 0%)")
         logger.info("-" * 50)
         
         # Skip the first result (which should be the target URL) and show the rest
@@ -149,11 +199,42 @@ async def search_similar_sections_general(
             logger.info(f"\n{idx}. {storage_url}")
             logger.info(f"Similarity Score: {similarity_score:.3f}")
 
+        return {'results': results[1:limit + 1], 'degraded': degraded, 'coverage': coverage}
+
     except Exception as e:
         logger.error(f"Error searching similar sections: {str(e)}")
         logger.debug(traceback.format_exc())
         raise
 
+async def search_similar_sites(
+    db_service: BaseDatabaseService,
+    target_url: str,
+    limit: int = 5
+):
+    """Search for sites similar overall to the site of the target screenshot (site_index)"""
+    try:
+        target_analysis = await db_service.get_analysis_by_url(target_url)
+        if not target_analysis:
+            logger.error(f"Analysis not found for: {target_url}")
+            return
+
+        site_url = target_analysis['site_url']
+        results = await SiteIndexService(db_service).search(site_url, limit)
+
+        logger.info(f"\nSites similar to {site_url}:")
+        logger.info("-" * 50)
+        for idx, result in enumerate(results, 1):
+            logger.info(f"\n{idx}. {result['site_url']}")
+            logger.info(f"Site Score: {result['score']:.3f}")
+            # Sections both sites have, by contribution to the score
+            for section, score in sorted(result['section_scores'].items(), key=lambda item: -item[1])[:3]:
+                logger.info(f"  {section}: {score:.3f}")
+
+    except Exception as e:
+        logger.error(f"Error searching similar sites: {str(e)}")
+        logger.debug(traceback.format_exc())
+        raise
+
 async def main(
     target_url: str,
     section: str,
@@ -162,24 +243,36 @@ async def main(
     weight_layout: float = 0.6,
     weight_color: float = 0.4,
     limit: int = 5,
-    mode: str = 'specific'  # Add mode parameter
+    mode: str = 'specific',  # Add mode parameter
+    candidate_source: str = 'all',
+    layout_similarity: str = 'embedding',
+    server_side: bool = False,
+    candidate_count: int = 200,
+    palette: Optional[List[str]] = None,
+    palette_match: str = 'any',
+    shard_workers: int = 0,
+    shard_size: int = 50000,
+    shard_assignment: str = 'balanced',
+    shard_hosts: Optional[List[str]] = None,
+    deadline_ms: Optional[float] = None,
+    sections: Optional[List[str]] = None
 ):
     """Main execution function"""
     try:
-        # Initialize clients
-        supabase = create_client(PUBLIC_SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-        
         # Initialize services
-        db_service = DatabaseService(supabase)
+        db_service = ServiceFactory.create_db_service()
         gemini_service = GeminiService(GEMINI_API_KEY)
         
-        if mode == 'general':
+        if mode == 'sites':
+            await search_similar_sites(db_service, target_url=target_url, limit=limit)
+        elif mode == 'general':
             # Use general search
             await search_similar_sections_general(
                 db_service,
                 target_url=target_url,
                 section=section,
-                limit=limit
+                limit=limit,
+                deadline_ms=deadline_ms
             )
         else:
             # Use specific search (original implementation)
@@ -193,18 +286,41 @@ async def main(
             except ValueError as e:
                 logger.error(f"Invalid section type: {section}")
                 return
+
+            if shard_workers or shard_hosts:
+                # Scatter-gather over worker processes / shard servers instead of one in-process corpus
+                service.shard_service = ShardedIndexService(
+                    db_service,
+                    workers=shard_workers,
+                    shard_size=shard_size,
+                    assignment=shard_assignment,
+                    remote=shard_hosts or ()
+                )
+                await service.shard_service.start([section_type])
             
-            await search_similar_sections(
-                db_service,
-                service,
-                target_url=target_url,
-                section=section,
-                search_layout=search_layout,
-                search_color=search_color,
-                weight_layout=weight_layout,
-                weight_color=weight_color,
-                limit=limit
-            )
+            try:
+                await search_similar_sections(
+                    db_service,
+                    service,
+                    target_url=target_url,
+                    section=section,
+                    search_layout=search_layout,
+                    search_color=search_color,
+                    weight_layout=weight_layout,
+                    weight_color=weight_color,
+                    limit=limit,
+                    candidate_source=candidate_source,
+                    layout_similarity=layout_similarity,
+                    server_side=server_side,
+                    candidate_count=candidate_count,
+                    palette=palette,
+                    palette_match=palette_match,
+                    deadline_ms=deadline_ms,
+                    sections=sections
+                )
+            finally:
+                if service.shard_service is not None:
+                    service.shard_service.close()
 
     except Exception as e:
         logger.error(f"Error in main execution: {str(e)}")
@@ -215,10 +331,10 @@ def parse_args():
     parser = argparse.ArgumentParser(description='Section similarity search tool')
     parser.add_argument('--target_url', required=True,
                        help='URL of the target screenshot')
-    parser.add_argument('--section', type=str, required=True,
-                       help='Section type to search (footer, above the fold, etc)')
-    parser.add_argument('--mode', choices=['specific', 'general'],
-                       default='specific', help='Search mode to use')
+    parser.add_argument('--section', type=str,
+                       help='Section type to search (footer, above the fold, etc); not used by --mode sites')
+    parser.add_argument('--mode', choices=['specific', 'general', 'sites'],
+                       default='specific', help='Search mode to use (sites: whole sites similar to the target\'s site)')
     parser.add_argument('--no-layout', action='store_true',
                        help='Disable layout similarity search')
     parser.add_argument('--no-color', action='store_true',
@@ -229,11 +345,39 @@ def parse_args():
                        help='Weight for color similarity (default: 0.3)')
     parser.add_argument('--limit', type=int, default=5,
                        help='Maximum number of results to show (default: 5)')
-    return parser.parse_args()
+    parser.add_argument('--candidates', choices=['all', 'lsh', 'color'], default='all',
+                       help='Score every screen of the section, only MinHash LSH candidates, '
+                            'or only screens sharing a dominant color with the target (default: all)')
+    parser.add_argument('--layout-similarity', choices=['embedding', 'minhash'], default='embedding',
+                       help='Layout score from OpenAI embeddings or local MinHash fingerprints (default: embedding)')
+    parser.add_argument('--server-side', action='store_true',
+                       help='Rank inside the database with match_relative_screens (specific mode only)')
+    parser.add_argument('--candidate-count', type=int, default=200,
+                       help='Nearest layout candidates reranked by the server-side search (default: 200)')
+    parser.add_argument('--palette', type=str,
+                       help='Comma-separated #rrggbb colors (or HSV bin numbers) that must be dominant in results')
+    parser.add_argument('--palette-match', choices=['any', 'all'], default='any',
+                       help='Require any or all of the palette colors (default: any)')
+    parser.add_argument('--shard-workers', type=int, default=0,
+                       help='Split the section into id-range shards served by this many worker processes (default: 0, in-process)')
+    parser.add_argument('--shard-size', type=int, default=50000,
+                       help='Maximum rows per shard (default: 50000)')
+    parser.add_argument('--shard-assignment', choices=['balanced', 'section'], default='balanced',
+                       help='Spread shards by row count, or keep each section on one worker (default: balanced)')
+    parser.add_argument('--shard-hosts', type=str,
+                       help='Comma-separated host:port of shard servers (scripts/serve_index_shards.py)')
+    parser.add_argument('--sections', type=str,
+                       help='Comma-separated sections (or "all") searched together in one cross-section index '
+                            '(specific mode only; default: only --section)')
+    parser.add_argument('--deadline-ms', type=float,
+                       help='Latency budget; past it the best results found so far are shown, marked degraded')
+    args = parser.parse_args()
+    if args.mode != 'sites' and not args.section:
+        parser.error('--section is required in specific and general mode')
+    return args
 
 if __name__ == "__main__":
     args = parse_args()
-    import asyncio
     asyncio.run(main(
         target_url=args.target_url,
         section=args.section,
@@ -242,5 +386,17 @@ if __name__ == "__main__":
         weight_layout=args.weight_layout,
         weight_color=args.weight_color,
         limit=args.limit,
-        mode=args.mode
+        mode=args.mode,
+        candidate_source=args.candidates,
+        layout_similarity=args.layout_similarity,
+        server_side=args.server_side,
+        candidate_count=args.candidate_count,
+        palette=args.palette.split(',') if args.palette else None,
+        palette_match=args.palette_match,
+        shard_workers=args.shard_workers,
+        shard_size=args.shard_size,
+        shard_assignment=args.shard_assignment,
+        shard_hosts=args.shard_hosts.split(',') if args.shard_hosts else None,
+        deadline_ms=args.deadline_ms,
+        sections=args.sections.split(',') if args.sections else None
     ))
\ No newline at end of file
@@ -0,0 +1,10 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Models behind the stored features. Changing one marks the rows it produced as
+# stale in relative_screen.provenance, so backfills recompute only those rows.
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-exp")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
@@ -45,4 +45,16 @@ SCREEN_PROMPTS = {
     ScreenType.FAQS: SCREEN_ANALYSIS_PROMPT,
     ScreenType.LAST_CTA: SCREEN_ANALYSIS_PROMPT,
     ScreenType.BLOG: SCREEN_ANALYSIS_PROMPT
-}
\ No newline at end of file
+}
+# Appended to the section prompt when several screenshots share one Gemini request
+BATCH_PROMPT_SUFFIX = '''
+You will receive {count} screenshots, each preceded by a line "SCREENSHOT <n>".
+Analyze each screenshot independently and answer with one complete HTML document per
+screenshot, in order, each wrapped exactly like this:
+
+<!-- BEGIN SCREENSHOT <n> -->
+<!DOCTYPE html>
+...
+</html>
+<!-- END SCREENSHOT <n> -->
+'''
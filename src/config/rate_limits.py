@@ -0,0 +1,25 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Client-side quotas per API: requests per minute and tokens per minute.
+# Set them to the project's quota; the scheduler keeps throughput just under them.
+RATE_LIMITS = {
+    "gemini": {
+        "requests_per_minute": float(os.getenv("GEMINI_RPM", "10")),
+        "tokens_per_minute": float(os.getenv("GEMINI_TPM", "4000000")),
+    },
+    "openai": {
+        "requests_per_minute": float(os.getenv("OPENAI_RPM", "3000")),
+        "tokens_per_minute": float(os.getenv("OPENAI_TPM", "1000000")),
+    },
+}
+
+# Concurrency bounds for the adaptive (AIMD) limit
+MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY", "16"))
+INITIAL_CONCURRENCY = int(os.getenv("API_INITIAL_CONCURRENCY", "2"))
+
+# Retries for rate-limited or transient failures before an item is given up
+MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "10"))
@@ -0,0 +1,26 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Storage backend: "supabase" (default) or "sqlite" for offline runs
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase").lower()
+
+# SQLite database file used by the sqlite backend (":memory:" for a throwaway database)
+SQLITE_DB_PATH = os.getenv("SQLITE_DB_PATH", "local.db")
+
+# "zstd" stores new layouts as dictionary-compressed frames once a dictionary is trained
+# (scripts/compress_layouts.py); "none" writes plain layout_data
+LAYOUT_COMPRESSION = os.getenv("LAYOUT_COMPRESSION", "none").lower()
+
+# Supabase configuration
+PUBLIC_SUPABASE_URL = os.getenv("PUBLIC_SUPABASE_URL")
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+
+def storage_configured() -> bool:
+    """Whether the selected backend has everything it needs to connect"""
+    if STORAGE_BACKEND == "sqlite":
+        return True
+    return all([PUBLIC_SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY])
@@ -0,0 +1,311 @@
+from abc import ABC, abstractmethod
+from typing import Optional, List, Dict, Tuple
+from ..config.storage import LAYOUT_COMPRESSION
+from ..utils.layout_codec import LayoutCodec, layout_columns, unpack_layout_rows
+
+class BaseDatabaseService(ABC):
+    """Storage interface shared by the Supabase and local backends"""
+
+    def __init__(self, storage_url: str = "http://127.0.0.1:54321/storage/v1/object/public/screens"):
+        self.storage_url = storage_url
+        self._layout_codec: Optional[LayoutCodec] = None
+
+    def get_storage_url(self, img_url: str) -> str:
+        """
+        Convert relative path to full storage URL
+        Example:
+        img_url: 'lemcal.com/20240804160759-CleanShot_2024-08-04_at_16.webp'
+        returns: 'http://127.0.0.1:54321/storage/v1/object/public/screens/lemcal.com/20240804160759-CleanShot_2024-08-04_at_16.webp'
+        """
+        # Remove any leading slashes
+        img_url = img_url.lstrip('/')
+        return f"{self.storage_url}/{img_url}"
+
+    @abstractmethod
+    def create_screen_section_analysis_table(self):
+        """Creates the relative_screen table if it doesn't exist"""
+        pass
+
+    @abstractmethod
+    async def get_unprocessed_screenshots(self, section: str, max_items: Optional[int] = None) -> List[Dict]:
+        """Get unprocessed screenshots of a section from screens table"""
+        pass
+
+    @abstractmethod
+    async def get_all_unprocessed_screenshots(self, max_items: Optional[int] = None) -> List[Dict]:
+        """Get all unprocessed screenshots without filtering by section"""
+        pass
+
+    @abstractmethod
+    async def mark_as_processed(self, screen_id: int, analysis_data: dict) -> Dict:
+        """Store analysis results in relative_screen table"""
+        pass
+
+    @abstractmethod
+    async def get_screens_by_type(
+        self,
+        section: str,
+        columns: str = '*',
+        id_range: Optional[Tuple[Optional[int], Optional[int]]] = None
+    ) -> List[Dict]:
+        """
+        Get all processed screens of a specific type.
+        id_range: (start, end) half-open id bounds, None for unbounded; rows come back ordered by id.
+        """
+        pass
+
+    @abstractmethod
+    async def get_analysis_by_url(self, img_url: str) -> Optional[Dict]:
+        """Get analysis data by image URL"""
+        pass
+
+    @abstractmethod
+    async def get_analyses_by_type(self, section_type: str, limit: Optional[int] = None) -> List[Dict]:
+        """Get all analyses of a specific type"""
+        pass
+
+    @abstractmethod
+    async def get_analyses(self, columns: str = '*', limit: Optional[int] = None) -> List[Dict]:
+        """Get relative_screen rows of every section"""
+        pass
+
+    @abstractmethod
+    async def get_analyses_without_related_ids(self) -> List[Dict]:
+        """Get relative_screen rows whose screen_related_ids is still empty"""
+        pass
+
+    @abstractmethod
+    async def update_analysis_embedding(self, analysis_id: int, layout_embedding: List[float], provenance: Optional[Dict] = None):
+        """Update layout embedding (and optionally the row's provenance) for a specific analysis"""
+        pass
+
+    @abstractmethod
+    async def update_layout_data(
+        self,
+        analysis_id: int,
+        layout_data: str,
+        layout_embedding: Optional[List[float]],
+        layout_minhash: List[int],
+        provenance: Dict
+    ):
+        """Replace the Gemini layout of a specific analysis together with the features derived from it"""
+        pass
+
+    @abstractmethod
+    async def get_stale_analyses(
+        self,
+        feature: str,
+        expected: Dict[str, str],
+        section: Optional[str] = None,
+        columns: str = '*',
+        limit: Optional[int] = None
+    ) -> List[Dict]:
+        """relative_screen rows whose provenance[feature] differs from `expected` in any key (or is missing)"""
+        pass
+
+    @abstractmethod
+    async def get_analyses_by_ids(self, analysis_ids: List[int]) -> List[Dict]:
+        """Get relative_screen rows by id"""
+        pass
+
+    @abstractmethod
+    async def update_layout_storage(self, analysis_id: int, layout_data: Optional[str], layout_zstd: Optional[str]):
+        """Rewrite how a row stores its layout: plain layout_data or a compressed layout_zstd frame"""
+        pass
+
+    @abstractmethod
+    async def get_layout_dictionaries(self) -> List[Dict]:
+        """id and base64 dictionary of every layout compression dictionary, oldest first"""
+        pass
+
+    @abstractmethod
+    async def store_layout_dictionary(self, dict_id: int, dictionary: str) -> Dict:
+        """Store a trained layout dictionary; later compressed writes use it"""
+        pass
+
+    async def get_layout_codec(self, refresh: bool = False) -> LayoutCodec:
+        """Codec over the stored layout dictionaries, loaded on first use"""
+        if self._layout_codec is None or refresh:
+            self._layout_codec = LayoutCodec.from_rows(await self.get_layout_dictionaries())
+        return self._layout_codec
+
+    async def pack_layout(self, values: Dict) -> Dict:
+        """
+        Row values to write: with LAYOUT_COMPRESSION=zstd and a trained dictionary,
+        layout_data moves to a compressed layout_zstd frame
+        """
+        if LAYOUT_COMPRESSION != 'zstd' or not values.get('layout_data'):
+            return values
+        codec = await self.get_layout_codec()
+        if codec.active_id is None:
+            return values
+        return {**values, 'layout_data': None, 'layout_zstd': codec.compress(values['layout_data'])}
+
+    async def unpack_layouts(self, rows: List[Dict]) -> List[Dict]:
+        """
+        Decompress the layouts of rows read with layout_zstd (i.e. rows whose
+        HTML was requested); other rows are returned untouched
+        """
+        blobs = [row['layout_zstd'] for row in rows if row.get('layout_zstd') and row.get('layout_data') is None]
+        codec = self._layout_codec
+        if blobs:
+            codec = await self.get_layout_codec()
+            # A dictionary trained by another process since the codec was loaded
+            if any(LayoutCodec.frame_dictionary(blob) not in codec.dictionaries for blob in blobs):
+                codec = await self.get_layout_codec(refresh=True)
+        return unpack_layout_rows(rows, codec)
+
+    @abstractmethod
+    async def get_layout_fingerprints(self, section: str) -> List[Dict]:
+        """Get id and layout_minhash of every relative_screen row of a section"""
+        pass
+
+    @abstractmethod
+    async def update_layout_minhash(self, analysis_id: int, layout_minhash: List[int], provenance: Optional[Dict] = None):
+        """Update layout MinHash signature (and optionally the row's provenance) for a specific analysis"""
+        pass
+
+    @abstractmethod
+    async def get_image_hashes(self, section: str) -> List[Dict]:
+        """Get id, site_url and image_hash of every relative_screen row of a section"""
+        pass
+
+    @abstractmethod
+    async def update_image_hash(self, analysis_id: int, image_hash: str):
+        """Update perceptual image hash for a specific analysis"""
+        pass
+
+    @abstractmethod
+    async def update_color_embedding(
+        self,
+        analysis_id: int,
+        color_embedding: Optional[List[float]],
+        color_histogram: Optional[Dict] = None,
+        provenance: Optional[Dict] = None
+    ):
+        """Update color embedding (and optionally its sparse histogram and the row's provenance) for a specific analysis"""
+        pass
+
+    @abstractmethod
+    async def update_screen_related_ids(self, screen_id: int, related_ids: List[int], related_scores: Optional[List[float]] = None):
+        """Update related screen IDs (and optionally their scores) for a specific relative_screen row"""
+        pass
+
+    @abstractmethod
+    async def get_all_sections(self) -> List[str]:
+        """Get list of all unique sections from database"""
+        pass
+
+    @abstractmethod
+    async def get_screen_analyses(self, columns: str = '*', limit: Optional[int] = None) -> List[Dict]:
+        """Get screen_analysis rows of every section"""
+        pass
+
+    @abstractmethod
+    async def get_analyses_by_site(self, site_urls: List[str], columns: str = '*') -> List[Dict]:
+        """relative_screen rows of every section of the given sites"""
+        pass
+
+    @abstractmethod
+    async def upsert_site_vectors(self, rows: List[Dict]) -> int:
+        """Insert or replace site_index rows (keyed by site_url)"""
+        pass
+
+    @abstractmethod
+    async def get_rows_page(
+        self,
+        table: str,
+        after_id: int = 0,
+        limit: int = 1000,
+        columns: str = '*',
+        section: Optional[str] = None,
+        before_id: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Next `limit` rows of a table with id > after_id, ordered by id (keyset paging).
+        section / before_id: only rows of that section / with id < before_id.
+        """
+        pass
+
+    async def get_all_rows(
+        self,
+        table: str,
+        columns: str = '*',
+        section: Optional[str] = None,
+        id_range: Optional[Tuple[Optional[int], Optional[int]]] = None,
+        page_size: int = 1000
+    ) -> List[Dict]:
+        """
+        Every row of a table (optionally one section and a half-open id range),
+        ordered by id. Read in keyset pages, so PostgREST max-rows cannot
+        truncate it; requested layouts are decompressed.
+        """
+        start, end = id_range or (None, None)
+        after_id = start - 1 if start is not None else 0
+        rows = []
+        while True:
+            page = await self.get_rows_page(
+                table, after_id=after_id, limit=page_size, columns=layout_columns(columns),
+                section=section, before_id=end
+            )
+            if not page:
+                break
+            rows.extend(await self.unpack_layouts(page))
+            after_id = page[-1]['id']
+        return rows
+
+    @abstractmethod
+    async def insert_rows(self, table: str, rows: List[Dict], upsert: bool = True) -> int:
+        """Bulk-write rows into a table, replacing rows with the same id when upsert is set"""
+        pass
+
+    @abstractmethod
+    async def get_vector_index_stats(self) -> List[Dict]:
+        """Row count and current index of every embedding column served by an approximate index"""
+        pass
+
+    @abstractmethod
+    async def get_screen_analysis(self, webp_url: str, section: str) -> Optional[Dict]:
+        """Get a screen_analysis row by webp_url and section"""
+        pass
+
+    @abstractmethod
+    async def get_screen_analyses_without_related_ids(self) -> List[Dict]:
+        """Get screen_analysis rows whose screen_related_ids is still empty"""
+        pass
+
+    @abstractmethod
+    async def update_screen_analysis_related_ids(self, analysis_id: int, related_ids: List[int]):
+        """Update related screen IDs for a specific screen_analysis row"""
+        pass
+
+    @abstractmethod
+    async def match_screen_embeddings(
+        self,
+        query_embedding: List[float],
+        section_type: str,
+        match_threshold: float,
+        match_count: int,
+        search_effort: float = 1.0
+    ) -> List[Dict]:
+        """
+        Rank screen_analysis rows of a section by cosine similarity (match_screen_embeddings RPC).
+        search_effort < 1 scales the index's probes / ef_search down for a faster, less exact answer.
+        """
+        pass
+
+    @abstractmethod
+    async def match_relative_screens(
+        self,
+        query_layout: Optional[List[float]],
+        query_color: Optional[List[float]],
+        section_type: str,
+        weight_layout: float = 0.5,
+        weight_color: float = 0.5,
+        match_count: int = 5,
+        candidate_count: int = 200,
+        exclude_id: Optional[int] = None,
+        exclude_img_url: Optional[str] = None
+    ) -> List[Dict]:
+        """Top relative_screen ids of a section by combined layout + color score (match_relative_screens RPC)"""
+        pass
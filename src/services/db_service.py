@@ -1,14 +1,18 @@
+import asyncio
 import logging
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 from supabase import Client
 from ..types.screen import ScreenType
+from .base_db_service import BaseDatabaseService
+from ..utils.layout_codec import layout_columns
 
 logger = logging.getLogger(__name__)
 
-class DatabaseService:
+class DatabaseService(BaseDatabaseService):
+    """Supabase-backed storage"""
     def __init__(self, supabase: Client):
+        super().__init__()
         self.supabase = supabase
-        self.storage_url = "http://127.0.0.1:54321/storage/v1/object/public/screens"
 
     def create_screen_section_analysis_table(self):
         """Creates the relative_screen table if it doesn't exist"""
@@ -36,7 +40,12 @@ class DatabaseService:
                 img_url text not null,
                 layout_embedding vector(1536),
                 color_embedding vector(512),
+                color_histogram jsonb,
                 layout_data jsonb,
+                layout_zstd text,
+                layout_minhash jsonb,
+                image_hash text,
+                provenance jsonb,
                 created_at timestamp with time zone default timezone('utc'::text, now()),
                 updated_at timestamp with time zone default timezone('utc'::text, now())
             );
@@ -45,8 +54,8 @@ class DatabaseService:
             create index relative_screen_screen_id_idx on relative_screen(screen_id);
             create index relative_screen_section_idx on relative_screen(section);
             create index relative_screen_site_url_idx on relative_screen(site_url);
-            create index relative_screen_layout_embedding_idx on relative_screen using ivfflat (layout_embedding vector_cosine_ops);
-            create index relative_screen_color_embedding_idx on relative_screen using ivfflat (color_embedding vector_cosine_ops);
+            -- Vector indexes are trained on existing rows, so they are built once data is loaded
+            -- (scripts/manage_vector_indexes.py rebuild), not on the empty table
             """
             
             # Execute SQL
@@ -58,17 +67,6 @@ class DatabaseService:
             logger.error(f"Error creating relative screen table: {str(e)}")
             raise
 
-    def get_storage_url(self, img_url: str) -> str:
-        """
-        Convert relative path to full storage URL
-        Example:
-        img_url: 'lemcal.com/20240804160759-CleanShot_2024-08-04_at_16.webp'
-        returns: 'http://127.0.0.1:54321/storage/v1/object/public/screens/lemcal.com/20240804160759-CleanShot_2024-08-04_at_16.webp'
-        """
-        # Remove any leading slashes
-        img_url = img_url.lstrip('/')
-        return f"{self.storage_url}/{img_url}"
-
     async def get_unprocessed_screenshots(self, section: str, max_items: Optional[int] = None):
         """Get unprocessed screenshots from screens table"""
         try:
@@ -119,31 +117,43 @@ class DatabaseService:
             if 'original_img_url' in analysis_data:
                 analysis_data['img_url'] = analysis_data.pop('original_img_url')
             
-            data = {
+            data = await self.pack_layout({
                 "screen_id": screen_id,
                 **analysis_data
-            }
+            })
             
             result = self.supabase.table('relative_screen')\
                 .insert(data)\
                 .execute()
                 
             logger.info(f"Stored analysis for screen {screen_id}")
-            return result.data[0]
+            return (await self.unpack_layouts(result.data))[0]
             
         except Exception as e:
             logger.error(f"Error storing analysis: {str(e)}")
             raise
 
-    async def get_screens_by_type(self, section: str) -> List[Dict]:
-        """Get all processed screens of a specific type"""
+    async def get_screens_by_type(
+        self,
+        section: str,
+        columns: str = '*',
+        id_range: Optional[Tuple[Optional[int], Optional[int]]] = None
+    ) -> List[Dict]:
+        """Get all processed screens of a specific type (optionally one id range, ordered by id)"""
         try:
-            result = self.supabase.table('relative_screen')\
-                .select('*')\
-                .eq('section', section)\
-                .execute()
+            query = self.supabase.table('relative_screen')\
+                .select(layout_columns(columns))\
+                .eq('section', section)
+            if id_range is not None:
+                start, end = id_range
+                if start is not None:
+                    query = query.gte('id', start)
+                if end is not None:
+                    query = query.lt('id', end)
+                query = query.order('id')
+            result = query.execute()
                 
-            return result.data
+            return await self.unpack_layouts(result.data)
             
         except Exception as e:
             logger.error(f"Error getting screens by type: {str(e)}")
@@ -161,7 +171,7 @@ class DatabaseService:
                 .eq('img_url', img_url)\
                 .single()\
                 .execute()
-            return result.data
+            return (await self.unpack_layouts([result.data]))[0] if result.data else result.data
             
         except Exception as e:
             logger.error(f"Error getting analysis by URL: {str(e)}")
@@ -176,17 +186,20 @@ class DatabaseService:
                 query = query.limit(limit)
                 
             response = query.execute()
-            return response.data
+            return await self.unpack_layouts(response.data)
             
         except Exception as e:
             logger.error(f"Error getting analyses by type: {str(e)}")
             raise
 
-    async def update_analysis_embedding(self, analysis_id: int, layout_embedding: List[float]):
-        """Update layout embedding for a specific analysis"""
+    async def update_analysis_embedding(self, analysis_id: int, layout_embedding: List[float], provenance: Optional[Dict] = None):
+        """Update layout embedding (and optionally the row's provenance) for a specific analysis"""
         try:
+            values = {'layout_embedding': layout_embedding}
+            if provenance is not None:
+                values['provenance'] = provenance
             response = self.supabase.table('relative_screen')\
-                .update({'layout_embedding': layout_embedding})\
+                .update(values)\
                 .eq('id', analysis_id)\
                 .execute()
             return response.data
@@ -195,6 +208,97 @@ class DatabaseService:
             logger.error(f"Error updating analysis embedding: {str(e)}")
             raise 
 
+    async def update_layout_data(
+        self,
+        analysis_id: int,
+        layout_data: str,
+        layout_embedding: Optional[List[float]],
+        layout_minhash: List[int],
+        provenance: Dict
+    ):
+        """Replace the Gemini layout of a specific analysis together with the features derived from it"""
+        try:
+            response = self.supabase.table('relative_screen')\
+                .update(await self.pack_layout({
+                    'layout_data': layout_data,
+                    'layout_embedding': layout_embedding,
+                    'layout_minhash': layout_minhash,
+                    'provenance': provenance
+                }))\
+                .eq('id', analysis_id)\
+                .execute()
+            return response.data
+
+        except Exception as e:
+            logger.error(f"Error updating layout data: {str(e)}")
+            raise
+
+    async def update_layout_storage(self, analysis_id: int, layout_data: Optional[str], layout_zstd: Optional[str]):
+        """Rewrite how a row stores its layout: plain layout_data or a compressed layout_zstd frame"""
+        try:
+            self.supabase.table('relative_screen')\
+                .update({'layout_data': layout_data, 'layout_zstd': layout_zstd})\
+                .eq('id', analysis_id)\
+                .execute()
+
+        except Exception as e:
+            logger.error(f"Error updating layout storage: {str(e)}")
+            raise
+
+    async def get_layout_dictionaries(self) -> List[Dict]:
+        """id and base64 dictionary of every layout compression dictionary, oldest first"""
+        try:
+            result = self.supabase.table('layout_dictionaries')\
+                .select('id, dictionary')\
+                .order('created_at')\
+                .execute()
+            return result.data
+
+        except Exception as e:
+            logger.error(f"Error getting layout dictionaries: {str(e)}")
+            raise
+
+    async def store_layout_dictionary(self, dict_id: int, dictionary: str) -> Dict:
+        """Store a trained layout dictionary; later compressed writes use it"""
+        try:
+            result = self.supabase.table('layout_dictionaries')\
+                .upsert({'id': dict_id, 'dictionary': dictionary})\
+                .execute()
+            self._layout_codec = None
+            return result.data[0]
+
+        except Exception as e:
+            logger.error(f"Error storing layout dictionary: {str(e)}")
+            raise
+
+    async def get_stale_analyses(
+        self,
+        feature: str,
+        expected: Dict[str, str],
+        section: Optional[str] = None,
+        columns: str = '*',
+        limit: Optional[int] = None
+    ) -> List[Dict]:
+        """relative_screen rows whose provenance[feature] differs from `expected` in any key (or is missing)"""
+        try:
+            conditions = []
+            for key, value in expected.items():
+                path = f"provenance->{feature}->>{key}"
+                # Missing provenance yields null on the JSON path
+                conditions += [f"{path}.is.null", f'{path}.neq."{value}"']
+            query = self.supabase.table('relative_screen')\
+                .select(layout_columns(columns))\
+                .or_(','.join(conditions))
+            if section:
+                query = query.eq('section', section)
+            if limit:
+                query = query.limit(limit)
+            return await self.unpack_layouts(query.execute().data)
+
+        except Exception as e:
+            logger.error(f"Error getting stale analyses: {str(e)}")
+            raise
+
     async def get_all_sections(self):
         """Get list of all unique sections from database"""
         result = await self.supabase.table('screens')\
@@ -245,14 +349,334 @@ class DatabaseService:
             logger.error(f"Error getting unprocessed screenshots: {str(e)}")
             raise 
 
-    async def update_screen_related_ids(self, screen_id: int, related_ids: List[int]):
-        """Update related screen IDs for a specific screen"""
+    async def update_screen_related_ids(self, screen_id: int, related_ids: List[int], related_scores: Optional[List[float]] = None):
+        """Update related screen IDs (and optionally their scores) for a specific screen"""
         try:
+            values = {'screen_related_ids': related_ids}
+            if related_scores is not None:
+                values['screen_related_scores'] = related_scores
             response = self.supabase.table('relative_screen')\
-                .update({'screen_related_ids': related_ids})\
+                .update(values)\
                 .eq('id', screen_id)\
                 .execute()
             return response.data
         except Exception as e:
             logger.error(f"Error updating related screen IDs: {str(e)}")
-            raise 
\ No newline at end of file
+            raise
+
+    async def get_analyses(self, columns: str = '*', limit: Optional[int] = None) -> List[Dict]:
+        """Get relative_screen rows of every section"""
+        try:
+            query = self.supabase.table('relative_screen').select(layout_columns(columns))
+
+            if limit:
+                query = query.limit(limit)
+
+            return await self.unpack_layouts(query.execute().data)
+
+        except Exception as e:
+            logger.error(f"Error getting analyses: {str(e)}")
+            raise
+
+    async def get_analyses_without_related_ids(self) -> List[Dict]:
+        """Get relative_screen rows whose screen_related_ids is still empty"""
+        try:
+            result = self.supabase.table('relative_screen')\
+                .select('*')\
+                .eq('screen_related_ids', [])\
+                .execute()
+            return await self.unpack_layouts(result.data)
+
+        except Exception as e:
+            logger.error(f"Error getting analyses without related ids: {str(e)}")
+            raise
+
+    async def get_analyses_by_ids(self, analysis_ids: List[int]) -> List[Dict]:
+        """Get relative_screen rows by id"""
+        try:
+            if not analysis_ids:
+                return []
+            result = self.supabase.table('relative_screen')\
+                .select('*')\
+                .in_('id', analysis_ids)\
+                .execute()
+            return await self.unpack_layouts(result.data)
+
+        except Exception as e:
+            logger.error(f"Error getting analyses by ids: {str(e)}")
+            raise
+
+    async def get_layout_fingerprints(self, section: str) -> List[Dict]:
+        """Get id and layout_minhash of every relative_screen row of a section"""
+        try:
+            result = self.supabase.table('relative_screen')\
+                .select('id, layout_minhash')\
+                .eq('section', section)\
+                .execute()
+            return result.data
+
+        except Exception as e:
+            logger.error(f"Error getting layout fingerprints: {str(e)}")
+            raise
+
+    async def update_layout_minhash(self, analysis_id: int, layout_minhash: List[int], provenance: Optional[Dict] = None):
+        """Update layout MinHash signature (and optionally the row's provenance) for a specific analysis"""
+        try:
+            values = {'layout_minhash': layout_minhash}
+            if provenance is not None:
+                values['provenance'] = provenance
+            response = self.supabase.table('relative_screen')\
+                .update(values)\
+                .eq('id', analysis_id)\
+                .execute()
+            return response.data
+
+        except Exception as e:
+            logger.error(f"Error updating layout minhash: {str(e)}")
+            raise
+
+    async def get_image_hashes(self, section: str) -> List[Dict]:
+        """Get id, site_url and image_hash of every relative_screen row of a section"""
+        try:
+            result = self.supabase.table('relative_screen')\
+                .select('id, site_url, image_hash')\
+                .eq('section', section)\
+                .execute()
+            return result.data
+
+        except Exception as e:
+            logger.error(f"Error getting image hashes: {str(e)}")
+            raise
+
+    async def update_image_hash(self, analysis_id: int, image_hash: str):
+        """Update perceptual image hash for a specific analysis"""
+        try:
+            response = self.supabase.table('relative_screen')\
+                .update({'image_hash': image_hash})\
+                .eq('id', analysis_id)\
+                .execute()
+            return response.data
+
+        except Exception as e:
+            logger.error(f"Error updating image hash: {str(e)}")
+            raise
+
+    async def update_color_embedding(
+        self,
+        analysis_id: int,
+        color_embedding: Optional[List[float]],
+        color_histogram: Optional[Dict] = None,
+        provenance: Optional[Dict] = None
+    ):
+        """Update color embedding (and optionally its sparse histogram and the row's provenance) for a specific analysis"""
+        try:
+            values = {'color_embedding': color_embedding} if color_embedding is not None else {}
+            if color_histogram is not None:
+                values['color_histogram'] = color_histogram
+            if provenance is not None:
+                values['provenance'] = provenance
+            response = self.supabase.table('relative_screen')\
+                .update(values)\
+                .eq('id', analysis_id)\
+                .execute()
+            return response.data
+
+        except Exception as e:
+            logger.error(f"Error updating color embedding: {str(e)}")
+            raise
+
+    async def get_screen_analyses(self, columns: str = '*', limit: Optional[int] = None) -> List[Dict]:
+        """Get screen_analysis rows of every section"""
+        try:
+            query = self.supabase.table('screen_analysis').select(columns)
+            if limit:
+                query = query.limit(limit)
+            result = query.execute()
+            return result.data
+
+        except Exception as e:
+            logger.error(f"Error getting screen analyses: {str(e)}")
+            raise
+
+    async def get_analyses_by_site(self, site_urls: List[str], columns: str = '*') -> List[Dict]:
+        """relative_screen rows of every section of the given sites"""
+        try:
+            if not site_urls:
+                return []
+            result = self.supabase.table('relative_screen')\
+                .select(layout_columns(columns))\
+                .in_('site_url', site_urls)\
+                .execute()
+            return await self.unpack_layouts(result.data)
+
+        except Exception as e:
+            logger.error(f"Error getting analyses by site: {str(e)}")
+            raise
+
+    async def upsert_site_vectors(self, rows: List[Dict]) -> int:
+        """Insert or replace site_index rows (keyed by site_url)"""
+        try:
+            if not rows:
+                return 0
+            result = self.supabase.table('site_index')\
+                .upsert(rows, on_conflict='site_url')\
+                .execute()
+            return len(result.data)
+
+        except Exception as e:
+            logger.error(f"Error upserting site vectors: {str(e)}")
+            raise
+
+    async def get_rows_page(
+        self,
+        table: str,
+        after_id: int = 0,
+        limit: int = 1000,
+        columns: str = '*',
+        section: Optional[str] = None,
+        before_id: Optional[int] = None
+    ) -> List[Dict]:
+        """Next `limit` rows of a table with id > after_id, ordered by id (keyset paging)"""
+        try:
+            query = self.supabase.table(table)\
+                .select(columns)\
+                .gt('id', after_id)
+            if section is not None:
+                query = query.eq('section', section)
+            if before_id is not None:
+                query = query.lt('id', before_id)
+            result = query.order('id').limit(limit).execute()
+            return result.data
+
+        except Exception as e:
+            logger.error(f"Error getting rows page of {table}: {str(e)}")
+            raise
+
+    async def insert_rows(self, table: str, rows: List[Dict], upsert: bool = True) -> int:
+        """Bulk-write rows into a table, replacing rows with the same id when upsert is set"""
+        try:
+            if not rows:
+                return 0
+            query = self.supabase.table(table)
+            result = (query.upsert(rows) if upsert else query.insert(rows)).execute()
+            return len(result.data)
+
+        except Exception as e:
+            logger.error(f"Error inserting rows into {table}: {str(e)}")
+            raise
+
+    async def get_vector_index_stats(self) -> List[Dict]:
+        """Row count and current index of every embedding column served by an approximate index"""
+        try:
+            result = self.supabase.rpc('vector_index_stats', {}).execute()
+            return result.data
+
+        except Exception as e:
+            logger.error(f"Error getting vector index stats: {str(e)}")
+            raise
+
+    async def get_screen_analysis(self, webp_url: str, section: str) -> Optional[Dict]:
+        """Get a screen_analysis row by webp_url and section"""
+        try:
+            result = self.supabase.table('screen_analysis')\
+                .select('*')\
+                .eq('webp_url', webp_url)\
+                .eq('section', section)\
+                .execute()
+            return result.data[0] if result.data else None
+
+        except Exception as e:
+            logger.error(f"Error getting screen analysis: {str(e)}")
+            raise
+
+    async def get_screen_analyses_without_related_ids(self) -> List[Dict]:
+        """Get screen_analysis rows whose screen_related_ids is still empty"""
+        try:
+            result = self.supabase.table('screen_analysis')\
+                .select('*')\
+                .eq('screen_related_ids', [])\
+                .execute()
+            return result.data
+
+        except Exception as e:
+            logger.error(f"Error getting screen analyses without related ids: {str(e)}")
+            raise
+
+    async def update_screen_analysis_related_ids(self, analysis_id: int, related_ids: List[int]):
+        """Update related screen IDs for a specific screen_analysis row"""
+        try:
+            response = self.supabase.table('screen_analysis')\
+                .update({'screen_related_ids': related_ids})\
+                .eq('id', analysis_id)\
+                .execute()
+            return response.data
+        except Exception as e:
+            logger.error(f"Error updating screen analysis related IDs: {str(e)}")
+            raise
+
+    async def match_screen_embeddings(
+        self,
+        query_embedding: List[float],
+        section_type: str,
+        match_threshold: float,
+        match_count: int,
+        search_effort: float = 1.0
+    ) -> List[Dict]:
+        """
+        Rank screen_analysis rows of a section by cosine similarity (match_screen_embeddings RPC).
+        search_effort < 1 scales the index's probes / ef_search down for a faster, less exact answer.
+        """
+        try:
+            query = self.supabase.rpc(
+                'match_screen_embeddings',
+                {
+                    'query_embedding': query_embedding,
+                    'section_type': section_type,
+                    'match_threshold': match_threshold,
+                    'match_count': match_count,
+                    'search_effort': search_effort
+                }
+            )
+            # Off the event loop, so deadline-bounded searches can stop waiting
+            result = await asyncio.to_thread(query.execute)
+            return result.data
+
+        except Exception as e:
+            logger.error(f"Error matching screen embeddings: {str(e)}")
+            raise
+
+    async def match_relative_screens(
+        self,
+        query_layout: Optional[List[float]],
+        query_color: Optional[List[float]],
+        section_type: str,
+        weight_layout: float = 0.5,
+        weight_color: float = 0.5,
+        match_count: int = 5,
+        candidate_count: int = 200,
+        exclude_id: Optional[int] = None,
+        exclude_img_url: Optional[str] = None
+    ) -> List[Dict]:
+        """Top relative_screen ids of a section by combined layout + color score (match_relative_screens RPC)"""
+        try:
+            query = self.supabase.rpc(
+                'match_relative_screens',
+                {
+                    'query_layout': query_layout,
+                    'query_color': query_color,
+                    'section_type': section_type,
+                    'weight_layout': weight_layout,
+                    'weight_color': weight_color,
+                    'match_count': match_count,
+                    'candidate_count': candidate_count,
+                    'exclude_id': exclude_id,
+                    'exclude_img_url': exclude_img_url
+                }
+            )
+            # Off the event loop, so deadline-bounded searches can stop waiting
+            result = await asyncio.to_thread(query.execute)
+            return result.data
+
+        except Exception as e:
+            logger.error(f"Error matching relative screens: {str(e)}")
+            raise
@@ -1,21 +1,84 @@
 import os
+import re
+import time
+import asyncio
 import logging
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 import google.generativeai as genai
 import requests
 from PIL import Image
 from io import BytesIO
-from ..config.prompts import SCREEN_PROMPTS
+from ..config.prompts import SCREEN_PROMPTS, BATCH_PROMPT_SUFFIX
+from ..config.models import GEMINI_MODEL
 from ..types.screen import ScreenType
+from ..utils.rate_limiter import get_scheduler, estimate_tokens
 
 logger = logging.getLogger(__name__)
 
+# Upload formats Gemini accepts as-is
+GEMINI_IMAGE_MIME_TYPES = {'image/jpeg', 'image/png', 'image/webp'}
+
+# Token estimates for the scheduler: one image (258 tokens per 768px tile) and a typical HTML answer
+IMAGE_TOKENS = 258 * 2
+ANSWER_TOKENS = 2048
+
+
+class GenerationDeadlineExceeded(Exception):
+    """A generate_content call ran past its wall-clock deadline (not retried by the scheduler)"""
+
+
+def html_complete(text: str) -> bool:
+    """Whether a streamed answer already holds a whole document: its </html>, or the fence closing ```html"""
+    if "</html>" in text.lower():
+        return True
+    fence = text.find("```html")
+    return fence != -1 and text.find("```", fence + 7) != -1
+
+
+def _chunk_text(chunk) -> str:
+    # Chunks carrying only the finish reason or safety ratings have no text part
+    try:
+        return chunk.text
+    except ValueError:
+        return ''
+
+
 class GeminiService:
     """Handles image analysis using Gemini API"""
-    def __init__(self, api_key: str):
+
+    MAX_SIZE = (800, 800)
+
+    def __init__(
+        self,
+        api_key: str,
+        passthrough_max_bytes: int = 0,
+        passthrough_max_pixels: int = 1920 * 1080,
+        prepare_workers: Optional[int] = None,
+        batch_size: int = 1,
+        batch_wait: float = 0.5,
+        stream: bool = True,
+        deadline: Optional[float] = None
+    ):
+        """
+        passthrough_max_bytes: send the source bytes untouched when the file is at most this
+        size and at most passthrough_max_pixels pixels (0 disables passthrough).
+        batch_size: screenshots of one section per request (1 sends each on its own); all of
+        their HTML shares the 8192-token output limit, so keep it small.
+        batch_wait: seconds a partial batch waits for more screenshots before it is sent.
+        stream: read the answer as it is generated and stop once every expected document
+        has closed, instead of waiting for the model to finish.
+        deadline: wall-clock seconds allowed per generate_content call (None: no limit);
+        a call past it fails like any other failed analysis.
+        """
+        self.passthrough_max_bytes = passthrough_max_bytes
+        self.passthrough_max_pixels = passthrough_max_pixels
+        # PIL releases the GIL while decoding/resampling, so preparation scales with threads
+        self.executor = ThreadPoolExecutor(max_workers=prepare_workers or os.cpu_count())
+
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel(
-            model_name="gemini-2.0-flash-exp",
+            model_name=GEMINI_MODEL,
             generation_config={
                 "temperature": 1,
                 "top_p": 0.95,
@@ -23,19 +86,38 @@ class GeminiService:
                 "max_output_tokens": 8192,
             }
         )
+        self.scheduler = get_scheduler("gemini")
 
-    def _download_image(self, url: str) -> Optional[Image.Image]:
-        """Downloads image and returns PIL Image object"""
+        self.stream = stream
+        self.deadline = deadline
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._pending: Dict[ScreenType, List] = {}
+        self._batch_timers: Dict[ScreenType, asyncio.TimerHandle] = {}
+        self._batch_tasks = set()
+
+    def _download_image_bytes(self, url: str) -> Optional[bytes]:
+        """Downloads image and returns the encoded bytes"""
         try:
             response = requests.get(url)
             response.raise_for_status()
-            return Image.open(BytesIO(response.content))
+            return response.content
         except Exception as e:
             logger.error(f"Error downloading image from {url}: {str(e)}")
             return None
 
+    def _download_image(self, url: str) -> Optional[Image.Image]:
+        """Downloads image and returns PIL Image object"""
+        data = self._download_image_bytes(url)
+        return Image.open(BytesIO(data)) if data is not None else None
+
     def _prepare_image(self, image: Image.Image) -> bytes:
-        """Optimize image size and convert to bytes"""
+        """
+        Optimize image size and convert to bytes. Only used when a caller has
+        no payload of its own: label.py encodes uploads from the array its
+        feature extractor already decoded (encode_gemini_payload), so a
+        draft/reduce decoding mode here would never run.
+        """
         try:
             # Resize image
             max_size = (800, 800)
@@ -54,50 +136,249 @@ class GeminiService:
             logger.error(f"Error preparing image: {str(e)}")
             raise
 
-    async def analyze_layout(self, img_url: str, screen_type: ScreenType) -> Optional[str]:
-        """Analyzes an image using Gemini API and returns HTML string"""
+    def prepare_payload(self, data: bytes) -> Tuple[bytes, str]:
+        """Turn downloaded image bytes into the (bytes, mime_type) sent to Gemini"""
+        image = Image.open(BytesIO(data))  # header only, pixels are decoded lazily
+        mime_type = Image.MIME.get(image.format)
+        if (self.passthrough_max_bytes
+                and len(data) <= self.passthrough_max_bytes
+                and image.width * image.height <= self.passthrough_max_pixels
+                and mime_type in GEMINI_IMAGE_MIME_TYPES):
+            return data, mime_type
+
+        return self._prepare_image(image), 'image/jpeg'
+
+    def payload_options(self) -> Dict:
+        """Options of the 'gemini_payload' feature, for callers that encode the upload themselves"""
+        return {
+            'max_size': self.MAX_SIZE,
+            'passthrough_max_bytes': self.passthrough_max_bytes,
+            'passthrough_max_pixels': self.passthrough_max_pixels,
+        }
+
+    @staticmethod
+    def _extract_html(text: str) -> str:
+        """HTML document of a response (or of one screenshot's part of it); raises if there is none"""
+        text = text.strip()
+
+        # Find HTML block in markdown code blocks if present
+        if "```html" in text:
+            html_str = text.split("```html")[1].split("```")[0].strip()
+        elif "```" in text:
+            html_str = text.split("```")[1].strip()
+        else:
+            html_str = text
+
+        if not html_str or "<html" not in html_str:
+            raise ValueError("Response does not contain valid HTML")
+
+        return html_str
+
+    @staticmethod
+    def split_batch_response(text: str, count: int) -> List[Optional[str]]:
+        """One validated HTML document per screenshot of a batch response (None where missing or invalid)"""
+        documents: List[Optional[str]] = []
+        for n in range(1, count + 1):
+            match = re.search(
+                rf"<!--\s*BEGIN SCREENSHOT {n}\s*-->(.*?)<!--\s*END SCREENSHOT {n}\s*-->", text, re.DOTALL
+            )
+            try:
+                documents.append(GeminiService._extract_html(match.group(1)) if match else None)
+            except ValueError:
+                documents.append(None)
+        return documents
+
+    async def _get_payload(self, img_url: str, payload: Optional[Tuple[bytes, str]]) -> Tuple[bytes, str]:
+        if payload is not None:
+            return payload
+        # Download and prepare image (off the event loop so items can overlap)
+        data = await asyncio.to_thread(self._download_image_bytes, img_url)
+        if not data:
+            raise Exception(f"Failed to download image from {img_url}")
+
+        # Optimize image
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.prepare_payload, data)
+
+    def _call_model(self, contents: List, is_complete: Callable[[str], bool]) -> Tuple[str, Optional[int]]:
+        """
+        Blocking generate_content returning (text, total tokens). When streaming,
+        chunks are read until is_complete(text) holds; the rest of the answer is
+        never waited for. Runs in a scheduler worker thread.
+        """
+        start = time.monotonic()
+        kwargs = {'request_options': {'timeout': self.deadline}} if self.deadline else {}
+        try:
+            if not self.stream:
+                response = self.model.generate_content(contents, **kwargs)
+                return response.text, response.usage_metadata.total_token_count
+
+            text, tokens = '', None
+            for chunk in self.model.generate_content(contents, stream=True, **kwargs):
+                text += _chunk_text(chunk)
+                # Only the last chunk carries the final count; an early stop keeps the estimate
+                tokens = getattr(getattr(chunk, 'usage_metadata', None), 'total_token_count', None) or tokens
+                if is_complete(text):
+                    break
+                if self.deadline and time.monotonic() - start > self.deadline:
+                    raise GenerationDeadlineExceeded(f"No complete answer after {self.deadline:g}s")
+            return text, tokens
+
+        except GenerationDeadlineExceeded:
+            raise
+        except Exception as e:
+            # The transport's own timeout is retryable; past the deadline it is a failed call
+            if self.deadline and time.monotonic() - start >= self.deadline:
+                raise GenerationDeadlineExceeded(f"No complete answer after {self.deadline:g}s: {str(e)}") from e
+            raise
+
+    async def _generate(self, contents: List, tokens: int, is_complete: Callable[[str], bool] = html_complete) -> str:
+        """Answer text of generate_content under the shared Gemini quota"""
+        text, _ = await self.scheduler.run(
+            self._call_model,
+            contents,
+            is_complete,
+            tokens=tokens,
+            usage=lambda result: result[1]
+        )
+        return text
+
+    async def analyze_layout(
+        self,
+        img_url: str,
+        screen_type: ScreenType,
+        payload: Optional[Tuple[bytes, str]] = None
+    ) -> Optional[str]:
+        """
+        Analyzes an image using Gemini API and returns HTML string.
+        payload: (bytes, mime_type) already prepared by the feature extraction stage;
+        without it the image is downloaded and prepared here.
+        With batch_size > 1, concurrent calls of a section share one request.
+        """
+        if self.batch_size > 1:
+            return await self._analyze_layout_batched(img_url, screen_type, payload)
+        return await self._analyze_layout_single(img_url, screen_type, payload)
+
+    async def _analyze_layout_single(
+        self,
+        img_url: str,
+        screen_type: ScreenType,
+        payload: Optional[Tuple[bytes, str]] = None
+    ) -> Optional[str]:
+        """One screenshot per generate_content call"""
         try:
             # Get prompt for screen type
             prompt = SCREEN_PROMPTS.get(screen_type)
             if not prompt:
                 raise ValueError(f"No prompt defined for screen type: {screen_type}")
 
-            # Download and prepare image
-            image = self._download_image(img_url)
-            if not image:
-                raise Exception(f"Failed to download image from {img_url}")
-                
-            # Optimize image
-            image_bytes = self._prepare_image(image)
-            
-            # Generate response
-            response = self.model.generate_content([
-                prompt,
-                {
-                    "mime_type": "image/jpeg",
-                    "data": image_bytes
-                }
-            ])
+            image_bytes, mime_type = await self._get_payload(img_url, payload)
+
+            # Estimate: prompt + one image (258 tokens per 768px tile) + a typical HTML answer
+            text = await self._generate(
+                [
+                    prompt,
+                    {
+                        "mime_type": mime_type,
+                        "data": image_bytes
+                    }
+                ],
+                tokens=estimate_tokens(prompt) + IMAGE_TOKENS + ANSWER_TOKENS
+            )
             
             # Log raw response for debugging
-            logger.debug(f"Raw response: {response.text}")
+            logger.debug(f"Raw response: {text}")
             
             # Extract HTML from response
-            text = response.text.strip()
-            
-            # Find HTML block in markdown code blocks if present
-            if "```html" in text:
-                html_str = text.split("```html")[1].split("```")[0].strip()
-            elif "```" in text:
-                html_str = text.split("```")[1].strip()
-            else:
-                html_str = text
-                
-            if not html_str or "<html" not in html_str:
-                raise ValueError("Response does not contain valid HTML")
-                
-            return html_str
+            return self._extract_html(text)
             
         except Exception as e:
             logger.error(f"Error analyzing image: {str(e)}")
-            return None 
\ No newline at end of file
+            return None
+
+    async def analyze_layouts(
+        self,
+        items: List[Tuple[str, Optional[Tuple[bytes, str]]]],
+        screen_type: ScreenType
+    ) -> List[Optional[str]]:
+        """
+        Analyze several screenshots of one section in a single request: the
+        prompt is sent once and each image is preceded by a numbered marker.
+        Screenshots whose document is missing or invalid in the answer (or the
+        whole batch, if the request fails) fall back to single-image calls.
+        """
+        prompt = SCREEN_PROMPTS.get(screen_type)
+        if not prompt:
+            raise ValueError(f"No prompt defined for screen type: {screen_type}")
+
+        results: List[Optional[str]] = [None] * len(items)
+        try:
+            payloads = await asyncio.gather(*[self._get_payload(url, payload) for url, payload in items])
+            batch_prompt = prompt + BATCH_PROMPT_SUFFIX.format(count=len(items))
+            contents: List = [batch_prompt]
+            for n, (image_bytes, mime_type) in enumerate(payloads, 1):
+                contents += [f"SCREENSHOT {n}", {"mime_type": mime_type, "data": image_bytes}]
+            items = [(url, payload) for (url, _), payload in zip(items, payloads)]
+
+            last_marker = re.compile(rf"<!--\s*END SCREENSHOT {len(items)}\s*-->")
+            text = await self._generate(
+                contents,
+                tokens=estimate_tokens(batch_prompt) + len(items) * (IMAGE_TOKENS + ANSWER_TOKENS),
+                is_complete=lambda text: last_marker.search(text) is not None
+            )
+            logger.debug(f"Raw batch response: {text}")
+            results = self.split_batch_response(text, len(items))
+
+        except Exception as e:
+            logger.warning(f"Batch of {len(items)} screenshots failed, analyzing them one by one: {str(e)}")
+
+        missing = [i for i, html in enumerate(results) if html is None]
+        if missing and len(missing) < len(items):
+            logger.info(f"Batch answer missing {len(missing)}/{len(items)} screenshots, retrying them one by one")
+        retried = await asyncio.gather(*[
+            self._analyze_layout_single(items[i][0], screen_type, items[i][1]) for i in missing
+        ])
+        for i, html in zip(missing, retried):
+            results[i] = html
+        return results
+
+    async def _analyze_layout_batched(
+        self,
+        img_url: str,
+        screen_type: ScreenType,
+        payload: Optional[Tuple[bytes, str]] = None
+    ) -> Optional[str]:
+        """
+        Queue a screenshot for the next batch of its section. A batch is sent
+        once batch_size screenshots are waiting, or batch_wait seconds after
+        the first one arrived.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(screen_type, [])
+        pending.append((img_url, payload, future))
+        if len(pending) >= self.batch_size:
+            self._flush_batch(screen_type)
+        elif len(pending) == 1:
+            self._batch_timers[screen_type] = loop.call_later(self.batch_wait, self._flush_batch, screen_type)
+        return await future
+
+    def _flush_batch(self, screen_type: ScreenType):
+        timer = self._batch_timers.pop(screen_type, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(screen_type, [])
+        if batch:
+            task = asyncio.ensure_future(self._run_batch(batch, screen_type))
+            # Keep a reference until the batch is done
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch: List, screen_type: ScreenType):
+        try:
+            results = await self.analyze_layouts([(url, payload) for url, payload, _ in batch], screen_type)
+        except Exception as e:
+            logger.error(f"Error analyzing batch: {str(e)}")
+            results = [None] * len(batch)
+        for (_, _, future), html in zip(batch, results):
+            if not future.done():
+                future.set_result(html)
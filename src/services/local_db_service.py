@@ -0,0 +1,533 @@
+import json
+import sqlite3
+import logging
+import numpy as np
+from typing import Optional, List, Dict, Iterable, Tuple
+from .base_db_service import BaseDatabaseService
+from ..utils.layout_codec import layout_columns
+from ..utils.similarity import rank_hybrid
+from ..utils.vector_index import VECTOR_INDEXES
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+create table if not exists screens (
+    id integer primary key autoincrement,
+    img_url text not null,
+    section text,
+    site_url text,
+    date text,
+    is_public integer default 1
+);
+
+create table if not exists relative_screen (
+    id integer primary key autoincrement,
+    screen_id integer references screens(id),
+    section text not null,
+    site_url text not null,
+    img_url text not null,
+    layout_embedding blob,
+    color_embedding blob,
+    color_histogram text,
+    layout_data text,
+    layout_zstd text,
+    screen_related_ids text default '[]',
+    screen_related_scores text default '[]',
+    layout_minhash text,
+    image_hash text,
+    provenance text,
+    created_at text default current_timestamp,
+    updated_at text default current_timestamp
+);
+
+create index if not exists relative_screen_screen_id_idx on relative_screen(screen_id);
+create index if not exists relative_screen_section_idx on relative_screen(section);
+create index if not exists relative_screen_img_url_idx on relative_screen(img_url);
+create index if not exists relative_screen_site_url_idx on relative_screen(site_url);
+
+create table if not exists layout_dictionaries (
+    id integer primary key,
+    dictionary text not null,
+    created_at text default (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+);
+
+create table if not exists site_index (
+    id integer primary key autoincrement,
+    site_url text not null unique,
+    site_vector blob,
+    sections text,
+    config text,
+    updated_at text default current_timestamp
+);
+
+create table if not exists screen_analysis (
+    id integer primary key autoincrement,
+    screen_id integer,
+    section text,
+    webp_url text,
+    embedding blob,
+    screen_related_ids text default '[]'
+);
+
+create index if not exists screen_analysis_section_idx on screen_analysis(section);
+create index if not exists screen_analysis_webp_url_idx on screen_analysis(webp_url);
+"""
+
+# Columns stored as float32 blobs / JSON text, per table
+VECTOR_COLUMNS = {
+    'relative_screen': ('layout_embedding', 'color_embedding'),
+    'screen_analysis': ('embedding',),
+    'site_index': ('site_vector',),
+}
+JSON_COLUMNS = ('screen_related_ids', 'screen_related_scores', 'layout_minhash', 'color_histogram', 'provenance', 'sections')
+
+
+def encode_vector(vec) -> Optional[bytes]:
+    if vec is None:
+        return None
+    if isinstance(vec, str):
+        vec = json.loads(vec)
+    return np.asarray(vec, dtype=np.float32).tobytes()
+
+
+def decode_vector(blob: Optional[bytes]) -> Optional[np.ndarray]:
+    if blob is None:
+        return None
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+class LocalDatabaseService(BaseDatabaseService):
+    """
+    SQLite-backed storage for offline runs and reproducible benchmarks.
+    Vectors are stored as float32 blobs and matched in-process with numpy,
+    so match_screen_embeddings needs no database extension.
+    """
+
+    def __init__(self, path: str = ':memory:'):
+        super().__init__()
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.create_screen_section_analysis_table()
+
+    def create_screen_section_analysis_table(self):
+        """Creates the local tables if they don't exist"""
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        return True
+
+    def _row_to_dict(self, table: str, row: sqlite3.Row) -> Dict:
+        data = dict(row)
+        for column in VECTOR_COLUMNS.get(table, ()):
+            if column in data:
+                vec = decode_vector(data[column])
+                data[column] = vec.tolist() if vec is not None else None
+        for column in JSON_COLUMNS:
+            if isinstance(data.get(column), str):
+                data[column] = json.loads(data[column])
+        return data
+
+    def _select(self, table: str, where: str = '', params: Iterable = (), columns: str = '*', suffix: str = '') -> List[Dict]:
+        sql = f"select {columns} from {table}"
+        if where:
+            sql += f" where {where}"
+        if suffix:
+            sql += f" {suffix}"
+        return [self._row_to_dict(table, row) for row in self.conn.execute(sql, tuple(params))]
+
+    def insert(self, table: str, rows: List[Dict]) -> List[Dict]:
+        """Insert rows into a table, encoding vector and JSON columns"""
+        inserted = self._write(table, rows)
+        if not inserted:
+            return []
+        placeholders = ', '.join('?' for _ in inserted)
+        return self._select(table, f"id in ({placeholders})", inserted)
+
+    def _write(self, table: str, rows: List[Dict], replace: bool = False) -> List[int]:
+        inserted = []
+        verb = "insert or replace" if replace else "insert"
+        for values in rows:
+            data = dict(values)
+            for column in VECTOR_COLUMNS.get(table, ()):
+                if column in data:
+                    data[column] = encode_vector(data[column])
+            for column in JSON_COLUMNS:
+                if column in data and not isinstance(data[column], str):
+                    data[column] = json.dumps(data[column])
+            columns = ', '.join(data)
+            placeholders = ', '.join('?' for _ in data)
+            cursor = self.conn.execute(
+                f"{verb} into {table} ({columns}) values ({placeholders})",
+                tuple(data.values())
+            )
+            inserted.append(cursor.lastrowid)
+        self.conn.commit()
+        return inserted
+
+    def _update(self, table: str, row_id: int, values: Dict) -> List[Dict]:
+        data = dict(values)
+        for column in VECTOR_COLUMNS.get(table, ()):
+            if column in data:
+                data[column] = encode_vector(data[column])
+        for column in JSON_COLUMNS:
+            if column in data and not isinstance(data[column], str):
+                data[column] = json.dumps(data[column])
+        assignments = ', '.join(f"{column} = ?" for column in data)
+        self.conn.execute(
+            f"update {table} set {assignments} where id = ?",
+            (*data.values(), row_id)
+        )
+        self.conn.commit()
+        return self._select(table, "id = ?", (row_id,))
+
+    def _unprocessed(self, section: Optional[str], max_items: Optional[int]) -> List[Dict]:
+        where = "coalesce(is_public, 1) != 0 and date <= '2024-11-27'"
+        params = []
+        if section is not None:
+            where += " and section = ?"
+            params.append(section)
+        where += " and id not in (select screen_id from relative_screen where screen_id is not null)"
+        suffix = "order by date desc"
+        if max_items:
+            suffix += f" limit {int(max_items)}"
+        return [
+            {
+                "screen_id": item['id'],
+                "img_url": self.get_storage_url(item['img_url']),
+                "original_img_url": item['img_url'],
+                "site_url": item['site_url'],
+                "section": item['section']
+            }
+            for item in self._select('screens', where, params, 'id, img_url, section, site_url, date', suffix)
+        ]
+
+    async def get_unprocessed_screenshots(self, section: str, max_items: Optional[int] = None) -> List[Dict]:
+        """Get unprocessed screenshots of a section from screens table"""
+        return self._unprocessed(section, max_items)
+
+    async def get_all_unprocessed_screenshots(self, max_items: Optional[int] = None) -> List[Dict]:
+        """Get all unprocessed screenshots without filtering by section"""
+        return self._unprocessed(None, max_items)
+
+    async def mark_as_processed(self, screen_id: int, analysis_data: dict) -> Dict:
+        """Store analysis results in relative_screen table"""
+        if 'original_img_url' in analysis_data:
+            analysis_data['img_url'] = analysis_data.pop('original_img_url')
+        values = await self.pack_layout({"screen_id": screen_id, **analysis_data})
+        row = self.insert('relative_screen', [values])[0]
+        logger.info(f"Stored analysis for screen {screen_id}")
+        return (await self.unpack_layouts([row]))[0]
+
+    async def get_screens_by_type(
+        self,
+        section: str,
+        columns: str = '*',
+        id_range: Optional[Tuple[Optional[int], Optional[int]]] = None
+    ) -> List[Dict]:
+        """Get all processed screens of a specific type (optionally one id range, ordered by id)"""
+        columns = layout_columns(columns)
+        if id_range is None:
+            return await self.unpack_layouts(self._select('relative_screen', "section = ?", (section,), columns=columns))
+        where, params = "section = ?", [section]
+        start, end = id_range
+        if start is not None:
+            where += " and id >= ?"
+            params.append(start)
+        if end is not None:
+            where += " and id < ?"
+            params.append(end)
+        return await self.unpack_layouts(
+            self._select('relative_screen', where, tuple(params), columns=columns, suffix="order by id")
+        )
+
+    async def get_analysis_by_url(self, img_url: str) -> Optional[Dict]:
+        """Get analysis data by image URL"""
+        if img_url.startswith(self.storage_url):
+            img_url = img_url.replace(f"{self.storage_url}/", "")
+        rows = await self.unpack_layouts(self._select('relative_screen', "img_url = ?", (img_url,)))
+        return rows[0] if rows else None
+
+    async def get_analyses_by_type(self, section_type: str, limit: Optional[int] = None) -> List[Dict]:
+        """Get all analyses of a specific type"""
+        suffix = f"limit {int(limit)}" if limit else ''
+        return await self.unpack_layouts(self._select('relative_screen', "section = ?", (section_type,), suffix=suffix))
+
+    async def get_analyses(self, columns: str = '*', limit: Optional[int] = None) -> List[Dict]:
+        """Get relative_screen rows of every section"""
+        suffix = f"limit {int(limit)}" if limit else ''
+        return await self.unpack_layouts(self._select('relative_screen', columns=layout_columns(columns), suffix=suffix))
+
+    async def get_analyses_without_related_ids(self) -> List[Dict]:
+        """Get relative_screen rows whose screen_related_ids is still empty"""
+        return await self.unpack_layouts(self._select('relative_screen', "screen_related_ids = '[]'"))
+
+    async def update_analysis_embedding(self, analysis_id: int, layout_embedding: List[float], provenance: Optional[Dict] = None):
+        """Update layout embedding (and optionally the row's provenance) for a specific analysis"""
+        values = {'layout_embedding': layout_embedding}
+        if provenance is not None:
+            values['provenance'] = provenance
+        return self._update('relative_screen', analysis_id, values)
+
+    async def update_layout_data(
+        self,
+        analysis_id: int,
+        layout_data: str,
+        layout_embedding: Optional[List[float]],
+        layout_minhash: List[int],
+        provenance: Dict
+    ):
+        """Replace the Gemini layout of a specific analysis together with the features derived from it"""
+        return self._update('relative_screen', analysis_id, await self.pack_layout({
+            'layout_data': layout_data,
+            'layout_embedding': layout_embedding,
+            'layout_minhash': layout_minhash,
+            'provenance': provenance
+        }))
+
+    async def update_layout_storage(self, analysis_id: int, layout_data: Optional[str], layout_zstd: Optional[str]):
+        """Rewrite how a row stores its layout: plain layout_data or a compressed layout_zstd frame"""
+        self._update('relative_screen', analysis_id, {'layout_data': layout_data, 'layout_zstd': layout_zstd})
+
+    async def get_layout_dictionaries(self) -> List[Dict]:
+        """id and base64 dictionary of every layout compression dictionary, oldest first"""
+        return self._select('layout_dictionaries', columns='id, dictionary', suffix="order by created_at")
+
+    async def store_layout_dictionary(self, dict_id: int, dictionary: str) -> Dict:
+        """Store a trained layout dictionary; later compressed writes use it"""
+        self._write('layout_dictionaries', [{'id': dict_id, 'dictionary': dictionary}], replace=True)
+        self._layout_codec = None
+        return {'id': dict_id}
+
+    async def get_stale_analyses(
+        self,
+        feature: str,
+        expected: Dict[str, str],
+        section: Optional[str] = None,
+        columns: str = '*',
+        limit: Optional[int] = None
+    ) -> List[Dict]:
+        """relative_screen rows whose provenance[feature] differs from `expected` in any key (or is missing)"""
+        # `is not` is true for NULL, which covers rows without provenance
+        where = ' or '.join(f"json_extract(provenance, '$.{feature}.{key}') is not ?" for key in expected)
+        params = list(expected.values())
+        if section:
+            where = f"section = ? and ({where})"
+            params.insert(0, section)
+        suffix = f"limit {int(limit)}" if limit else ''
+        return await self.unpack_layouts(
+            self._select('relative_screen', where, params, columns=layout_columns(columns), suffix=suffix)
+        )
+
+    async def get_analyses_by_ids(self, analysis_ids: List[int]) -> List[Dict]:
+        """Get relative_screen rows by id"""
+        if not analysis_ids:
+            return []
+        placeholders = ', '.join('?' for _ in analysis_ids)
+        return await self.unpack_layouts(self._select('relative_screen', f"id in ({placeholders})", analysis_ids))
+
+    async def get_layout_fingerprints(self, section: str) -> List[Dict]:
+        """Get id and layout_minhash of every relative_screen row of a section"""
+        return self._select('relative_screen', "section = ?", (section,), columns='id, layout_minhash')
+
+    async def update_layout_minhash(self, analysis_id: int, layout_minhash: List[int], provenance: Optional[Dict] = None):
+        """Update layout MinHash signature (and optionally the row's provenance) for a specific analysis"""
+        values = {'layout_minhash': layout_minhash}
+        if provenance is not None:
+            values['provenance'] = provenance
+        return self._update('relative_screen', analysis_id, values)
+
+    async def get_image_hashes(self, section: str) -> List[Dict]:
+        """Get id, site_url and image_hash of every relative_screen row of a section"""
+        return self._select('relative_screen', "section = ?", (section,), columns='id, site_url, image_hash')
+
+    async def update_image_hash(self, analysis_id: int, image_hash: str):
+        """Update perceptual image hash for a specific analysis"""
+        return self._update('relative_screen', analysis_id, {'image_hash': image_hash})
+
+    async def update_color_embedding(
+        self,
+        analysis_id: int,
+        color_embedding: Optional[List[float]],
+        color_histogram: Optional[Dict] = None,
+        provenance: Optional[Dict] = None
+    ):
+        """Update color embedding (and optionally its sparse histogram and the row's provenance) for a specific analysis"""
+        values = {'color_embedding': color_embedding} if color_embedding is not None else {}
+        if color_histogram is not None:
+            values['color_histogram'] = color_histogram
+        if provenance is not None:
+            values['provenance'] = provenance
+        return self._update('relative_screen', analysis_id, values)
+
+    async def update_screen_related_ids(self, screen_id: int, related_ids: List[int], related_scores: Optional[List[float]] = None):
+        """Update related screen IDs (and optionally their scores) for a specific relative_screen row"""
+        values = {'screen_related_ids': related_ids}
+        if related_scores is not None:
+            values['screen_related_scores'] = related_scores
+        return self._update('relative_screen', screen_id, values)
+
+    async def get_all_sections(self) -> List[str]:
+        """Get list of all unique sections from database"""
+        rows = self.conn.execute("select distinct section from screens where section is not null")
+        return [row['section'] for row in rows]
+
+    async def get_screen_analyses(self, columns: str = '*', limit: Optional[int] = None) -> List[Dict]:
+        """Get screen_analysis rows of every section"""
+        suffix = f"limit {int(limit)}" if limit else ''
+        return self._select('screen_analysis', columns=columns, suffix=suffix)
+
+    async def get_analyses_by_site(self, site_urls: List[str], columns: str = '*') -> List[Dict]:
+        """relative_screen rows of every section of the given sites"""
+        if not site_urls:
+            return []
+        placeholders = ', '.join('?' for _ in site_urls)
+        return await self.unpack_layouts(
+            self._select('relative_screen', f"site_url in ({placeholders})", site_urls, columns=layout_columns(columns))
+        )
+
+    async def upsert_site_vectors(self, rows: List[Dict]) -> int:
+        """Insert or replace site_index rows (keyed by site_url)"""
+        for values in rows:
+            data = {
+                'site_url': values['site_url'],
+                'site_vector': encode_vector(values.get('site_vector')),
+                'sections': json.dumps(values.get('sections') or {}),
+                'config': values.get('config'),
+            }
+            # Upsert in place so the row keeps its id (get_rows_page pages by id)
+            self.conn.execute(
+                "insert into site_index (site_url, site_vector, sections, config) values (?, ?, ?, ?) "
+                "on conflict(site_url) do update set site_vector = excluded.site_vector, "
+                "sections = excluded.sections, config = excluded.config, updated_at = current_timestamp",
+                tuple(data.values())
+            )
+        self.conn.commit()
+        return len(rows)
+
+    async def get_rows_page(
+        self,
+        table: str,
+        after_id: int = 0,
+        limit: int = 1000,
+        columns: str = '*',
+        section: Optional[str] = None,
+        before_id: Optional[int] = None
+    ) -> List[Dict]:
+        """Next `limit` rows of a table with id > after_id, ordered by id (keyset paging)"""
+        where, params = "id > ?", [after_id]
+        if section is not None:
+            where += " and section = ?"
+            params.append(section)
+        if before_id is not None:
+            where += " and id < ?"
+            params.append(before_id)
+        return self._select(table, where, params, columns=columns, suffix=f"order by id limit {int(limit)}")
+
+    async def insert_rows(self, table: str, rows: List[Dict], upsert: bool = True) -> int:
+        """Bulk-write rows into a table, replacing rows with the same id when upsert is set"""
+        return len(self._write(table, rows, replace=upsert))
+
+    async def get_vector_index_stats(self) -> List[Dict]:
+        """Row counts of the embedding columns; the local backend always scans exactly"""
+        stats = []
+        for (table, column) in VECTOR_INDEXES:
+            row_count = self.conn.execute(f"select count({column}) from {table}").fetchone()[0]
+            stats.append({
+                "table_name": table,
+                "column_name": column,
+                "row_count": row_count,
+                "index_name": None,
+                "index_method": None,
+                "index_definition": None,
+                "probes": None,
+                "ef_search": None
+            })
+        return stats
+
+    async def get_screen_analysis(self, webp_url: str, section: str) -> Optional[Dict]:
+        """Get a screen_analysis row by webp_url and section"""
+        rows = self._select('screen_analysis', "webp_url = ? and section = ?", (webp_url, section))
+        return rows[0] if rows else None
+
+    async def get_screen_analyses_without_related_ids(self) -> List[Dict]:
+        """Get screen_analysis rows whose screen_related_ids is still empty"""
+        return self._select('screen_analysis', "screen_related_ids = '[]'")
+
+    async def update_screen_analysis_related_ids(self, analysis_id: int, related_ids: List[int]):
+        """Update related screen IDs for a specific screen_analysis row"""
+        return self._update('screen_analysis', analysis_id, {'screen_related_ids': related_ids})
+
+    async def match_screen_embeddings(
+        self,
+        query_embedding: List[float],
+        section_type: str,
+        match_threshold: float,
+        match_count: int,
+        search_effort: float = 1.0
+    ) -> List[Dict]:
+        """
+        Rank screen_analysis rows of a section by cosine similarity (match_screen_embeddings RPC).
+        The scan is exact, so search_effort has no effect here.
+        """
+        rows = self.conn.execute(
+            "select screen_id, webp_url, embedding from screen_analysis "
+            "where embedding is not null and section = ?",
+            (section_type,)
+        ).fetchall()
+        if not rows:
+            return []
+
+        matrix = np.stack([decode_vector(row['embedding']) for row in rows])
+        query = np.asarray(query_embedding, dtype=np.float32)
+        similarity = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+
+        candidates = np.flatnonzero(similarity > match_threshold)
+        top = candidates[np.argsort(-similarity[candidates], kind='stable')[:match_count]]
+        return [
+            {"screen_id": rows[i]['screen_id'], "webp_url": rows[i]['webp_url'], "similarity": float(similarity[i])}
+            for i in top
+        ]
+
+    async def match_relative_screens(
+        self,
+        query_layout: Optional[List[float]],
+        query_color: Optional[List[float]],
+        section_type: str,
+        weight_layout: float = 0.5,
+        weight_color: float = 0.5,
+        match_count: int = 5,
+        candidate_count: int = 200,
+        exclude_id: Optional[int] = None,
+        exclude_img_url: Optional[str] = None
+    ) -> List[Dict]:
+        """Top relative_screen ids of a section by combined layout + color score (match_relative_screens RPC)"""
+        where = "section = ?"
+        params = [section_type]
+        if exclude_id is not None:
+            where += " and id != ?"
+            params.append(exclude_id)
+        if exclude_img_url is not None:
+            where += " and img_url is not ?"
+            params.append(exclude_img_url)
+        if query_layout is not None:
+            where += " and layout_embedding is not null"
+        if query_color is not None:
+            where += " and color_embedding is not null"
+        rows = self.conn.execute(
+            f"select id, layout_embedding, color_embedding from relative_screen where {where}",
+            params
+        ).fetchall()
+        if not rows:
+            return []
+
+        return rank_hybrid(
+            [row['id'] for row in rows],
+            np.stack([decode_vector(row['layout_embedding']) for row in rows]) if query_layout is not None else None,
+            np.stack([decode_vector(row['color_embedding']) for row in rows]) if query_color is not None else None,
+            query_layout,
+            query_color,
+            weight_layout,
+            weight_color,
+            match_count,
+            candidate_count
+        )
@@ -1,29 +1,73 @@
-from typing import Dict, List, Optional
-from ..types.screen import ScreenType, ScreenAnalysis, SearchOptions, SearchResult
+import json
+import time
+import asyncio
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from ..types.screen import ScreenType, ScreenAnalysis, SearchOptions, SearchResponse, SearchResult
 from ..utils.embeddings import EmbeddingProcessor
-from ..utils.color_histogram import get_color_histogram_embedding
-from ..utils.similarity import calculate_cosine_similarity, calculate_histogram_similarity
+from ..utils.color_histogram import get_color_histogram_embedding, download_image_bytes
+from ..utils.image_features import FeatureExtractor, get_feature_extractor
+from ..utils.perceptual_hash import BKTree, hex_to_hash
+from ..utils.similarity import calculate_cosine_similarity, calculate_histogram_similarity, combine_scores
+from ..utils.sparse_histogram import to_sparse, sparse_histogram_similarity
+from ..utils.layout_fingerprint import LayoutLSHIndex, get_layout_minhash, estimate_jaccard
+from ..utils.layout_canonical import canonicalize_layout, canonical_hash
+from ..utils.section_corpus import SectionCorpus, CORPUS_COLUMNS, merge_matches
+from ..utils.color_index import intersect_positions, parse_palette
+from ..utils.provenance import build_provenance
 from .base_service import BaseScreenService
 from .gemini_service import GeminiService
-from .db_service import DatabaseService
+from .base_db_service import BaseDatabaseService
+from .unified_index_service import UnifiedIndexService, resolve_sections
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Rows scored between deadline checks of a bounded corpus scan
+SCAN_CHUNK_ROWS = 8192
+# Ids per get_analyses_by_ids call when backfilling signatures (the id list goes into the URL)
+MINHASH_FILL_BATCH = 200
+
 class ScreenService(BaseScreenService):
     """Generic service for handling different screen types"""
     
-    def __init__(self, section: ScreenType, gemini_service: Optional[GeminiService] = None, db_service: Optional[DatabaseService] = None):
+    def __init__(
+        self,
+        section: ScreenType,
+        gemini_service: Optional[GeminiService] = None,
+        db_service: Optional[BaseDatabaseService] = None,
+        duplicate_max_distance: Optional[int] = None,
+        feature_extractor: Optional[FeatureExtractor] = None,
+        shard_service: Optional['ShardedIndexService'] = None,
+        unified_index: Optional[UnifiedIndexService] = None
+    ):
         self.section = section
         self.gemini_service = gemini_service
         self.db_service = db_service
         self.embedding_processor = EmbeddingProcessor()
+        self._fingerprint_index: Optional[LayoutLSHIndex] = None
+        # Hamming distance under which a screenshot reuses a labeled row's layout (None disables)
+        self.duplicate_max_distance = duplicate_max_distance
+        # One BK-tree per site_url: only re-captures of the same site share a layout
+        self._duplicate_index: Optional[Dict[str, BKTree]] = None
+        self._duplicate_index_lock = asyncio.Lock()
+        self._corpus: Optional[SectionCorpus] = None
+        self._corpus_lock = asyncio.Lock()
+        # Background load started by a deadline-bounded search on a cold corpus
+        self._corpus_task: Optional[asyncio.Future] = None
+        self._materialize_seconds = 0.0
+        self.feature_extractor = feature_extractor or get_feature_extractor()
+        # Scatter-gather search over worker processes instead of the in-process corpus
+        self.shard_service = shard_service
+        # Every section in one corpus, for searches given options.sections (shared by ServiceFactory)
+        self.unified_index = unified_index
         
-    async def analyze_layout(self, img_url: str) -> Dict:
+    async def analyze_layout(self, img_url: str, payload: Optional[Tuple[bytes, str]] = None) -> Dict:
         """Analyze layout using Gemini Vision API"""
         layout_data = await self.gemini_service.analyze_layout(
             img_url=img_url,
-            screen_type=self.section
+            screen_type=self.section,
+            payload=payload
         )
         if layout_data is None:
             raise Exception("Failed to analyze layout")
@@ -36,42 +80,468 @@ class ScreenService(BaseScreenService):
     async def get_color_embedding(self, img_url: str) -> List[float]:
         """Get color histogram embedding"""
         return await get_color_histogram_embedding(img_url)
+
+    async def extract_image_features(self, img_url: str) -> Dict:
+        """
+        Download a screenshot and decode it once for every CPU feature:
+        source hash, perceptual hash, color histogram and (with Gemini) its upload payload.
+        """
+        data = await asyncio.to_thread(download_image_bytes, img_url)
+        features = ['source_sha256', 'image_hash', 'color_histogram']
+        options = {}
+        if self.gemini_service is not None:
+            features.append('gemini_payload')
+            options['gemini_payload'] = self.gemini_service.payload_options()
+        return await self.feature_extractor.extract(data, img_url, features, options)
+
+    def get_layout_minhash(self, layout_data: str) -> List[int]:
+        """Get structural MinHash signature of the layout HTML (no API call)"""
+        return get_layout_minhash(layout_data)
+
+    async def get_fingerprint_index(self) -> LayoutLSHIndex:
+        """LSH index over the stored layout signatures of this section, built on first use"""
+        if self._fingerprint_index is None:
+            index = LayoutLSHIndex()
+            for row in await self.db_service.get_layout_fingerprints(self.section):
+                if row.get('layout_minhash'):
+                    index.add(row['id'], row['layout_minhash'])
+            self._fingerprint_index = index
+            logger.info(f"Built layout fingerprint index for {self.section}: {len(index)} rows")
+        return self._fingerprint_index
+
+    def invalidate_fingerprint_index(self):
+        """Drop the cached LSH index so the next search rebuilds it"""
+        self._fingerprint_index = None
     
+    async def get_corpus(self) -> SectionCorpus:
+        """Columnar corpus of this section (no layout_data), built on first use"""
+        async with self._corpus_lock:
+            if self._corpus is None:
+                rows = await self.db_service.get_all_rows('relative_screen', columns=CORPUS_COLUMNS, section=self.section)
+                self._corpus = SectionCorpus.from_rows(rows)
+                logger.info(f"Loaded {self.section} corpus: {len(self._corpus)} rows, {self._corpus.nbytes / 1e6:.1f} MB")
+        return self._corpus
+
+    def invalidate_corpus(self):
+        """Drop the cached corpus so the next search reloads the section"""
+        self._corpus = None
+        self._corpus_task = None
+
+    async def fill_corpus_minhashes(self, corpus: SectionCorpus):
+        """Compute signatures for rows stored without one, fetching their layout_data once"""
+        missing = corpus.missing_minhash_ids()
+        if not missing:
+            return
+        logger.info(f"Computing layout signatures of {len(missing)} {self.section} rows stored without one")
+        for start in range(0, len(missing), MINHASH_FILL_BATCH):
+            for row in await self.db_service.get_analyses_by_ids(missing[start:start + MINHASH_FILL_BATCH]):
+                if row.get('layout_data'):
+                    corpus.set_minhash(row['id'], self.get_layout_minhash(row['layout_data']))
+
+    async def get_duplicate_index(self, site_url: str) -> Optional[BKTree]:
+        """BK-tree over the stored image hashes of this section's rows of `site_url` (the section is loaded on first use)"""
+        async with self._duplicate_index_lock:
+            if self._duplicate_index is None:
+                index: Dict[str, BKTree] = {}
+                for row in await self.db_service.get_image_hashes(self.section):
+                    if row.get('image_hash') and row.get('site_url'):
+                        index.setdefault(row['site_url'], BKTree()).add(hex_to_hash(row['image_hash']), row['id'])
+                self._duplicate_index = index
+                logger.info(
+                    f"Built duplicate index for {self.section}: "
+                    f"{sum(len(tree) for tree in index.values())} rows of {len(index)} sites"
+                )
+        return self._duplicate_index.get(site_url)
+
+    def register_image_hash(self, analysis_id: int, image_hash: Optional[str], site_url: Optional[str]):
+        """Make a newly stored row available as a duplicate source for its site"""
+        if image_hash and site_url and self._duplicate_index is not None:
+            self._duplicate_index.setdefault(site_url, BKTree()).add(hex_to_hash(image_hash), analysis_id)
+
+    async def find_duplicate(self, image_hash: str, site_url: str) -> Optional[Dict]:
+        """Closest labeled row of the same site within duplicate_max_distance that has layout data"""
+        index = await self.get_duplicate_index(site_url)
+        matches = index.find(hex_to_hash(image_hash), self.duplicate_max_distance) if index is not None else []
+        if not matches:
+            return None
+        rows = await self.db_service.get_analyses_by_ids([key for _, key in matches[:5]])
+        rows_by_id = {row['id']: row for row in rows}
+        for distance, key in matches[:5]:
+            row = rows_by_id.get(key)
+            if row and row.get('layout_data') and row.get('site_url') == site_url:
+                logger.info(f"Near-duplicate of {row['img_url']} (distance {distance})")
+                return row
+        return None
+
+    async def analyze_duplicate(self, img_url: str, site_url: str) -> ScreenAnalysis:
+        """Reuse the layout of a near-duplicate labeled screenshot, computing only the color histogram"""
+        features = await self.extract_image_features(img_url)
+        image_hash = features['image_hash']
+        color_embedding = features['color_histogram']
+        source_sha256 = features['source_sha256']
+
+        duplicate = await self.find_duplicate(image_hash, site_url)
+        if duplicate is None:
+            return await self.analyze_new(img_url, site_url, features=features)
+
+        layout_embedding = duplicate.get('layout_embedding')
+        if isinstance(layout_embedding, str):
+            layout_embedding = json.loads(layout_embedding)
+        layout_data = duplicate['layout_data']
+        # The layout features keep the provenance of the row they were copied from
+        reused = {
+            feature: entry for feature, entry in (duplicate.get('provenance') or {}).items()
+            if feature in ('layout_data', 'layout_embedding', 'layout_minhash')
+        }
+        stored = ['color_histogram'] if duplicate.get('layout_minhash') else ['color_histogram', 'layout_minhash']
+        return ScreenAnalysis(
+            section=self.section,
+            site_url=site_url,
+            img_url=img_url,
+            layout_embedding=layout_embedding,
+            color_embedding=color_embedding,
+            color_histogram=to_sparse(color_embedding).to_dict(),
+            layout_data=layout_data,
+            layout_minhash=duplicate.get('layout_minhash') or self.get_layout_minhash(layout_data),
+            image_hash=image_hash,
+            provenance=build_provenance(self.section, stored, source_sha256, base=reused),
+            duplicate_of=duplicate['id']
+        )
+
+    async def analyze_new(
+        self,
+        img_url: str,
+        site_url: str,
+        features: Optional[Dict] = None
+    ) -> ScreenAnalysis:
+        """Run Gemini and the embeddings for a screenshot (features: output of extract_image_features)"""
+        if features is None:
+            features = await self.extract_image_features(img_url)
+        color_embedding = features['color_histogram']
+
+        # Get layout analysis from the payload encoded alongside the histogram; only the
+        # canonical form is embedded and stored
+        layout_data = canonicalize_layout(await self.analyze_layout(img_url, features.get('gemini_payload')))
+
+        layout_minhash = self.get_layout_minhash(layout_data)
+
+        # Get embeddings; without a layout embedding, search falls back to the MinHash signature
+        try:
+            layout_embedding = await self.get_layout_embedding(layout_data)
+        except Exception as e:
+            logger.warning(f"Layout embedding unavailable, storing fingerprint only: {str(e)}")
+            layout_embedding = None
+
+        stored = ['layout_data', 'layout_minhash', 'color_histogram']
+        if layout_embedding is not None:
+            stored.append('layout_embedding')
+        provenance = build_provenance(self.section, stored, features['source_sha256'])
+        provenance['layout_data']['canonical_sha256'] = canonical_hash(layout_data)
+        
+        # Create and return analysis
+        return ScreenAnalysis(
+            section=self.section,
+            site_url=site_url,
+            img_url=img_url,
+            layout_embedding=layout_embedding,
+            color_embedding=color_embedding,
+            color_histogram=to_sparse(color_embedding).to_dict(),
+            layout_data=layout_data,
+            layout_minhash=layout_minhash,
+            image_hash=features['image_hash'],
+            provenance=provenance
+        )
+
     async def analyzeAndStore(self, img_url: str, site_url: str) -> ScreenAnalysis:
         """Analyze and store screen data"""
         try:
-            # Get layout analysis
-            layout_data = await self.analyze_layout(img_url)
-            
-            # Get embeddings
-            layout_embedding = await self.get_layout_embedding(layout_data)
-            color_embedding = await self.get_color_embedding(img_url)
-            
-            # Create and return analysis
-            return ScreenAnalysis(
-                section=self.section,
-                site_url=site_url,
-                img_url=img_url,
-                layout_embedding=layout_embedding,
-                color_embedding=color_embedding,
-                layout_data=layout_data
-            )
+            if self.duplicate_max_distance is not None:
+                return await self.analyze_duplicate(img_url, site_url)
+            return await self.analyze_new(img_url, site_url)
         except Exception as e:
             logger.error(f"Error in analyzeAndStore: {str(e)}")
             raise
     
+    @staticmethod
+    def _to_analysis(screen_data: Dict) -> ScreenAnalysis:
+        # Convert string embeddings to list
+        for column in ('layout_embedding', 'color_embedding'):
+            if isinstance(screen_data.get(column), str):
+                screen_data[column] = json.loads(screen_data[column])
+        return ScreenAnalysis(**screen_data)
+
+    async def search_similar_server_side(
+        self,
+        target_screen: ScreenAnalysis,
+        options: SearchOptions
+    ) -> List[SearchResult]:
+        """Rank in the database with match_relative_screens, then fetch only the matched rows"""
+        matches = await self.db_service.match_relative_screens(
+            query_layout=target_screen.layout_embedding if options.search_layout else None,
+            query_color=target_screen.color_embedding if options.search_color else None,
+            section_type=self.section,
+            weight_layout=options.weight_layout,
+            weight_color=options.weight_color,
+            match_count=options.limit,
+            candidate_count=max(options.candidate_count, options.limit),
+            exclude_id=target_screen.id,
+            exclude_img_url=target_screen.img_url
+        )
+        return await self._materialize(matches)
+
+    async def rank_corpus(
+        self,
+        corpus: SectionCorpus,
+        target_screen: ScreenAnalysis,
+        options: SearchOptions
+    ) -> List[Dict]:
+        """
+        Top `limit` matches of a corpus as {id, score, layout_score, color_score}.
+        Color candidates and palette filters restrict scoring to rows found
+        through the dominant-color index.
+        """
+        matches, _, _ = await self.scan_corpus(corpus, target_screen, options)
+        return matches
+
+    async def scan_corpus(
+        self,
+        corpus: SectionCorpus,
+        target_screen: ScreenAnalysis,
+        options: SearchOptions,
+        deadline: Optional[float] = None
+    ) -> Tuple[List[Dict], int, int]:
+        """
+        rank_corpus bounded by a time.monotonic() deadline: rows are scored in
+        strided chunks (each spread over the whole section) until time is up,
+        at least one chunk. Returns (matches, rows scored, rows the exact search scores).
+        """
+        target_histogram = to_sparse(target_screen.color_histogram or target_screen.color_embedding)
+        positions = None
+        if options.candidate_source == 'color':
+            positions = corpus.color_index().candidates(target_histogram)
+        if options.palette:
+            positions = intersect_positions(
+                positions, corpus.color_index().palette_filter(parse_palette(options.palette), options.palette_match)
+            )
+        # Whole-corpus scans score without fancy indexing (no copy of the matrices)
+        whole = positions is None
+        rows = np.arange(len(corpus)) if whole else positions
+        total = len(rows)
+
+        target_minhash = target_screen.layout_minhash or self.get_layout_minhash(target_screen.layout_data)
+        use_minhash = options.layout_similarity == 'minhash'
+        cosine_only = not use_minhash and target_screen.layout_embedding is not None
+        if options.search_layout and not (cosine_only and corpus.has_layout.all()):
+            if deadline is None or not corpus.missing_minhash_ids():
+                await self.fill_corpus_minhashes(corpus)
+            else:
+                # Fetching layout_data to sign the missing rows is not worth the budget: skip those rows
+                scorable = (corpus.has_layout | corpus.has_minhash) if cosine_only else corpus.has_minhash
+                rows = rows[scorable[rows]]
+                whole = False
+
+        chunks = 1 if deadline is None else max(1, -(-len(rows) // SCAN_CHUNK_ROWS))
+        best: List[Tuple] = []
+        scanned = 0
+        for i in range(chunks):
+            # Strided so a partial scan still samples the whole section
+            chunk = rows[i::chunks] if chunks > 1 else rows
+            scores, layout_scores, color_scores = corpus.score(
+                target_screen.layout_embedding,
+                target_minhash,
+                target_histogram,
+                search_layout=options.search_layout,
+                search_color=options.search_color,
+                weight_layout=options.weight_layout,
+                weight_color=options.weight_color,
+                use_minhash=use_minhash,
+                positions=None if whole and chunks == 1 else chunk
+            )
+            top = corpus.top_k(
+                scores, options.limit, exclude_img_url=target_screen.img_url,
+                positions=None if whole and chunks == 1 else chunk
+            )
+            for j in top:
+                best.append((
+                    -float(scores[j]),
+                    int(chunk[j]),
+                    float(layout_scores[j]) if layout_scores is not None else None,
+                    float(color_scores[j]) if color_scores is not None else None,
+                ))
+            # Ties stay in corpus order, as in a single full scan
+            best = sorted(best)[:options.limit]
+            scanned += len(chunk)
+            if deadline is not None and i + 1 < chunks:
+                if time.monotonic() >= deadline:
+                    break
+                await asyncio.sleep(0)
+
+        matches = [
+            {'id': int(corpus.ids[pos]), 'score': -neg_score, 'layout_score': layout_score, 'color_score': color_score}
+            for neg_score, pos, layout_score, color_score in best
+        ]
+        return matches, scanned, total
+
+    async def _materialize(self, matches: List[Dict]) -> List[SearchResult]:
+        """Fetch the full rows of ranked matches, keeping their order"""
+        start = time.monotonic()
+        rows = await self.db_service.get_analyses_by_ids([match['id'] for match in matches])
+        # Kept out of the scan budget of deadline-bounded searches
+        self._materialize_seconds = 0.8 * self._materialize_seconds + 0.2 * (time.monotonic() - start)
+        rows_by_id = {row['id']: row for row in rows}
+
+        results = []
+        for match in matches:
+            screen_data = rows_by_id.get(match['id'])
+            if screen_data is None:
+                continue
+            results.append(SearchResult(
+                screen=self._to_analysis(screen_data),
+                score=match['score'],
+                layout_score=match.get('layout_score'),
+                color_score=match.get('color_score')
+            ))
+        return results
+
+    async def search_similar_corpus(
+        self,
+        target_screen: ScreenAnalysis,
+        options: SearchOptions,
+        deadline: Optional[float] = None
+    ) -> SearchResponse:
+        """
+        Score the section on the columnar corpus (or its shards, when a shard
+        service is attached) and materialize only the top `limit` rows
+        """
+        # The time the final row fetch is expected to take is kept out of the scan
+        scan_deadline = None if deadline is None else deadline - self._materialize_seconds
+        if self.shard_service is not None:
+            timeout = None if deadline is None else max(0.0, scan_deadline - time.monotonic())
+            matches, coverage = await self.shard_service.search(self.section, target_screen, options, timeout)
+        elif deadline is not None and self._corpus is None and not options.palette:
+            return await self._search_cold(target_screen, options, deadline)
+        else:
+            matches, scanned, total = await self.scan_corpus(
+                await self.get_corpus(), target_screen, options, scan_deadline
+            )
+            coverage = scanned / total if total else 1.0
+        return SearchResponse(results=await self._materialize(matches), degraded=coverage < 1, coverage=coverage)
+
+    async def search_across_sections(
+        self,
+        target_screen: ScreenAnalysis,
+        options: SearchOptions,
+        deadline: Optional[float] = None
+    ) -> SearchResponse:
+        """
+        Score the options.sections partitions of the unified index in one pass
+        (the target's own section takes part only when listed) and materialize
+        the top `limit` rows
+        """
+        if self.unified_index is None:
+            self.unified_index = UnifiedIndexService(self.db_service)
+        unified = await self.unified_index.get_corpus()
+        sections = resolve_sections(options.sections)
+        scan_deadline = None if deadline is None else deadline - self._materialize_seconds
+
+        partition_matches = []
+        scanned = total = 0
+        for view in unified.views(sections):
+            if scan_deadline is not None and partition_matches and time.monotonic() >= scan_deadline:
+                total += len(view)
+                continue
+            matches, view_scanned, view_total = await self.scan_corpus(view, target_screen, options, scan_deadline)
+            partition_matches.append(matches)
+            scanned += view_scanned
+            total += view_total
+        coverage = scanned / total if total else 1.0
+        return SearchResponse(
+            results=await self._materialize(merge_matches(partition_matches, options.limit)),
+            degraded=coverage < 1,
+            coverage=coverage
+        )
+
+    async def _search_cold(self, target_screen: ScreenAnalysis, options: SearchOptions, deadline: float) -> SearchResponse:
+        """
+        Deadline-bounded search before the corpus is loaded: answer from the
+        database ranking (approximate nearest layout candidates) while the
+        corpus loads in the background for the next query
+        """
+        if self._corpus_task is None:
+            self._corpus_task = asyncio.ensure_future(self.get_corpus())
+        try:
+            results = await asyncio.wait_for(
+                self.search_similar_server_side(target_screen, options),
+                timeout=max(0.0, deadline - time.monotonic())
+            )
+            return SearchResponse(results=results, degraded=True, coverage=None)
+        except asyncio.TimeoutError:
+            logger.warning(f"Search of {self.section} missed its {options.deadline_ms:g} ms deadline with a cold corpus")
+            return SearchResponse(results=[], degraded=True, coverage=0.0)
+
+    async def search(
+        self,
+        target_screen: ScreenAnalysis,
+        options: SearchOptions
+    ) -> SearchResponse:
+        """
+        Search for similar screens. With options.deadline_ms, a search that
+        cannot finish in time returns the best results of a partial scan (or
+        of a cheaper approximate path) marked degraded, with the fraction of
+        the section it covered.
+        """
+        deadline = time.monotonic() + options.deadline_ms / 1000 if options.deadline_ms else None
+        if options.sections:
+            return await self.search_across_sections(target_screen, options, deadline)
+        # Palette filters need the dominant-color index, which lives on the corpus
+        if options.server_side and not options.palette:
+            if deadline is None:
+                return SearchResponse(results=await self.search_similar_server_side(target_screen, options))
+            try:
+                results = await asyncio.wait_for(
+                    self.search_similar_server_side(target_screen, options),
+                    timeout=max(0.0, deadline - time.monotonic())
+                )
+                return SearchResponse(results=results)
+            except asyncio.TimeoutError:
+                logger.warning(f"Server-side search of {self.section} missed its deadline, scanning the corpus instead")
+                if self._corpus is None:
+                    return SearchResponse(results=[], degraded=True, coverage=0.0)
+                response = await self.search_similar_corpus(target_screen, options, deadline)
+                response.degraded = True
+                return response
+        if options.candidate_source != 'lsh' or options.palette:
+            return await self.search_similar_corpus(target_screen, options, deadline)
+        return await self.search_similar_lsh(target_screen, options, deadline)
+
     async def search_similar(
         self,
         target_screen: ScreenAnalysis,
         options: SearchOptions
     ) -> List[SearchResult]:
         """Search for similar screens"""
+        return (await self.search(target_screen, options)).results
+
+    async def search_similar_lsh(
+        self,
+        target_screen: ScreenAnalysis,
+        options: SearchOptions,
+        deadline: Optional[float] = None
+    ) -> SearchResponse:
+        """Score only the screens sharing an LSH bucket with the target"""
         results = []
+        target_minhash = target_screen.layout_minhash or self.get_layout_minhash(target_screen.layout_data)
+        target_histogram = to_sparse(target_screen.color_histogram or target_screen.color_embedding)
         
-        # Get all screens of same type from database
-        screens = await self.db_service.get_screens_by_type(self.section)
+        # Only fetch screens sharing an LSH bucket with the target
+        index = await self.get_fingerprint_index()
+        candidate_ids = index.query(target_minhash)
+        screens = await self.db_service.get_analyses_by_ids(sorted(candidate_ids))
         
-        for screen_data in screens:
+        for scanned, screen_data in enumerate(screens):
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.warning(f"LSH search of {self.section} scored {scanned}/{len(screens)} candidates before its deadline")
+                break
             # Skip if this is the target screen
             if screen_data['img_url'] == target_screen.img_url:
                 continue
@@ -83,35 +553,38 @@ class ScreenService(BaseScreenService):
                 screen_data['color_embedding'] = eval(screen_data['color_embedding'])
             
             screen = ScreenAnalysis(**screen_data)
-            final_score = 0
             layout_score = None
             color_score = None
-            num_enabled_features = 0
             
             if options.search_layout:
-                layout_score = calculate_cosine_similarity(
-                    target_screen.layout_embedding,
-                    screen.layout_embedding
-                )
-                final_score += layout_score
-                num_enabled_features += 1
+                if (options.layout_similarity == 'minhash'
+                        or target_screen.layout_embedding is None
+                        or screen.layout_embedding is None):
+                    layout_score = estimate_jaccard(
+                        target_minhash,
+                        screen.layout_minhash or self.get_layout_minhash(screen.layout_data)
+                    )
+                else:
+                    layout_score = calculate_cosine_similarity(
+                        target_screen.layout_embedding,
+                        screen.layout_embedding
+                    )
                 
             if options.search_color:
-                color_score = calculate_histogram_similarity(
-                    target_screen.color_embedding,
-                    screen.color_embedding
-                )
-                final_score += color_score
-                num_enabled_features += 1
+                if screen.color_histogram:
+                    # Sparse chi-square over the union of non-zero bins: bins in one histogram only
+                    # enter through the precomputed self terms, so only shared bins are visited
+                    color_score = sparse_histogram_similarity(target_histogram, screen.color_histogram)
+                else:
+                    color_score = calculate_histogram_similarity(
+                        target_screen.color_embedding,
+                        screen.color_embedding
+                    )
             
-            # Calculate average score instead of weighted sum
-            if num_enabled_features > 0:
-                final_score = final_score / num_enabled_features
-                
-                # Apply weights only if both features are enabled
-                if num_enabled_features == 2:
-                    final_score = (layout_score * options.weight_layout + 
-                                 color_score * options.weight_color)
+            # Weighted sum when both features are enabled, otherwise the enabled score
+            final_score = combine_scores(
+                layout_score, color_score, options.weight_layout, options.weight_color
+            )
                 
             results.append(SearchResult(
                 screen=screen,
@@ -120,4 +593,12 @@ class ScreenService(BaseScreenService):
                 color_score=color_score
             ))
             
-        return sorted(results, key=lambda x: x.score, reverse=True) 
\ No newline at end of file
+        else:
+            scanned = len(screens)
+
+        coverage = scanned / len(screens) if screens else 1.0
+        return SearchResponse(
+            results=sorted(results, key=lambda x: x.score, reverse=True),
+            degraded=coverage < 1,
+            coverage=coverage
+        ) 
\ No newline at end of file
@@ -1,18 +1,39 @@
 from typing import Optional
 from .screen_service import ScreenService
+from .base_db_service import BaseDatabaseService
+from .unified_index_service import UnifiedIndexService
 from ..types.screen import ScreenType
+from ..config import storage
 
 class ServiceFactory:
     _services = {}
+    # Cross-section index shared by the services of every section
+    _unified_index: Optional[UnifiedIndexService] = None
 
     @classmethod
     def get_service(cls, section_type: ScreenType, gemini_service=None, db_service=None) -> ScreenService:
         """Get service instance based on section type"""
         if section_type not in cls._services:
+            if db_service is not None and (cls._unified_index is None or cls._unified_index.db_service is not db_service):
+                cls._unified_index = UnifiedIndexService(db_service)
             cls._services[section_type] = ScreenService(
                 section=section_type,
                 gemini_service=gemini_service,
-                db_service=db_service
+                db_service=db_service,
+                unified_index=cls._unified_index
             )
         
-        return cls._services[section_type] 
\ No newline at end of file
+        return cls._services[section_type]
+
+    @staticmethod
+    def create_db_service(backend: Optional[str] = None) -> BaseDatabaseService:
+        """Create the storage backend selected by STORAGE_BACKEND (or `backend`)"""
+        backend = (backend or storage.STORAGE_BACKEND).lower()
+        if backend == 'sqlite':
+            from .local_db_service import LocalDatabaseService
+            return LocalDatabaseService(storage.SQLITE_DB_PATH)
+        if backend == 'supabase':
+            from supabase import create_client
+            from .db_service import DatabaseService
+            return DatabaseService(create_client(storage.PUBLIC_SUPABASE_URL, storage.SUPABASE_SERVICE_ROLE_KEY))
+        raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,356 @@
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+from multiprocessing.connection import Client, Connection
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .base_db_service import BaseDatabaseService
+from .screen_service import ScreenService
+from ..types.screen import ScreenAnalysis, ScreenType, SearchOptions
+from ..utils.layout_fingerprint import get_layout_minhash
+from ..utils.section_corpus import SectionCorpus, CORPUS_COLUMNS, merge_matches
+
+logger = logging.getLogger(__name__)
+
+ASSIGNMENTS = ('balanced', 'section')
+
+# Share of a search timeout given to the workers' scans
+WORKER_BUDGET_SHARE = 0.8
+
+
+def shard_key(shard: Dict) -> Tuple:
+    """Identity of a shard; a worker reloads a shard only when this changes"""
+    return (shard['section'], shard['start_id'], shard['end_id'], shard['rows'])
+
+
+def plan_index_shards(section_ids: Dict[str, Sequence[int]], shard_size: int) -> List[Dict]:
+    """
+    Cut every section into id ranges of at most shard_size rows. The first
+    range of a section is open below and the last open above, so rows added
+    later still belong to exactly one shard.
+    """
+    shards = []
+    for section, ids in sorted(section_ids.items()):
+        ids = sorted(ids)
+        starts = list(range(0, len(ids), shard_size))
+        for i, start in enumerate(starts):
+            end = start + shard_size
+            shards.append({
+                'section': section,
+                'start_id': ids[start] if i > 0 else None,
+                'end_id': ids[end] if end < len(ids) else None,
+                'rows': len(ids[start:end]),
+            })
+    return shards
+
+
+def assign_shards(
+    shards: List[Dict],
+    workers: int,
+    strategy: str = 'balanced',
+    previous: Optional[Dict[Tuple, int]] = None,
+    max_imbalance: float = 1.25
+) -> List[List[Dict]]:
+    """
+    Shards per worker. 'balanced' spreads shards by row count (largest first
+    onto the least loaded worker); 'section' keeps each section on one worker.
+    Shards already placed in `previous` stay put while their worker stays under
+    max_imbalance x the average load, so a rebalance moves as little as possible.
+    """
+    if strategy not in ASSIGNMENTS:
+        raise ValueError(f"Unknown shard assignment: {strategy}")
+    if strategy == 'section':
+        groups: Dict[str, List[Dict]] = {}
+        for shard in shards:
+            groups.setdefault(shard['section'], []).append(shard)
+        units = list(groups.values())
+    else:
+        units = [[shard] for shard in shards]
+
+    total = sum(shard['rows'] for shard in shards)
+    limit = max_imbalance * total / workers if workers else 0
+    loads = [0] * workers
+    assignment: List[List[Dict]] = [[] for _ in range(workers)]
+    pending = []
+    for unit in units:
+        owner = (previous or {}).get(shard_key(unit[0]))
+        rows = sum(shard['rows'] for shard in unit)
+        if owner is not None and owner < workers and loads[owner] + rows <= limit:
+            assignment[owner].extend(unit)
+            loads[owner] += rows
+        else:
+            pending.append(unit)
+
+    for unit in sorted(pending, key=lambda unit: -sum(shard['rows'] for shard in unit)):
+        worker = loads.index(min(loads))
+        assignment[worker].extend(unit)
+        loads[worker] += sum(shard['rows'] for shard in unit)
+    return assignment
+
+
+class _ShardWorker:
+    """State of one worker process: a SectionCorpus per loaded shard"""
+
+    def __init__(self, db_service: BaseDatabaseService):
+        self.db_service = db_service
+        self.corpora: Dict[Tuple, SectionCorpus] = {}
+        self.services: Dict[str, ScreenService] = {}
+
+    def _service(self, section: str) -> ScreenService:
+        if section not in self.services:
+            self.services[section] = ScreenService(ScreenType(section), db_service=self.db_service)
+        return self.services[section]
+
+    async def load(self, shards: List[Dict]) -> Dict:
+        """Keep the listed shards (reloading changed ones) and drop the rest"""
+        keys = {shard_key(shard) for shard in shards}
+        for key in [key for key in self.corpora if key not in keys]:
+            del self.corpora[key]
+        loaded = 0
+        for shard in shards:
+            key = shard_key(shard)
+            if key in self.corpora:
+                continue
+            # Paged: one select per shard would be capped at PostgREST max-rows
+            rows = await self.db_service.get_all_rows(
+                'relative_screen', columns=CORPUS_COLUMNS, section=shard['section'],
+                id_range=(shard['start_id'], shard['end_id'])
+            )
+            self.corpora[key] = SectionCorpus.from_rows(rows)
+            loaded += 1
+        return {
+            'shards': len(self.corpora),
+            'loaded': loaded,
+            'rows': sum(len(corpus) for corpus in self.corpora.values()),
+            'bytes': sum(corpus.nbytes for corpus in self.corpora.values()),
+        }
+
+    async def search(
+        self,
+        section: str,
+        target_screen: ScreenAnalysis,
+        options: SearchOptions,
+        budget_ms: Optional[float] = None
+    ) -> Dict:
+        """
+        Merged top-k of the worker's shards of a section, scanned within
+        budget_ms when given, with the rows scored and the rows in those shards
+        """
+        service = self._service(section)
+        deadline = time.monotonic() + budget_ms / 1000 if budget_ms else None
+        shard_matches = []
+        scanned = rows = 0
+        for key, corpus in self.corpora.items():
+            if key[0] != section or not len(corpus):
+                continue
+            rows += len(corpus)
+            if deadline is not None and shard_matches and time.monotonic() >= deadline:
+                continue
+            matches, shard_scanned, _ = await service.scan_corpus(corpus, target_screen, options, deadline)
+            shard_matches.append(matches)
+            scanned += shard_scanned
+        return {'matches': merge_matches(shard_matches, options.limit), 'scanned': scanned, 'rows': rows}
+
+
+def serve_shards(conn: Connection, db_factory: Callable[[], BaseDatabaseService]):
+    """
+    Worker loop: answer ('load', shards), ('search', section, target, options,
+    budget_ms) and ('stop',) messages on a connection until it closes. Runs in a local
+    worker process or behind a listener on another host.
+    """
+    loop = asyncio.new_event_loop()
+    worker = _ShardWorker(db_factory())
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+            if message[0] == 'stop':
+                break
+            try:
+                if message[0] == 'load':
+                    reply = loop.run_until_complete(worker.load(message[1]))
+                elif message[0] == 'search':
+                    reply = loop.run_until_complete(worker.search(*message[1:]))
+                else:
+                    raise ValueError(f"Unknown shard message: {message[0]}")
+                conn.send(('ok', reply))
+            except Exception as e:
+                conn.send(('error', f"{type(e).__name__}: {str(e)}"))
+    finally:
+        loop.close()
+        conn.close()
+
+
+def shard_authkey() -> bytes:
+    """
+    Shared secret of remote shard servers, from SHARD_AUTHKEY. There is no
+    default: connections unpickle what the peer sends, so a known key would
+    let anyone who reaches the port run code. Raises ValueError when unset.
+    """
+    authkey = os.getenv('SHARD_AUTHKEY')
+    if not authkey:
+        raise ValueError("SHARD_AUTHKEY must be set to a shared secret to use remote shard servers")
+    return authkey.encode()
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+class ShardedIndexService:
+    """
+    Coordinator of the sharded specific-mode index. Sections are cut into id
+    ranges, the shards are spread over local worker processes (and remote
+    shard servers), and a query is scattered to the workers holding its
+    section, whose per-shard top-k lists are merged exactly.
+    """
+
+    def __init__(
+        self,
+        db_service: BaseDatabaseService,
+        workers: int = 2,
+        shard_size: int = 50000,
+        assignment: str = 'balanced',
+        remote: Sequence[str] = (),
+        db_factory: Optional[Callable[[], BaseDatabaseService]] = None
+    ):
+        """
+        db_service: used by the coordinator to plan shards.
+        db_factory: opens the storage connection inside each local worker
+        (default: ServiceFactory.create_db_service, i.e. the environment configuration).
+        remote: host:port addresses of shard servers on other machines.
+        """
+        if assignment not in ASSIGNMENTS:
+            raise ValueError(f"Unknown shard assignment: {assignment}")
+        authkey = shard_authkey() if remote else None
+        if db_factory is None:
+            from .service_factory import ServiceFactory
+            db_factory = ServiceFactory.create_db_service
+        self.db_service = db_service
+        self.shard_size = shard_size
+        self.assignment = assignment
+        self._processes: List[multiprocessing.Process] = []
+        self._connections: List[Connection] = []
+        for _ in range(workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=serve_shards, args=(child_conn, db_factory), daemon=True)
+            process.start()
+            child_conn.close()
+            self._processes.append(process)
+            self._connections.append(parent_conn)
+        for address in remote:
+            self._connections.append(Client(parse_address(address), authkey=authkey))
+        if not self._connections:
+            raise ValueError("A sharded index needs at least one local or remote worker")
+        # One request in flight per connection
+        self._locks = [asyncio.Lock() for _ in self._connections]
+        self.shards: List[List[Dict]] = [[] for _ in self._connections]
+        self.sections: List[str] = []
+
+    async def _request(self, worker: int, message: Tuple):
+        async with self._locks[worker]:
+            conn = self._connections[worker]
+            conn.send(message)
+            status, reply = await asyncio.to_thread(conn.recv)
+        if status == 'error':
+            raise RuntimeError(f"Shard worker {worker}: {reply}")
+        return reply
+
+    async def plan(self, sections: Sequence[str]) -> List[Dict]:
+        section_ids = {}
+        for section in sections:
+            rows = await self.db_service.get_all_rows('relative_screen', columns='id', section=section)
+            section_ids[section] = [row['id'] for row in rows]
+        return plan_index_shards(section_ids, self.shard_size)
+
+    async def start(self, sections: Optional[Sequence[str]] = None, max_imbalance: float = 1.25) -> List[Dict]:
+        """(Re)plan the shards of `sections` (default: the current ones, or every section) and load them"""
+        try:
+            if sections:
+                self.sections = [ScreenType(section).value for section in sections]
+            elif not self.sections:
+                self.sections = [section.value for section in ScreenType]
+            shards = await self.plan(self.sections)
+            previous = {shard_key(shard): worker for worker, owned in enumerate(self.shards) for shard in owned}
+            self.shards = assign_shards(shards, len(self._connections), self.assignment, previous, max_imbalance)
+            stats = await asyncio.gather(*[
+                self._request(worker, ('load', owned)) for worker, owned in enumerate(self.shards)
+            ])
+            for worker, stat in enumerate(stats):
+                logger.info(
+                    f"Shard worker {worker}: {stat['shards']} shards, {stat['rows']} rows, "
+                    f"{stat['bytes'] / 1e6:.1f} MB ({stat['loaded']} loaded)"
+                )
+            return stats
+
+        except Exception as e:
+            logger.error(f"Error starting sharded index: {str(e)}")
+            raise
+
+    async def rebalance(self, max_imbalance: float = 1.25) -> List[Dict]:
+        """
+        Re-plan after rows were added: shards whose range or row count changed
+        are reloaded, and shards move only when a worker exceeds max_imbalance
+        """
+        return await self.start(max_imbalance=max_imbalance)
+
+    async def search(
+        self,
+        section: ScreenType,
+        target_screen: ScreenAnalysis,
+        options: SearchOptions,
+        timeout: Optional[float] = None
+    ) -> Tuple[List[Dict], float]:
+        """
+        Scatter a query to the workers holding the section and merge their
+        top-k. Returns (matches, coverage): with a timeout, workers scan within
+        a budget and workers that still miss it are left out of the merge, so
+        coverage is the fraction of the section's rows that were scored.
+        """
+        section = ScreenType(section).value
+        if section not in self.sections:
+            raise ValueError(f"Section not loaded in the sharded index: {section}")
+        if target_screen.layout_minhash is None and target_screen.layout_data:
+            # Computed once here instead of on every worker
+            target_screen.layout_minhash = get_layout_minhash(target_screen.layout_data)
+        workers = [worker for worker, owned in enumerate(self.shards) if any(s['section'] == section for s in owned)]
+        # Workers get most of the budget; the rest covers the round trip
+        budget_ms = timeout * 1000 * WORKER_BUDGET_SHARE if timeout is not None else None
+        tasks = [
+            asyncio.ensure_future(self._request(worker, ('search', section, target_screen, options, budget_ms)))
+            for worker in workers
+        ]
+        if timeout is None:
+            replies = await asyncio.gather(*tasks)
+        else:
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                # Left running: the worker's reply must still be read off its connection
+                task.add_done_callback(lambda task: task.cancelled() or task.exception())
+            if pending:
+                logger.warning(f"{len(pending)}/{len(tasks)} shard workers missed the search deadline")
+            replies = [task.result() for task in tasks if task in done]
+
+        section_rows = sum(
+            shard['rows'] for owned in self.shards for shard in owned if shard['section'] == section
+        )
+        scanned = sum(reply['scanned'] for reply in replies)
+        coverage = min(1.0, scanned / section_rows) if section_rows else 1.0
+        return merge_matches([reply['matches'] for reply in replies], options.limit), coverage
+
+    def close(self):
+        for conn in self._connections:
+            try:
+                conn.send(('stop',))
+                conn.close()
+            except (OSError, EOFError):
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+        self._connections = []
+        self._processes = []
@@ -0,0 +1,171 @@
+import sys
+import asyncio
+import logging
+import numpy as np
+from typing import Dict, Iterable, List, Optional
+
+from .base_db_service import BaseDatabaseService
+from ..utils.section_corpus import parse_vector
+from ..utils.site_vectors import SITE_COLUMNS, SiteVectorBuilder
+
+logger = logging.getLogger(__name__)
+
+# Sites whose rows are fetched in one request
+SITE_BATCH_SIZE = 100
+
+
+class SiteIndexService:
+    """
+    Precomputed site-level index: one aggregate vector per site_url in the
+    site_index table, built from the embeddings of every labeled section of
+    the site. "Similar sites" queries are one matrix-vector product over the
+    loaded vectors instead of a search per section.
+    """
+
+    def __init__(self, db_service: BaseDatabaseService, builder: Optional[SiteVectorBuilder] = None):
+        self.db_service = db_service
+        self.builder = builder or SiteVectorBuilder()
+        self._site_urls: Optional[np.ndarray] = None
+        self._vectors: Optional[np.ndarray] = None
+        self._sections: List[Dict] = []
+        self._positions: Dict[str, int] = {}
+        self._lock = asyncio.Lock()
+
+    async def refresh_sites(self, site_urls: Iterable[str]) -> int:
+        """Rebuild and store the vectors of the given sites from their current rows"""
+        try:
+            site_urls = sorted(set(filter(None, site_urls)))
+            stored = 0
+            for start in range(0, len(site_urls), SITE_BATCH_SIZE):
+                batch = site_urls[start:start + SITE_BATCH_SIZE]
+                rows = await self.db_service.get_analyses_by_site(batch, columns=SITE_COLUMNS)
+                by_site: Dict[str, List[Dict]] = {}
+                for row in rows:
+                    by_site.setdefault(row['site_url'], []).append(row)
+
+                records = []
+                for site_url in batch:
+                    vector, sections = self.builder.build(by_site.get(site_url, []))
+                    if vector is None:
+                        continue
+                    records.append({
+                        'site_url': site_url,
+                        'site_vector': vector.tolist(),
+                        'sections': sections,
+                        'config': self.builder.config,
+                    })
+                    self._update_loaded(site_url, vector, sections)
+                stored += await self.db_service.upsert_site_vectors(records)
+            return stored
+
+        except Exception as e:
+            logger.error(f"Error refreshing site vectors: {str(e)}")
+            raise
+
+    async def rebuild(self, page_size: int = 1000) -> int:
+        """Rebuild the vector of every site with labeled sections"""
+        try:
+            site_urls = set()
+            after_id = 0
+            while True:
+                page = await self.db_service.get_rows_page(
+                    'relative_screen', after_id=after_id, limit=page_size, columns='id, site_url'
+                )
+                if not page:
+                    break
+                site_urls.update(row['site_url'] for row in page)
+                after_id = page[-1]['id']
+            logger.info(f"Building site vectors for {len(site_urls)} sites")
+            return await self.refresh_sites(site_urls)
+
+        except Exception as e:
+            logger.error(f"Error rebuilding site index: {str(e)}")
+            raise
+
+    async def load(self, page_size: int = 1000):
+        """Load the stored vectors built under the current config"""
+        async with self._lock:
+            site_urls, vectors, sections = [], [], []
+            stale = 0
+            after_id = 0
+            while True:
+                page = await self.db_service.get_rows_page('site_index', after_id=after_id, limit=page_size)
+                if not page:
+                    break
+                for row in page:
+                    vector = parse_vector(row.get('site_vector'))
+                    if row.get('config') != self.builder.config or vector is None or len(vector) != self.builder.dims:
+                        stale += 1
+                        continue
+                    site_urls.append(sys.intern(row['site_url']))
+                    vectors.append(vector)
+                    sections.append(row.get('sections') or {})
+                after_id = page[-1]['id']
+            if stale:
+                logger.warning(
+                    f"Skipped {stale} site vectors built under another config; run scripts/build_site_index.py"
+                )
+            self._site_urls = np.array(site_urls, dtype=object)
+            self._vectors = (
+                np.vstack(vectors) if vectors else np.zeros((0, self.builder.dims), dtype=np.float32)
+            )
+            self._sections = sections
+            self._positions = {site_url: pos for pos, site_url in enumerate(site_urls)}
+
+    def _update_loaded(self, site_url: str, vector: np.ndarray, sections: Dict):
+        """Keep a loaded index current with a refreshed site"""
+        if self._vectors is None:
+            return
+        pos = self._positions.get(site_url)
+        if pos is not None:
+            self._vectors[pos] = vector
+            self._sections[pos] = sections
+            return
+        self._positions[site_url] = len(self._site_urls)
+        self._site_urls = np.append(self._site_urls, np.array([sys.intern(site_url)], dtype=object))
+        self._vectors = np.vstack([self._vectors, vector[None, :]])
+        self._sections.append(sections)
+
+    async def site_vector(self, site_url: str) -> Optional[np.ndarray]:
+        """Indexed vector of a site, or one built from its rows when it is not indexed yet"""
+        if self._vectors is None:
+            await self.load()
+        pos = self._positions.get(site_url)
+        if pos is not None:
+            return self._vectors[pos]
+        rows = await self.db_service.get_analyses_by_site([site_url], columns=SITE_COLUMNS)
+        vector, _ = self.builder.build(rows)
+        return vector
+
+    async def search(self, site_url: str, limit: int = 10) -> List[Dict]:
+        """
+        Sites most similar to `site_url` overall, as {site_url, score,
+        section_scores}; section_scores holds the contribution of each
+        section both sites have
+        """
+        try:
+            target = await self.site_vector(site_url)
+            if target is None:
+                logger.error(f"No labeled sections for site: {site_url}")
+                return []
+            scores = self._vectors @ target
+            pos = self._positions.get(site_url)
+            if pos is not None:
+                scores[pos] = -np.inf
+            k = min(limit, len(scores) - (pos is not None))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            return [
+                {
+                    'site_url': self._site_urls[i],
+                    'score': float(scores[i]),
+                    'section_scores': self.builder.section_scores(target, self._vectors[i]),
+                }
+                for i in top
+            ]
+
+        except Exception as e:
+            logger.error(f"Error searching similar sites: {str(e)}")
+            raise
@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from typing import List, Optional, Sequence
+
+from .base_db_service import BaseDatabaseService
+from ..types.screen import ScreenType
+from ..utils.section_corpus import CORPUS_COLUMNS, UnifiedCorpus
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_sections(sections: Sequence[str]) -> List[str]:
+    """Section names of a query: "all" expands to every ScreenType; unknown names raise ValueError"""
+    if any(section.strip().lower() == 'all' for section in sections):
+        return [section.value for section in ScreenType]
+    return list(dict.fromkeys(ScreenType(section.strip()).value for section in sections))
+
+
+class UnifiedIndexService:
+    """
+    Cross-section index: relative_screen rows of every section loaded once
+    into a UnifiedCorpus partitioned by section. Services of every section
+    share it, so a query spanning several sections is one load and one pass
+    over the selected partitions instead of a corpus per section.
+    """
+
+    def __init__(self, db_service: BaseDatabaseService):
+        self.db_service = db_service
+        self._corpus: Optional[UnifiedCorpus] = None
+        self._lock = asyncio.Lock()
+
+    async def get_corpus(self, page_size: int = 1000) -> UnifiedCorpus:
+        """The unified corpus, loaded on first use"""
+        async with self._lock:
+            if self._corpus is None:
+                rows = []
+                try:
+                    # Keyset pages, so PostgREST max-rows cannot truncate the table
+                    after_id = 0
+                    while True:
+                        page = await self.db_service.get_rows_page(
+                            'relative_screen', after_id=after_id, limit=page_size,
+                            columns=f"{CORPUS_COLUMNS}, section"
+                        )
+                        if not page:
+                            break
+                        rows.extend(page)
+                        after_id = page[-1]['id']
+                except Exception as e:
+                    logger.error(f"Error loading unified index: {str(e)}")
+                    raise
+                self._corpus = UnifiedCorpus.from_rows(rows, [section.value for section in ScreenType])
+                logger.info(
+                    f"Loaded unified index: {len(self._corpus)} rows in {len(self._corpus.ranges)} sections, "
+                    f"{self._corpus.nbytes / 1e6:.1f} MB"
+                )
+        return self._corpus
+
+    def invalidate(self):
+        """Drop the loaded corpus so the next query reloads every section"""
+        self._corpus = None
@@ -22,9 +22,17 @@ class ScreenAnalysis(BaseModel):
     section: ScreenType
     site_url: str
     img_url: str
-    layout_embedding: List[float]
+    layout_embedding: Optional[List[float]] = None
     color_embedding: List[float]
+    # Non-zero bins of color_embedding: {"size", "indices", "values"}
+    color_histogram: Optional[Dict] = None
     layout_data: str
+    layout_minhash: Optional[List[int]] = None
+    image_hash: Optional[str] = None
+    # Per-feature model/parameters/source image hash (see src/utils/provenance.py)
+    provenance: Optional[Dict] = None
+    # Set when layout_data/layout_embedding were reused from a near-duplicate row (not stored)
+    duplicate_of: Optional[int] = None
     created_at: Optional[str] = None
     updated_at: Optional[str] = None
 
@@ -34,9 +42,33 @@ class SearchOptions(BaseModel):
     weight_layout: float = 0.5
     weight_color: float = 0.5
     limit: int = 5
+    # "all" scores the whole section, "lsh" only rows sharing a MinHash LSH bucket,
+    # "color" only rows sharing a dominant color bin with the target
+    candidate_source: str = "all"
+    # "embedding" uses the OpenAI vectors (MinHash when a row has none), "minhash" never calls for them
+    layout_similarity: str = "embedding"
+    # Rank inside the database (match_relative_screens RPC) and fetch only the top `limit` rows
+    server_side: bool = False
+    # Nearest layout candidates the RPC reranks by the combined score
+    candidate_count: int = 200
+    # Only rows whose dominant colors include these ('#rrggbb' colors or HSV bin numbers)
+    palette: Optional[List[str]] = None
+    # "any": at least one palette color is dominant in the row, "all": every one is
+    palette_match: str = "any"
+    # Latency budget of the whole search; past it the best results found so far are returned
+    deadline_ms: Optional[float] = None
+    # Search these sections (or ["all"]) of the cross-section index instead of the service's own section
+    sections: Optional[List[str]] = None
 
 class SearchResult(BaseModel):
     screen: ScreenAnalysis
     score: float
     layout_score: Optional[float]
-    color_score: Optional[float] 
\ No newline at end of file
+    color_score: Optional[float] 
+
+class SearchResponse(BaseModel):
+    results: List[SearchResult]
+    # The deadline cut the search short: results come from a partial scan or an approximate path
+    degraded: bool = False
+    # Fraction of the rows the exact search would score that were scored (None when unknown)
+    coverage: Optional[float] = 1.0
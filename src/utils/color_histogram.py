@@ -7,31 +7,51 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# HSV bins and ranges of the histogram; HISTOGRAM_VERSION is recorded as its provenance
+HISTOGRAM_BINS = [8, 8, 8]
+HISTOGRAM_RANGES = [0, 180, 0, 256, 0, 256]
+HISTOGRAM_VERSION = "hsv-" + "x".join(str(b) for b in HISTOGRAM_BINS) + "-l2"
+
+def download_image_bytes(img_url: str) -> bytes:
+    """Download the raw bytes of an image"""
+    response = requests.get(img_url)
+    response.raise_for_status()
+    return response.content
+
+def decode_image(data: bytes, img_url: str = '') -> np.ndarray:
+    """Decode image bytes to a BGR array"""
+    # Convert to OpenCV format
+    nparr = np.frombuffer(data, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"Could not decode image: {img_url}")
+    return img
+
+def download_image(img_url: str) -> np.ndarray:
+    """Download an image and decode it to a BGR array"""
+    return decode_image(download_image_bytes(img_url), img_url)
+
+def compute_color_histogram(img: np.ndarray) -> List[float]:
+    """HSV color histogram of a decoded BGR image"""
+    # Convert to HSV color space
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    
+    # Calculate 3D histogram in HSV color space
+    hist = cv2.calcHist([hsv], [0, 1, 2], None, 
+                       HISTOGRAM_BINS,  # Reduce bins for more general comparison
+                       HISTOGRAM_RANGES)
+    
+    # Normalize histogram
+    hist = cv2.normalize(hist, hist).flatten()
+    
+    # Convert to list of floats
+    return hist.tolist()
+
 async def get_color_histogram_embedding(img_url: str) -> List[float]:
     """Get color histogram embedding using HSV color space and Earth Mover's Distance"""
     try:
-        # Download image
-        response = requests.get(img_url)
-        response.raise_for_status()
-        
-        # Convert to OpenCV format
-        nparr = np.frombuffer(response.content, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        # Convert to HSV color space
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        
-        # Calculate 3D histogram in HSV color space
-        hist = cv2.calcHist([hsv], [0, 1, 2], None, 
-                           [8, 8, 8],  # Reduce bins for more general comparison
-                           [0, 180, 0, 256, 0, 256])
-        
-        # Normalize histogram
-        hist = cv2.normalize(hist, hist).flatten()
-        
-        # Convert to list of floats
-        return hist.tolist()
+        return compute_color_histogram(download_image(img_url))
         
     except Exception as e:
         logger.error(f"Error calculating color histogram: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
@@ -0,0 +1,124 @@
+import cv2
+import numpy as np
+from typing import List, Optional, Sequence, Union
+
+from .color_histogram import HISTOGRAM_BINS, HISTOGRAM_RANGES
+from .sparse_histogram import HISTOGRAM_SIZE, SparseHistogramMatrix, to_sparse
+
+# Share of a histogram's pixels a bin needs to count as a dominant color.
+# The heaviest bin of a histogram always counts, so no row is left unindexed.
+DOMINANT_MIN_MASS = 0.05
+
+
+def dominant_bins(hist, min_mass: float = DOMINANT_MIN_MASS) -> np.ndarray:
+    """Sorted HSV bins holding at least min_mass of the histogram (at least its heaviest bin)"""
+    sparse = to_sparse(hist)
+    if not len(sparse):
+        return np.zeros(0, dtype=np.int32)
+    # Bin values are proportional to pixel counts, so the L1 share is the pixel share
+    share = sparse.values / sparse.values.sum()
+    keep = share >= min_mass
+    keep[np.argmax(share)] = True
+    return np.sort(sparse.indices[keep])
+
+
+def color_to_bin(color: str) -> int:
+    """HSV histogram bin of a '#rrggbb' color, in the flattened order of get_color_histogram_embedding"""
+    value = color.lstrip('#')
+    if len(value) != 6:
+        raise ValueError(f"Expected a #rrggbb color: {color}")
+    r, g, b = (int(value[i:i + 2], 16) for i in (0, 2, 4))
+    hsv = cv2.cvtColor(np.uint8([[[b, g, r]]]), cv2.COLOR_BGR2HSV)[0, 0]
+    bin_index = 0
+    for channel, bins in enumerate(HISTOGRAM_BINS):
+        low, high = HISTOGRAM_RANGES[2 * channel], HISTOGRAM_RANGES[2 * channel + 1]
+        bin_index = bin_index * bins + min(bins - 1, int((int(hsv[channel]) - low) * bins / (high - low)))
+    return bin_index
+
+
+def parse_palette(palette: Sequence[Union[str, int]]) -> List[int]:
+    """Histogram bins of palette entries given as '#rrggbb' colors or bin numbers"""
+    bins = []
+    for entry in palette:
+        if isinstance(entry, str) and entry.startswith('#'):
+            bins.append(color_to_bin(entry))
+        else:
+            bin_index = int(entry)
+            if not 0 <= bin_index < HISTOGRAM_SIZE:
+                raise ValueError(f"Histogram bin out of range: {entry}")
+            bins.append(bin_index)
+    return sorted(set(bins))
+
+
+class ColorBinIndex:
+    """
+    Inverted index from dominant HSV bins to the corpus rows using them.
+    Posting lists are stored back to back in bin order (CSR layout), each
+    holding ascending corpus positions, so a lookup reads only the rows
+    that share a bin with the query.
+    """
+
+    def __init__(self, ids: np.ndarray, color: SparseHistogramMatrix, min_mass: float = DOMINANT_MIN_MASS):
+        self.ids = ids
+        self.min_mass = min_mass
+        n = len(color)
+        dominant = np.zeros(len(color.values), dtype=bool)
+        if len(color.values):
+            totals = np.bincount(color.rows, weights=color.values, minlength=n)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                share = color.values / totals[color.rows]
+            dominant = share >= min_mass
+            # Heaviest bin of every non-empty row
+            lengths = np.diff(color.indptr)
+            nonempty = np.flatnonzero(lengths)
+            row_max = np.maximum.reduceat(color.values, color.indptr[nonempty])
+            heaviest = np.zeros(n)
+            heaviest[nonempty] = row_max
+            dominant |= color.values == heaviest[color.rows]
+
+        bins = color.indices[dominant]
+        rows = color.rows[dominant]
+        # Stable sort keeps positions ascending inside each posting list
+        order = np.argsort(bins, kind='stable')
+        self.postings = rows[order].astype(np.int64)
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(bins, minlength=color.size))])
+
+    @property
+    def nbytes(self) -> int:
+        return self.postings.nbytes + self.indptr.nbytes
+
+    def postings_for(self, bin_index: int) -> np.ndarray:
+        """Corpus positions of the rows where the bin is dominant"""
+        return self.postings[self.indptr[bin_index]:self.indptr[bin_index + 1]]
+
+    def screen_ids(self, bin_index: int) -> np.ndarray:
+        """relative_screen ids of the rows where the bin is dominant"""
+        return self.ids[self.postings_for(bin_index)]
+
+    def match(self, bins: Sequence[int], min_shared: int = 1) -> np.ndarray:
+        """Ascending positions of the rows with at least min_shared of the bins dominant"""
+        lists = [self.postings_for(int(b)) for b in bins]
+        if not lists:
+            return np.zeros(0, dtype=np.int64)
+        positions, counts = np.unique(np.concatenate(lists), return_counts=True)
+        return positions if min_shared <= 1 else positions[counts >= min_shared]
+
+    def candidates(self, hist) -> np.ndarray:
+        """Rows sharing at least one dominant bin with a query histogram"""
+        return self.match(dominant_bins(hist, self.min_mass))
+
+    def palette_filter(self, bins: Sequence[int], match: str = 'any') -> np.ndarray:
+        """Rows where any (or all) of the palette bins are dominant"""
+        if match not in ('any', 'all'):
+            raise ValueError(f"Unknown palette match: {match}")
+        bins = sorted(set(bins))
+        return self.match(bins, min_shared=len(bins) if match == 'all' else 1)
+
+
+def intersect_positions(a: Optional[np.ndarray], b: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """Intersection of two ascending position sets, None standing for every row"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return np.intersect1d(a, b, assume_unique=True)
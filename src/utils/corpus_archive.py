@@ -0,0 +1,276 @@
+import os
+import json
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from urllib.parse import quote, unquote
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .section_corpus import parse_vector
+
+# Column kinds per exported table. Vectors become fixed-size float32 lists, so a
+# column loads into an (n, dims) numpy array without parsing any text.
+ARCHIVE_TABLES = {
+    'screens': {
+        'id': 'int', 'img_url': 'str', 'section': 'str', 'site_url': 'str', 'date': 'str', 'is_public': 'bool',
+    },
+    'relative_screen': {
+        'id': 'int', 'screen_id': 'int', 'section': 'str', 'site_url': 'str', 'img_url': 'str',
+        'layout_embedding': 'vector', 'color_embedding': 'vector', 'color_histogram': 'json',
+        'layout_data': 'str', 'screen_related_ids': 'int_list', 'screen_related_scores': 'float_list',
+        'layout_minhash': 'int_list', 'image_hash': 'str', 'provenance': 'json',
+        'created_at': 'str', 'updated_at': 'str',
+    },
+    'screen_analysis': {
+        'id': 'int', 'screen_id': 'int', 'section': 'str', 'webp_url': 'str',
+        'embedding': 'vector', 'screen_related_ids': 'int_list',
+    },
+}
+
+VECTOR_DIMS = {'layout_embedding': 1536, 'color_embedding': 512, 'embedding': 1536}
+
+# Files are written as <root>/<table>/section=<section>/part-0.<ext>
+PARTITION_KEY = 'section'
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+_ARROW_TYPES = {
+    'int': pa.int64(),
+    'str': pa.string(),
+    'bool': pa.bool_(),
+    'json': pa.string(),
+    'int_list': pa.list_(pa.int64()),
+    'float_list': pa.list_(pa.float64()),
+}
+
+
+def column_kinds(table: str, extra_columns: Sequence[str] = ()) -> Dict[str, str]:
+    """Known columns of the table plus any others found in the data, kept as JSON text"""
+    kinds = dict(ARCHIVE_TABLES[table])
+    for column in extra_columns:
+        kinds.setdefault(column, 'json')
+    return kinds
+
+
+def archive_schema(kinds: Dict[str, str]) -> pa.Schema:
+    """Arrow schema of the partition files (the partition column lives in the directory name)"""
+    fields = []
+    for column, kind in kinds.items():
+        if column == PARTITION_KEY:
+            continue
+        if kind == 'vector':
+            fields.append(pa.field(column, pa.list_(pa.float32(), VECTOR_DIMS[column])))
+        else:
+            fields.append(pa.field(column, _ARROW_TYPES[kind]))
+    return pa.schema(fields)
+
+
+def _vector_array(values: List, dims: int) -> pa.Array:
+    matrix = np.zeros((len(values), dims), dtype=np.float32)
+    missing = np.zeros(len(values), dtype=bool)
+    for i, value in enumerate(values):
+        vector = parse_vector(value)
+        if vector is None:
+            missing[i] = True
+        else:
+            matrix[i] = vector
+    return pa.FixedSizeListArray.from_arrays(pa.array(matrix.ravel()), dims, mask=pa.array(missing))
+
+
+def _json_or_none(value) -> Optional[str]:
+    if value is None:
+        return None
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def _list_or_none(value) -> Optional[List]:
+    if value is None:
+        return None
+    return json.loads(value) if isinstance(value, str) else list(value)
+
+
+def rows_to_batch(rows: List[Dict], schema: pa.Schema, kinds: Dict[str, str]) -> pa.RecordBatch:
+    """Convert database rows (vectors as pgvector text or lists) to a record batch"""
+    arrays = []
+    for field in schema:
+        values = [row.get(field.name) for row in rows]
+        kind = kinds[field.name]
+        if kind == 'vector':
+            arrays.append(_vector_array(values, field.type.list_size))
+            continue
+        if kind == 'json':
+            values = [_json_or_none(v) for v in values]
+        elif kind in ('int_list', 'float_list'):
+            values = [_list_or_none(v) for v in values]
+        elif kind == 'str':
+            values = [v if v is None or isinstance(v, str) else json.dumps(v) for v in values]
+        elif kind == 'bool':
+            # SQLite stores booleans as 0/1
+            values = [None if v is None else bool(v) for v in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def vector_matrix(column: pa.Array) -> Tuple[np.ndarray, np.ndarray]:
+    """(n, dims) float32 view of a fixed-size list column and its validity mask"""
+    column = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+    dims = column.type.list_size
+    # Null rows still occupy dims slots in the child array, so slice it instead of flatten()
+    flat = column.values[column.offset * dims:(column.offset + len(column)) * dims]
+    matrix = flat.to_numpy(zero_copy_only=False).reshape(len(column), dims)
+    valid = ~column.is_null().to_numpy(zero_copy_only=False)
+    return matrix, valid
+
+
+def batch_to_rows(batch: pa.RecordBatch, kinds: Dict[str, str]) -> List[Dict]:
+    """Inverse of rows_to_batch: JSON-serializable row dicts ready for insert"""
+    columns = {}
+    for name in batch.schema.names:
+        kind = kinds.get(name, 'json')
+        column = batch.column(name)
+        if kind == 'vector':
+            matrix, valid = vector_matrix(column)
+            columns[name] = [matrix[i].tolist() if valid[i] else None for i in range(len(column))]
+        elif kind == 'json':
+            columns[name] = [json.loads(v) if v is not None else None for v in column.to_pylist()]
+        else:
+            columns[name] = column.to_pylist()
+    return [{name: values[i] for name, values in columns.items()} for i in range(batch.num_rows)]
+
+
+def partition_dir(root: str, table: str, section: Optional[str]) -> str:
+    value = NULL_PARTITION if section is None else quote(section, safe='')
+    return os.path.join(root, table, f"{PARTITION_KEY}={value}")
+
+
+def list_partitions(root: str, table: str) -> List[Tuple[Optional[str], str]]:
+    """(section, file path) of every partition file of a table in an archive"""
+    table_dir = os.path.join(root, table)
+    if not os.path.isdir(table_dir):
+        return []
+    partitions = []
+    for entry in sorted(os.listdir(table_dir)):
+        if not entry.startswith(f"{PARTITION_KEY}="):
+            continue
+        value = entry.split('=', 1)[1]
+        section = None if value == NULL_PARTITION else unquote(value)
+        for name in sorted(os.listdir(os.path.join(table_dir, entry))):
+            if os.path.splitext(name)[1] in FORMATS.values():
+                partitions.append((section, os.path.join(table_dir, entry, name)))
+    return partitions
+
+
+class ArchiveWriter:
+    """
+    Streams one table into per-section files. Each page is converted to
+    Arrow right away and buffered per section up to `row_group_size` rows,
+    so memory stays bounded by sections x row groups of float32 columns
+    whatever the size of the table.
+    """
+
+    def __init__(self, root: str, table: str, fmt: str = 'parquet', row_group_size: int = 1000,
+                 extra_columns: Sequence[str] = ()):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown archive format: {fmt}")
+        self.root = root
+        self.table = table
+        self.fmt = fmt
+        self.row_group_size = row_group_size
+        self.kinds = column_kinds(table, extra_columns)
+        self.schema = archive_schema(self.kinds)
+        self.row_counts: Dict[Optional[str], int] = {}
+        self._writers: Dict[Optional[str], object] = {}
+        self._sinks: Dict[Optional[str], object] = {}
+        self._buffers: Dict[Optional[str], List[pa.RecordBatch]] = {}
+
+    def _writer(self, section: Optional[str]):
+        if section not in self._writers:
+            directory = partition_dir(self.root, self.table, section)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-0{FORMATS[self.fmt]}")
+            if self.fmt == 'parquet':
+                self._writers[section] = pq.ParquetWriter(path, self.schema, compression='zstd')
+            else:
+                self._sinks[section] = pa.OSFile(path, 'wb')
+                self._writers[section] = ipc.new_file(self._sinks[section], self.schema)
+        return self._writers[section]
+
+    def _flush(self, section: Optional[str]):
+        batches = self._buffers.pop(section, [])
+        if batches:
+            data = pa.Table.from_batches(batches, schema=self.schema)
+            if self.fmt == 'parquet':
+                self._writer(section).write_table(data, row_group_size=self.row_group_size)
+            else:
+                self._writer(section).write_table(data, max_chunksize=self.row_group_size)
+            self.row_counts[section] = self.row_counts.get(section, 0) + data.num_rows
+
+    def write_rows(self, rows: List[Dict]):
+        by_section: Dict[Optional[str], List[Dict]] = {}
+        for row in rows:
+            by_section.setdefault(row.get(PARTITION_KEY), []).append(row)
+        for section, section_rows in by_section.items():
+            buffer = self._buffers.setdefault(section, [])
+            buffer.append(rows_to_batch(section_rows, self.schema, self.kinds))
+            if sum(batch.num_rows for batch in buffer) >= self.row_group_size:
+                self._flush(section)
+
+    def close(self):
+        for section in list(self._buffers):
+            self._flush(section)
+        for writer in self._writers.values():
+            writer.close()
+        for sink in self._sinks.values():
+            sink.close()
+
+    def __enter__(self) -> 'ArchiveWriter':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_partition(path: str, batch_size: int = 1000) -> Iterator[pa.RecordBatch]:
+    """Record batches of one partition file, read incrementally"""
+    if path.endswith(FORMATS['parquet']):
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size)
+        return
+    with pa.memory_map(path) as source:
+        reader = ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+
+def iter_archive_rows(root: str, table: str, batch_size: int = 1000,
+                      sections: Optional[Sequence[str]] = None) -> Iterator[Tuple[Optional[str], List[Dict]]]:
+    """(section, rows) batches of a table, with the section column restored from the partition"""
+    for section, path in list_partitions(root, table):
+        if sections is not None and section not in sections:
+            continue
+        for batch in iter_partition(path, batch_size):
+            kinds = column_kinds(table, batch.schema.names)
+            rows = batch_to_rows(batch, kinds)
+            for row in rows:
+                row[PARTITION_KEY] = section
+            yield section, rows
+
+
+def load_vectors(root: str, table: str, column: str, section: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (ids, float32 matrix) of a vector column for offline analysis, optionally
+    one section only; rows without a vector are left out.
+    """
+    ids, matrices = [], []
+    for partition_section, path in list_partitions(root, table):
+        if section is not None and partition_section != section:
+            continue
+        for batch in iter_partition(path, batch_size=65536):
+            matrix, valid = vector_matrix(batch.column(column))
+            # Boolean indexing copies, so nothing keeps the memory map alive
+            ids.append(batch.column('id').to_numpy(zero_copy_only=False)[valid])
+            matrices.append(matrix[valid])
+    if not ids:
+        dims = VECTOR_DIMS.get(column, 0)
+        return np.zeros(0, dtype=np.int64), np.zeros((0, dims), dtype=np.float32)
+    return np.concatenate(ids), np.concatenate(matrices)
@@ -1,22 +1,32 @@
 import os
 import json
+import hashlib
 import logging
+from collections import OrderedDict
 from typing import List, Dict
 from openai import OpenAI
+from .rate_limiter import get_scheduler, estimate_tokens
+from .layout_canonical import LAYOUT_TEXT_TOKENS, canonicalize_layout
+from ..config.models import EMBEDDING_MODEL
 
 logger = logging.getLogger(__name__)
 
 class EmbeddingProcessor:
     """Handles creation of embeddings using OpenAI API"""
     
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    def __init__(self, cache_size: int = 1024):
+        # Retries are handled by the shared scheduler
+        self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), max_retries=0)
+        self.scheduler = get_scheduler("openai")
+        # Embeddings by hash of the canonical input, so identical layouts are embedded once
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
 
     def _create_embedding(self, text: str) -> List[float]:
         """Create embedding from text using OpenAI API"""
         try:
             response = self.client.embeddings.create(
-                model="text-embedding-3-small",
+                model=EMBEDDING_MODEL,
                 input=text,
                 encoding_format="float"
             )
@@ -36,10 +46,29 @@ class EmbeddingProcessor:
             logger.error(f"Error formatting JSON string: {str(e)}")
             return str(layout_data)
 
+    def layout_input(self, layout_data: Dict) -> str:
+        """Text sent for embedding: the canonical HTML (text nodes cut to LAYOUT_TEXT_TOKENS), or the JSON"""
+        layout_text = self._format_json_string(layout_data)
+        if isinstance(layout_data, str):
+            layout_text = canonicalize_layout(layout_text, LAYOUT_TEXT_TOKENS)
+        return layout_text
+
     async def get_layout_embedding(self, layout_data: Dict) -> List[float]:
         """Create embedding for layout data using OpenAI API"""
-        # Convert layout data to JSON string
-        layout_text = self._format_json_string(layout_data)
-        
-        # Create embedding
-        return self._create_embedding(layout_text) 
\ No newline at end of file
+        layout_text = self.layout_input(layout_data)
+        key = hashlib.sha256(layout_text.encode('utf-8')).hexdigest()
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return list(self._cache[key])
+
+        # Create embedding under the shared OpenAI quota
+        embedding = await self.scheduler.run(
+            self._create_embedding,
+            layout_text,
+            tokens=estimate_tokens(layout_text)
+        )
+        if self.cache_size:
+            self._cache[key] = embedding
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return list(embedding)
@@ -0,0 +1,164 @@
+import os
+import asyncio
+import cv2
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+from .color_histogram import decode_image, compute_color_histogram
+from .perceptual_hash import compute_phash, hash_to_hex
+from .provenance import content_hash
+
+# A feature computes one value from the decoded BGR array, the source bytes and
+# per-call options. Every requested feature of a screenshot reads the same array.
+FeatureFunction = Callable[[np.ndarray, bytes, Dict], Any]
+
+FEATURES: Dict[str, FeatureFunction] = {}
+
+# Worker processes for extraction; 0 runs it on a thread of the calling process
+FEATURE_WORKERS = int(os.getenv("FEATURE_WORKERS", os.cpu_count() or 1))
+
+GEMINI_MAX_SIZE = (800, 800)
+GEMINI_JPEG_QUALITY = 85
+
+_MAGIC_MIME_TYPES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+)
+
+
+def register_feature(name: str):
+    """
+    Register a CPU feature under `name`. The function must live at module
+    level: worker processes receive it by reference, not from this registry.
+    """
+    def decorator(func: FeatureFunction) -> FeatureFunction:
+        FEATURES[name] = func
+        return func
+    return decorator
+
+
+def sniff_mime_type(data: bytes) -> Optional[str]:
+    """MIME type from the file signature (JPEG, PNG, WebP), None otherwise"""
+    for magic, mime_type in _MAGIC_MIME_TYPES:
+        if data.startswith(magic):
+            return mime_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def encode_gemini_payload(
+    img: np.ndarray,
+    data: bytes,
+    max_size: Tuple[int, int] = GEMINI_MAX_SIZE,
+    passthrough_max_bytes: int = 0,
+    passthrough_max_pixels: int = 1920 * 1080
+) -> Tuple[bytes, str]:
+    """(bytes, mime_type) sent to Gemini, encoded from an already decoded image"""
+    mime_type = sniff_mime_type(data)
+    height, width = img.shape[:2]
+    if (passthrough_max_bytes
+            and len(data) <= passthrough_max_bytes
+            and width * height <= passthrough_max_pixels
+            and mime_type is not None):
+        return data, mime_type
+
+    # Same target size as PIL's thumbnail(); INTER_AREA averages whole source pixels
+    scale = min(max_size[0] / width, max_size[1] / height)
+    if scale < 1:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, GEMINI_JPEG_QUALITY])
+    if not ok:
+        raise ValueError("Could not encode the Gemini payload")
+    return encoded.tobytes(), 'image/jpeg'
+
+
+@register_feature('source_sha256')
+def _source_sha256(img: np.ndarray, data: bytes, options: Dict) -> str:
+    return content_hash(data)
+
+
+@register_feature('color_histogram')
+def _color_histogram(img: np.ndarray, data: bytes, options: Dict):
+    return compute_color_histogram(img)
+
+
+@register_feature('image_hash')
+def _image_hash(img: np.ndarray, data: bytes, options: Dict) -> str:
+    return hash_to_hex(compute_phash(img))
+
+
+@register_feature('gemini_payload')
+def _gemini_payload(img: np.ndarray, data: bytes, options: Dict) -> Tuple[bytes, str]:
+    return encode_gemini_payload(img, data, **options.get('gemini_payload', {}))
+
+
+def extract_features(
+    data: bytes,
+    img_url: str,
+    functions: Sequence[Tuple[str, FeatureFunction]],
+    options: Optional[Dict] = None
+) -> Dict[str, Any]:
+    """Decode once and run every function on the decoded array (runs inside a worker)"""
+    img = decode_image(data, img_url)
+    # Features only read the array; freezing it catches one that would modify it for the rest
+    img.flags.writeable = False
+    return {name: func(img, data, options or {}) for name, func in functions}
+
+
+class FeatureExtractor:
+    """
+    Decode-once extraction stage. Each screenshot's compressed bytes go to a
+    worker process, which decodes them a single time and computes the Gemini
+    payload, color histogram, perceptual hash and any other registered feature
+    from that one array; only the small results come back.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = FEATURE_WORKERS if workers is None else workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers <= 0:
+            return None
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    async def extract(
+        self,
+        data: bytes,
+        img_url: str,
+        features: Sequence[str],
+        options: Optional[Dict] = None
+    ) -> Dict[str, Any]:
+        """Requested features of one screenshot, keyed by feature name"""
+        unknown = [name for name in features if name not in FEATURES]
+        if unknown:
+            raise ValueError(f"Unknown features: {', '.join(unknown)}")
+        functions = [(name, FEATURES[name]) for name in features]
+        executor = self._executor()
+        if executor is None:
+            # OpenCV releases the GIL while decoding, so a thread still overlaps downloads
+            return await asyncio.to_thread(extract_features, data, img_url, functions, options)
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, extract_features, data, img_url, functions, options
+        )
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+_extractor: Optional[FeatureExtractor] = None
+
+
+def get_feature_extractor() -> FeatureExtractor:
+    """Shared extractor, so every service feeds one process pool"""
+    global _extractor
+    if _extractor is None:
+        _extractor = FeatureExtractor()
+    return _extractor
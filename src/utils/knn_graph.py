@@ -0,0 +1,417 @@
+import math
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .section_corpus import SectionCorpus
+from .similarity import combine_scores
+from .sparse_histogram import HISTOGRAM_SIZE, _EPS, _self_terms
+
+# Float32 elements of the temporary arrays of one scoring step
+BLOCK_ELEMENTS = 1 << 23
+
+
+class PairScorer:
+    """
+    Combined layout + color similarity between rows of a section, the score
+    related ids are ranked by and search computes (SectionCorpus.score):
+    cosine of the layout embeddings, estimated Jaccard of the MinHash
+    signatures when either row has no embedding, and chi-square similarity
+    of the color histograms, weighted by combine_scores.
+    """
+
+    def __init__(
+        self,
+        corpus: SectionCorpus,
+        search_layout: bool = True,
+        search_color: bool = True,
+        weight_layout: float = 0.5,
+        weight_color: float = 0.5
+    ):
+        if not search_layout and not search_color:
+            raise ValueError("At least one of layout or color scoring must be enabled")
+        self.corpus = corpus
+        self.search_layout = search_layout
+        self.search_color = search_color
+        self.weight_layout = weight_layout
+        self.weight_color = weight_color
+        self.n = len(corpus)
+
+        self.layout = None
+        if search_layout:
+            # Unit rows, so a dot product is the cosine (zero rows where the embedding is missing)
+            norms = np.where(corpus.has_layout, corpus.layout_norms, 1).astype(np.float32)
+            self.layout = np.where(corpus.has_layout[:, None], corpus.layout / norms[:, None], 0).astype(np.float32)
+
+        self.color = corpus.color if search_color else None
+        if self.color is not None:
+            lengths = np.diff(self.color.indptr)
+            width = max(int(lengths.max()) if len(lengths) else 0, 1)
+            # Pairs compare their stored bins directly while that is cheaper than all 512
+            self._sparse_pairs = width * width <= HISTOGRAM_SIZE
+            if self._sparse_pairs:
+                self._indices = np.full((self.n, width), -1, dtype=np.int16)
+                self._values = np.zeros((self.n, width), dtype=np.float32)
+                slots = np.arange(len(self.color.indices)) - np.repeat(self.color.indptr[:-1], lengths)
+                self._indices[self.color.rows, slots] = self.color.indices
+                self._values[self.color.rows, slots] = self.color.values
+            else:
+                self._dense = np.zeros((self.n, self.color.size), dtype=np.float32)
+                self._dense[self.color.rows, self.color.indices] = self.color.values
+            self._self_terms = self.color.self_terms.astype(np.float32)
+
+    @classmethod
+    def from_rows(
+        cls,
+        rows: List[Dict],
+        search_layout: bool = True,
+        search_color: bool = True,
+        weight_layout: float = 0.5,
+        weight_color: float = 0.5
+    ) -> 'PairScorer':
+        """From get_screens_by_type rows (CORPUS_COLUMNS, layout_minhash included)"""
+        return cls(SectionCorpus.from_rows(rows), search_layout, search_color, weight_layout, weight_color)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def combine(self, layout_scores, color_scores) -> np.ndarray:
+        return np.asarray(
+            combine_scores(layout_scores, color_scores, self.weight_layout, self.weight_color), dtype=np.float32
+        )
+
+    def row(self, pos: int) -> np.ndarray:
+        """Scores of row `pos` against every row, exactly as search computes them"""
+        corpus = self.corpus
+        scores, _, _ = corpus.score(
+            corpus.layout[pos] if corpus.has_layout[pos] else None,
+            corpus.minhash[pos] if corpus.has_minhash[pos] else None,
+            corpus.color.row(pos),
+            search_layout=self.search_layout,
+            search_color=self.search_color,
+            weight_layout=self.weight_layout,
+            weight_color=self.weight_color
+        )
+        return scores.astype(np.float32)
+
+    def layout_pairs(self, a: np.ndarray, b: np.ndarray) -> Optional[np.ndarray]:
+        if self.layout is None:
+            return None
+        step = max(1, BLOCK_ELEMENTS // max(self.layout.shape[1], 1))
+        cosine = np.concatenate([
+            np.einsum('ij,ij->i', self.layout[a[start:start + step]], self.layout[b[start:start + step]])
+            for start in range(0, len(a), step)
+        ]) if len(a) else np.zeros(0, dtype=np.float32)
+        return self.minhash_fallback(a, b, cosine)
+
+    def minhash_fallback(self, a: np.ndarray, b: np.ndarray, cosine: np.ndarray) -> np.ndarray:
+        """
+        Layout scores of the pairs given their cosines: pairs where either row
+        has no embedding take the estimated Jaccard of their MinHash signatures
+        (0 when either has none), as SectionCorpus.layout_scores does
+        """
+        corpus = self.corpus
+        scores = cosine.astype(np.float32, copy=True)
+        missing = np.flatnonzero(~(corpus.has_layout[a] & corpus.has_layout[b]))
+        if len(missing):
+            left, right = a[missing], b[missing]
+            both = corpus.has_minhash[left] & corpus.has_minhash[right]
+            jaccard = np.zeros(len(missing), dtype=np.float32)
+            if both.any():
+                jaccard[both] = (corpus.minhash[left[both]] == corpus.minhash[right[both]]).mean(axis=1)
+            scores[missing] = jaccard
+        return scores
+
+    def layout_block(self, candidates: np.ndarray) -> Optional[np.ndarray]:
+        """(B, M, M) layout cosines between the candidates of each of B rows (-1 padding reads row 0)"""
+        if self.layout is None:
+            return None
+        gathered = self.layout[np.maximum(candidates, 0)]
+        return gathered @ gathered.transpose(0, 2, 1)
+
+    def color_pairs(self, a: np.ndarray, b: np.ndarray) -> Optional[np.ndarray]:
+        """Chi-square color similarity of the pairs (a[i], b[i])"""
+        if self.color is None:
+            return None
+        chi_square = np.empty(len(a), dtype=np.float32)
+        width = self._indices.shape[1] ** 2 if self._sparse_pairs else self._dense.shape[1]
+        step = max(1, BLOCK_ELEMENTS // width)
+        for start in range(0, len(a), step):
+            left, right = a[start:start + step], b[start:start + step]
+            if self._sparse_pairs:
+                # Same terms as _chi_square: shared bins swap their self terms for (a-b)^2/(a+b)
+                ia, ib = self._indices[left], self._indices[right]
+                pair, i, j = np.nonzero((ia[:, :, None] == ib[:, None, :]) & (ia >= 0)[:, :, None])
+                va, vb = self._values[left][pair, i], self._values[right][pair, j]
+                shared = _self_terms(va) + _self_terms(vb) - (va - vb) ** 2 / (va + vb + _EPS)
+                chi_square[start:start + step] = (
+                    self._self_terms[left] + self._self_terms[right]
+                    - np.bincount(pair, weights=shared, minlength=len(left))
+                )
+            else:
+                da, db = self._dense[left], self._dense[right]
+                chi_square[start:start + step] = ((da - db) ** 2 / (da + db + _EPS)).sum(axis=1)
+        return np.exp(-chi_square / 2)
+
+    def pairs(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Scores of the pairs (a[i], b[i])"""
+        return self.combine(self.layout_pairs(a, b), self.color_pairs(a, b))
+
+    def block_rows(self, width: int) -> int:
+        """Rows per layout_block() call that keep its temporaries within BLOCK_ELEMENTS"""
+        per_row = width * max(self.layout.shape[1] if self.layout is not None else 1, 1)
+        return max(1, BLOCK_ELEMENTS // per_row)
+
+
+def _group_ranks(keys: np.ndarray) -> np.ndarray:
+    """Rank of every element within its run of equal (sorted) keys"""
+    starts = np.searchsorted(keys, keys, side='left')
+    return np.arange(len(keys)) - starts
+
+
+def _padded(rows: np.ndarray, values: np.ndarray, n: int, width: int) -> np.ndarray:
+    """(n, width) matrix of `values` grouped by sorted `rows`, -1 padded"""
+    out = np.full((n, width), -1, dtype=np.int64)
+    ranks = _group_ranks(rows)
+    keep = ranks < width
+    out[rows[keep], ranks[keep]] = values[keep]
+    return out
+
+
+def _sample_reverse(neighbors: np.ndarray, n: int, width: int, rng: np.random.Generator) -> np.ndarray:
+    """Up to `width` random reverse neighbors of every row (u for each edge u -> v)"""
+    owners, slots = np.nonzero(neighbors >= 0)
+    targets = neighbors[owners, slots]
+    order = np.lexsort((rng.random(len(targets)), targets))
+    return _padded(targets[order], owners[order], n, width)
+
+
+class KNNGraph:
+    """Approximate k-nearest-neighbor lists of every row, with build statistics"""
+
+    def __init__(self, neighbors: np.ndarray, scores: np.ndarray, stats: Dict):
+        # Positions of the neighbors, best first (-1 where a row has fewer than k)
+        self.neighbors = neighbors
+        self.scores = scores
+        self.stats = stats
+
+
+class NNDescent:
+    """
+    NN-descent (Dong, Moses & Li, 2011): start from random neighbor lists and
+    repeatedly compare the neighbors of each row's neighbors ("a neighbor of
+    a neighbor is likely a neighbor"), keeping the best `list_size` per row
+    and returning the top k of each. Each iteration joins a `sample_rate`
+    share of the entries that are new since the last one, plus reverse
+    neighbors, and stops once fewer than delta * n * list_size entries
+    change. Empirically this takes about O(n^1.14) comparisons instead of
+    the n^2 / 2 of exact all-pairs scoring; lists wider than k cost more
+    comparisons and raise recall. Up to `exact_rows` rows, where all pairs
+    are cheaper than the descent, lists are exact.
+    """
+
+    def __init__(
+        self,
+        k: int = 5,
+        iterations: int = 10,
+        sample_rate: float = 0.5,
+        delta: float = 0.001,
+        list_size: int = 20,
+        exact_rows: int = 1000,
+        seed: int = 0
+    ):
+        self.k = k
+        self.list_size = max(k, list_size)
+        self.exact_rows = exact_rows
+        self.iterations = iterations
+        self.sample_rate = sample_rate
+        self.delta = delta
+        self.seed = seed
+
+    def build(
+        self,
+        scorer: PairScorer,
+        eligible: Optional[np.ndarray] = None,
+        groups: Optional[np.ndarray] = None,
+        progress: Optional[Callable[[int, int, int], None]] = None
+    ) -> KNNGraph:
+        """
+        eligible: rows that may appear as neighbors (default: all).
+        groups: rows sharing a group never link (e.g. the same img_url); each
+        row is always excluded from its own list.
+        progress(iteration, updates, comparisons) is called after each iteration.
+        """
+        n, k = len(scorer), self.list_size
+        rng = np.random.default_rng(self.seed)
+        eligible = np.ones(n, dtype=bool) if eligible is None else eligible
+        groups = np.arange(n) if groups is None else groups
+        pool = np.flatnonzero(eligible)
+
+        neighbors = np.full((n, k), -1, dtype=np.int64)
+        scores = np.full((n, k), -np.inf, dtype=np.float32)
+        is_new = np.zeros((n, k), dtype=bool)
+        stats = {'comparisons': 0, 'iterations': 0, 'updates': []}
+        if n < 2 or not len(pool):
+            return KNNGraph(neighbors[:, :self.k], scores[:, :self.k], stats)
+        if n <= self.exact_rows:
+            return self._build_exact(scorer, eligible, groups)
+
+        # Random initial lists (duplicates and self links are dropped by the merge)
+        owners = np.repeat(np.arange(n), k)
+        initial = pool[rng.integers(0, len(pool), size=n * k)]
+        neighbors, scores, is_new, _ = self._merge(
+            neighbors, scores, is_new, owners, initial, scorer.pairs(owners, initial), eligible, groups
+        )
+        stats['comparisons'] += n * k
+
+        sample = max(1, int(math.ceil(self.sample_rate * k)))
+        for iteration in range(1, self.iterations + 1):
+            valid = neighbors >= 0
+            # Up to `sample` new entries per row join this iteration and become old
+            priority = np.where(valid & is_new, rng.random((n, k)), np.inf)
+            chosen = np.argsort(priority, axis=1)[:, :sample]
+            chosen_ok = np.isfinite(np.take_along_axis(priority, chosen, axis=1))
+            new_lists = np.where(chosen_ok, np.take_along_axis(neighbors, chosen, axis=1), -1)
+            old_lists = np.where(valid & ~is_new, neighbors, -1)
+            rows_idx = np.repeat(np.arange(n)[:, None], chosen.shape[1], axis=1)
+            is_new[rows_idx[chosen_ok], chosen[chosen_ok]] = False
+
+            new_candidates = np.hstack([new_lists, _sample_reverse(new_lists, n, sample, rng)])
+            old_candidates = np.hstack([old_lists, _sample_reverse(old_lists, n, sample, rng)])
+            candidates = np.hstack([new_candidates, old_candidates])
+            width, new_width = candidates.shape[1], new_candidates.shape[1]
+
+            # Pairs to compare inside each row's candidates: new x new (once) and new x old
+            first, second = np.meshgrid(np.arange(width), np.arange(width), indexing='ij')
+            template = (first < new_width) & ((second >= new_width) | (second > first))
+
+            active = np.flatnonzero((new_candidates >= 0).any(axis=1))
+            found_a, found_b, found_layout = [], [], []
+            step = scorer.block_rows(width)
+            for start in range(0, len(active), step):
+                batch = candidates[active[start:start + step]]
+                left, right = batch[:, :, None], batch[:, None, :]
+                mask = template & (left >= 0) & (right >= 0) & (left != right)
+                b, i, j = np.nonzero(mask)
+                found_a.append(batch[b, i])
+                found_b.append(batch[b, j])
+                # Layout cosines of every candidate pair of a row are one small matrix product
+                block = scorer.layout_block(batch)
+                if block is not None:
+                    found_layout.append(block[b, i, j])
+            if not found_a:
+                break
+            a, b = np.concatenate(found_a), np.concatenate(found_b)
+            layout_scores = np.concatenate(found_layout) if found_layout else None
+
+            # A pair met through several rows is scored once; pairs neither end may list are skipped
+            low, high = np.minimum(a, b), np.maximum(a, b)
+            _, unique = np.unique(low * n + high, return_index=True)
+            a, b = low[unique], high[unique]
+            useful = (groups[a] != groups[b]) & (eligible[a] | eligible[b])
+            unique, a, b = unique[useful], a[useful], b[useful]
+            pair_scores = scorer.combine(
+                scorer.minhash_fallback(a, b, layout_scores[unique]) if layout_scores is not None else None,
+                scorer.color_pairs(a, b)
+            )
+            stats['comparisons'] += len(a)
+
+            # Both ends of a compared pair are offered the other
+            neighbors, scores, is_new, updates = self._merge(
+                neighbors, scores, is_new,
+                np.concatenate([a, b]), np.concatenate([b, a]), np.concatenate([pair_scores, pair_scores]),
+                eligible, groups
+            )
+            stats['iterations'] = iteration
+            stats['updates'].append(updates)
+            if progress is not None:
+                progress(iteration, updates, stats['comparisons'])
+            if updates < self.delta * n * k:
+                break
+
+        return KNNGraph(neighbors[:, :self.k].copy(), scores[:, :self.k].copy(), stats)
+
+    def _build_exact(self, scorer: PairScorer, eligible: np.ndarray, groups: np.ndarray) -> KNNGraph:
+        n, k = len(scorer), self.k
+        neighbors = np.full((n, k), -1, dtype=np.int64)
+        scores = np.full((n, k), -np.inf, dtype=np.float32)
+        for pos in range(n):
+            row_scores = scorer.row(pos)
+            top = exact_neighbors(scorer, pos, k, eligible, groups, row_scores)
+            neighbors[pos, :len(top)] = top
+            scores[pos, :len(top)] = row_scores[top]
+        return KNNGraph(neighbors, scores, {'comparisons': n * (n - 1) // 2, 'iterations': 0, 'updates': []})
+
+    def _merge(
+        self,
+        neighbors: np.ndarray,
+        scores: np.ndarray,
+        is_new: np.ndarray,
+        owners: np.ndarray,
+        offered: np.ndarray,
+        offered_scores: np.ndarray,
+        eligible: np.ndarray,
+        groups: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+        """Keep the best k distinct neighbors per row out of the current lists and the offered pairs"""
+        n, k = neighbors.shape
+        current_owners, slots = np.nonzero(neighbors >= 0)
+        # An offer has to beat the last entry of a full list
+        keep = eligible[offered] & (groups[owners] != groups[offered]) & (offered_scores > scores[owners, -1])
+        rows = np.concatenate([current_owners, owners[keep]])
+        cols = np.concatenate([neighbors[current_owners, slots], offered[keep]])
+        values = np.concatenate([scores[current_owners, slots], offered_scores[keep]])
+        flags = np.concatenate([is_new[current_owners, slots], np.ones(int(keep.sum()), dtype=bool)])
+        fresh = np.concatenate([np.zeros(len(current_owners), dtype=bool), np.ones(int(keep.sum()), dtype=bool)])
+
+        # Current entries come first, so a pair already listed keeps its flag
+        _, first = np.unique(rows * n + cols, return_index=True)
+        rows, cols, values, flags, fresh = rows[first], cols[first], values[first], flags[first], fresh[first]
+
+        # Best first within each row; ties on the lower position, as in exact ranking
+        order = np.lexsort((cols, -values, rows))
+        rows, cols, values, flags, fresh = rows[order], cols[order], values[order], flags[order], fresh[order]
+        ranks = _group_ranks(rows)
+        top = ranks < k
+
+        merged = np.full((n, k), -1, dtype=np.int64)
+        merged_scores = np.full((n, k), -np.inf, dtype=np.float32)
+        merged_new = np.zeros((n, k), dtype=bool)
+        merged[rows[top], ranks[top]] = cols[top]
+        merged_scores[rows[top], ranks[top]] = values[top]
+        merged_new[rows[top], ranks[top]] = flags[top]
+        return merged, merged_scores, merged_new, int(fresh[top].sum())
+
+
+def exact_neighbors(
+    scorer: PairScorer,
+    pos: int,
+    k: int,
+    eligible: Optional[np.ndarray] = None,
+    groups: Optional[np.ndarray] = None,
+    scores: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Exact top-k positions of one row under the same exclusions as NNDescent.build"""
+    scores = scorer.row(pos) if scores is None else scores
+    allowed = np.ones(len(scores), dtype=bool) if eligible is None else eligible.copy()
+    allowed &= (np.arange(len(scores)) != pos) if groups is None else (groups != groups[pos])
+    candidates = np.flatnonzero(allowed)
+    return candidates[np.argsort(-scores[candidates], kind='stable')[:k]]
+
+
+def graph_recall(
+    graph: KNNGraph,
+    scorer: PairScorer,
+    sample: int = 100,
+    eligible: Optional[np.ndarray] = None,
+    groups: Optional[np.ndarray] = None,
+    seed: int = 0
+) -> float:
+    """Mean share of the exact top-k found by the graph, over `sample` random rows"""
+    n, k = graph.neighbors.shape
+    rows = np.random.default_rng(seed).choice(n, size=min(sample, n), replace=False)
+    found = total = 0
+    for pos in rows:
+        exact = exact_neighbors(scorer, int(pos), k, eligible, groups)
+        found += len(np.intersect1d(exact, graph.neighbors[pos][graph.neighbors[pos] >= 0]))
+        total += len(exact)
+    return found / total if total else 1.0
@@ -0,0 +1,114 @@
+import os
+import re
+import hashlib
+from html import escape
+from html.parser import HTMLParser
+from typing import List, Optional
+
+# Recorded in the provenance of layout embeddings; bump when the canonical form changes
+CANONICAL_VERSION = "canonical-v1"
+
+# Tokens (~4 characters each) kept per text node in the embedding input; 0 keeps all text
+LAYOUT_TEXT_TOKENS = int(os.getenv("LAYOUT_TEXT_TOKENS", 0))
+
+# Subtrees identical in every Gemini document or irrelevant to the layout
+_DROPPED_SUBTREES = {'head', 'title', 'script', 'style', 'noscript', 'template'}
+_DROPPED_TAGS = {'meta', 'link', 'base'}
+_VOID_TAGS = {'area', 'br', 'col', 'embed', 'hr', 'img', 'input', 'source', 'track', 'wbr'}
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def canonical_config(max_text_tokens: Optional[int] = None) -> str:
+    """Canonicalization recorded in provenance, including the text budget when one is set"""
+    budget = LAYOUT_TEXT_TOKENS if max_text_tokens is None else max_text_tokens
+    return f"{CANONICAL_VERSION}-t{budget}" if budget else CANONICAL_VERSION
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    limit = max_tokens * 4
+    if len(text) <= limit:
+        return text
+    # The ellipsis counts toward the limit, so a truncated node is not cut again
+    cut = text.rfind(' ', 0, limit)
+    return text[:cut if cut > 0 else limit - 1].rstrip() + '…'
+
+
+class _CanonicalWriter(HTMLParser):
+    """Re-serializes layout HTML without boilerplate, with sorted attributes and collapsed whitespace"""
+
+    def __init__(self, max_text_tokens: int = 0):
+        super().__init__(convert_charrefs=True)
+        self.max_text_tokens = max_text_tokens
+        self.parts: List[str] = []
+        self.dropped: List[str] = []
+
+    def _open(self, tag, attrs):
+        if self.dropped or tag in _DROPPED_TAGS:
+            return
+        rendered = []
+        for name, value in sorted(attrs, key=lambda attr: attr[0]):
+            if value is None:
+                rendered.append(name)
+                continue
+            value = _WHITESPACE.sub(' ', value).strip()
+            if name == 'class':
+                value = ' '.join(sorted(set(value.split())))
+            rendered.append(f'{name}="{escape(value)}"')
+        self.parts.append(f"<{' '.join([tag] + rendered)}>")
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _DROPPED_SUBTREES:
+            self.dropped.append(tag)
+            return
+        self._open(tag, attrs)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag not in _DROPPED_SUBTREES:
+            self._open(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if self.dropped:
+            if tag == self.dropped[-1]:
+                self.dropped.pop()
+            return
+        if tag not in _VOID_TAGS and tag not in _DROPPED_TAGS:
+            self.parts.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        if self.dropped:
+            return
+        text = _WHITESPACE.sub(' ', data).strip()
+        if not text:
+            return
+        if self.max_text_tokens:
+            text = _truncate(text, self.max_text_tokens)
+        self.parts.append(escape(text, quote=False))
+
+    # Doctype, comments and processing instructions are dropped
+    def handle_decl(self, decl):
+        pass
+
+    def handle_comment(self, data):
+        pass
+
+    def handle_pi(self, data):
+        pass
+
+
+def canonicalize_layout(layout_html: str, max_text_tokens: int = 0) -> str:
+    """
+    Canonical form of a Gemini layout document: doctype, <head>, meta tags,
+    scripts, styles and comments removed, attributes and class names sorted,
+    whitespace collapsed. With max_text_tokens, longer text nodes are cut at
+    a word boundary. Canonicalizing a canonical document returns it unchanged.
+    """
+    writer = _CanonicalWriter(max_text_tokens)
+    writer.feed(layout_html or '')
+    writer.close()
+    return ''.join(writer.parts)
+
+
+def canonical_hash(layout_html: str) -> str:
+    """Stable SHA-256 of a document's canonical form; documents differing only in boilerplate share it"""
+    return hashlib.sha256(canonicalize_layout(layout_html).encode('utf-8')).hexdigest()
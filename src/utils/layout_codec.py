@@ -0,0 +1,100 @@
+import os
+import base64
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from ..config.storage import LAYOUT_COMPRESSION
+
+# Compression level of new layout frames; dictionary compression is already most of the gain
+LAYOUT_ZSTD_LEVEL = int(os.getenv("LAYOUT_ZSTD_LEVEL", 9))
+
+# zstd's customary dictionary size; training wants roughly 100x as many sample bytes
+DEFAULT_DICT_SIZE = 112 * 1024
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Compressed layouts need zstandard (pip install zstandard)")
+    return zstandard
+
+
+def train_layout_dictionary(samples: Sequence[str], dict_size: int = DEFAULT_DICT_SIZE) -> Tuple[int, str]:
+    """(dictionary id, base64 dictionary) trained on layout documents"""
+    zstd = _zstd()
+    dictionary = zstd.train_dictionary(dict_size, [sample.encode('utf-8') for sample in samples])
+    return dictionary.dict_id(), base64.b64encode(dictionary.as_bytes()).decode('ascii')
+
+
+def layout_columns(columns: str) -> str:
+    """
+    Select list that also fetches layout_zstd whenever layout_data is requested.
+    Only with LAYOUT_COMPRESSION=zstd: without it the column may not exist yet.
+    """
+    if LAYOUT_COMPRESSION != 'zstd':
+        return columns
+    names = [name.strip() for name in columns.split(',')]
+    if 'layout_data' in names and 'layout_zstd' not in names:
+        return f"{columns}, layout_zstd"
+    return columns
+
+
+class LayoutCodec:
+    """
+    zstd frames of layout HTML compressed with dictionaries trained on the
+    corpus, stored base64-encoded in relative_screen.layout_zstd. Each frame
+    names its dictionary, so rows written under older dictionaries stay
+    readable; new frames use the most recent one.
+    """
+
+    def __init__(self, dictionaries: Optional[Dict[int, str]] = None, level: int = LAYOUT_ZSTD_LEVEL):
+        """dictionaries: base64 dictionary by id, oldest first"""
+        self.level = level
+        self.dictionaries = dict(dictionaries or {})
+        self._compressors = {}
+        self._decompressors = {}
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Dict], level: int = LAYOUT_ZSTD_LEVEL) -> 'LayoutCodec':
+        """Codec over layout_dictionaries rows ordered by creation"""
+        return cls({row['id']: row['dictionary'] for row in rows}, level)
+
+    @property
+    def active_id(self) -> Optional[int]:
+        return next(reversed(self.dictionaries), None)
+
+    def _dictionary(self, dict_id: int):
+        if dict_id not in self.dictionaries:
+            raise KeyError(f"Unknown layout dictionary: {dict_id}")
+        return _zstd().ZstdCompressionDict(base64.b64decode(self.dictionaries[dict_id]))
+
+    def compress(self, layout_html: str) -> str:
+        """Base64 zstd frame of a document under the newest dictionary"""
+        dict_id = self.active_id
+        if dict_id is None:
+            raise ValueError("No layout dictionary trained yet")
+        if dict_id not in self._compressors:
+            self._compressors[dict_id] = _zstd().ZstdCompressor(level=self.level, dict_data=self._dictionary(dict_id))
+        frame = self._compressors[dict_id].compress(layout_html.encode('utf-8'))
+        return base64.b64encode(frame).decode('ascii')
+
+    @staticmethod
+    def frame_dictionary(blob: str) -> int:
+        """Id of the dictionary a stored frame was compressed with"""
+        return _zstd().get_frame_parameters(base64.b64decode(blob)).dict_id
+
+    def decompress(self, blob: str) -> str:
+        frame = base64.b64decode(blob)
+        dict_id = _zstd().get_frame_parameters(frame).dict_id
+        if dict_id not in self._decompressors:
+            self._decompressors[dict_id] = _zstd().ZstdDecompressor(dict_data=self._dictionary(dict_id))
+        return self._decompressors[dict_id].decompress(frame).decode('utf-8')
+
+
+def unpack_layout_rows(rows: List[Dict], codec: LayoutCodec) -> List[Dict]:
+    """Fill layout_data from layout_zstd in place (uncompressed values win) and drop layout_zstd"""
+    for row in rows:
+        blob = row.pop('layout_zstd', None)
+        if blob and row.get('layout_data') is None:
+            row['layout_data'] = codec.decompress(blob)
+    return rows
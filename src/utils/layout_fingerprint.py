@@ -0,0 +1,162 @@
+import hashlib
+import numpy as np
+from html.parser import HTMLParser
+from typing import Dict, Hashable, Iterable, List, Optional, Set
+
+NUM_PERM = 128
+LSH_BANDS = 32
+# Recorded as the provenance of stored signatures; bump when shingling changes
+MINHASH_VERSION = f"tag-shingles-v1-{NUM_PERM}"
+
+# Universal hashing modulo a Mersenne prime; hashes are reduced below it first
+# so a * h + b stays inside uint64
+_PRIME = np.uint64((1 << 31) - 1)
+
+# Tags that carry no layout structure
+_IGNORED_TAGS = {'html', 'head', 'meta', 'title', 'link', 'script', 'style', 'br'}
+
+
+class _StructureParser(HTMLParser):
+    """Collects structural shingles from the Gemini layout HTML"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack: List[str] = []
+        self.children: List[List[str]] = [[]]
+        self.shingles: Set[str] = set()
+
+    def _label(self, tag: str, attrs: Dict[str, Optional[str]]) -> str:
+        label = tag
+        if attrs.get('data-section-type'):
+            label += f"#{attrs['data-section-type'].strip().lower()}"
+        if attrs.get('data-position'):
+            label += f"@{attrs['data-position'].strip().lower()}"
+        return label
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _IGNORED_TAGS:
+            return
+        label = self._label(tag, dict(attrs))
+
+        # Ancestor paths of length 1-3 ending at this element
+        path = self.stack + [label]
+        for n in range(1, 4):
+            if len(path) >= n:
+                self.shingles.add('/'.join(path[-n:]))
+
+        # Sibling order under the same parent
+        siblings = self.children[-1]
+        if siblings:
+            self.shingles.add(f"{siblings[-1]}+{label}")
+        siblings.append(label)
+
+        if label.startswith('section'):
+            self.shingles.add(f"section-depth:{len(self.stack)}")
+
+        if tag not in {'img', 'input', 'hr'}:
+            self.stack.append(label)
+            self.children.append([])
+
+    def handle_endtag(self, tag):
+        if tag in _IGNORED_TAGS or tag in {'img', 'input', 'hr'}:
+            return
+        # Tolerate unbalanced markup: unwind to the matching open tag
+        for depth in range(len(self.stack) - 1, -1, -1):
+            if self.stack[depth].split('#')[0].split('@')[0] == tag:
+                if len(self.children[-1]) > 0:
+                    self.shingles.add(f"{self.stack[depth]}>{len(self.children[-1])}")
+                del self.stack[depth:]
+                del self.children[depth + 1:]
+                return
+
+
+def extract_shingles(layout_html: str) -> Set[str]:
+    """Tag paths, data-position/data-section-type labels and sibling order of a layout document"""
+    parser = _StructureParser()
+    parser.feed(layout_html or '')
+    parser.close()
+    return parser.shingles
+
+
+def _permutations(num_perm: int, seed: int) -> np.ndarray:
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, int(_PRIME), size=num_perm).astype(np.uint64)
+    b = rng.randint(0, int(_PRIME), size=num_perm).astype(np.uint64)
+    return np.stack([a, b])
+
+
+_PERMUTATIONS = _permutations(NUM_PERM, seed=1)
+
+
+def compute_minhash(shingles: Iterable[str], num_perm: int = NUM_PERM) -> List[int]:
+    """MinHash signature of a shingle set (all values are max for an empty set)"""
+    perms = _PERMUTATIONS if num_perm == NUM_PERM else _permutations(num_perm, seed=1)
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), 'little') for s in shingles],
+        dtype=np.uint64
+    ) % _PRIME
+    if hashes.size == 0:
+        return [int(_PRIME)] * num_perm
+    a, b = perms[0][:, None], perms[1][:, None]
+    return ((a * hashes[None, :] + b) % _PRIME).min(axis=1).astype(np.int64).tolist()
+
+
+def get_layout_minhash(layout_html: str, num_perm: int = NUM_PERM) -> List[int]:
+    """MinHash signature of a layout document"""
+    return compute_minhash(extract_shingles(layout_html), num_perm)
+
+
+def estimate_jaccard(sig1: List[int], sig2: List[int]) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures"""
+    sig1 = np.asarray(sig1)
+    sig2 = np.asarray(sig2)
+    if sig1.shape != sig2.shape or sig1.size == 0:
+        return 0.0
+    return float(np.mean(sig1 == sig2))
+
+
+class LayoutLSHIndex:
+    """
+    Banded LSH over MinHash signatures. Two layouts with Jaccard similarity s
+    share a bucket in at least one band with probability 1 - (1 - s^r)^b
+    (r rows per band, b bands); 32 bands of 4 rows put the threshold near 0.4.
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, bands: int = LSH_BANDS):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.buckets: List[Dict[bytes, Set[Hashable]]] = [{} for _ in range(bands)]
+        self.signatures: Dict[Hashable, np.ndarray] = {}
+
+    def _band_keys(self, signature) -> List[bytes]:
+        sig = np.asarray(signature, dtype=np.int64)
+        return [sig[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, key: Hashable, signature: List[int]):
+        self.remove(key)
+        self.signatures[key] = np.asarray(signature, dtype=np.int64)
+        for band, band_key in zip(self.buckets, self._band_keys(signature)):
+            band.setdefault(band_key, set()).add(key)
+
+    def remove(self, key: Hashable):
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        for band, band_key in zip(self.buckets, self._band_keys(signature)):
+            bucket = band.get(band_key)
+            if bucket:
+                bucket.discard(key)
+                if not bucket:
+                    del band[band_key]
+
+    def query(self, signature: List[int]) -> Set[Hashable]:
+        """Keys sharing at least one band with the signature"""
+        candidates: Set[Hashable] = set()
+        for band, band_key in zip(self.buckets, self._band_keys(signature)):
+            candidates |= band.get(band_key, set())
+        return candidates
+
+    def __len__(self) -> int:
+        return len(self.signatures)
@@ -0,0 +1,83 @@
+import cv2
+import numpy as np
+from typing import Hashable, List, Optional, Tuple
+
+# 8x8 low-frequency DCT block -> 64-bit hash
+HASH_SIZE = 8
+_HIGHFREQ_FACTOR = 4
+
+
+def compute_phash(img: np.ndarray, hash_size: int = HASH_SIZE) -> int:
+    """
+    DCT perceptual hash of a decoded BGR image.
+    Bits mark which low-frequency coefficients are above their median, so the
+    hash survives re-encoding, rescaling and small pixel differences.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    size = hash_size * _HIGHFREQ_FACTOR
+    small = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:hash_size, :hash_size]
+    bits = (low > np.median(low)).flatten()
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+def hash_to_hex(value: int, hash_size: int = HASH_SIZE) -> str:
+    """Fixed-width hex string, as stored in relative_screen.image_hash"""
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+
+def hex_to_hash(value: str) -> int:
+    return int(value, 16)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over integer hashes with Hamming distance.
+    A radius-r query only descends into children whose edge distance d
+    satisfies |d - dist(query, node)| <= r (triangle inequality).
+    """
+
+    def __init__(self):
+        # node: [hash, keys, {distance: child}]
+        self.root: Optional[list] = None
+        self.size = 0
+
+    def add(self, hash_value: int, key: Hashable):
+        self.size += 1
+        if self.root is None:
+            self.root = [hash_value, [key], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            if distance == 0:
+                node[1].append(key)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, [key], {}]
+                return
+            node = child
+
+    def find(self, hash_value: int, max_distance: int) -> List[Tuple[int, Hashable]]:
+        """(distance, key) pairs within max_distance, closest first"""
+        if self.root is None:
+            return []
+        matches = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= max_distance:
+                matches.extend((distance, key) for key in node[1])
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return sorted(matches, key=lambda match: match[0])
+
+    def __len__(self) -> int:
+        return self.size
@@ -0,0 +1,76 @@
+import hashlib
+from typing import Dict, Iterable, Optional, Union
+
+from ..config.models import GEMINI_MODEL, EMBEDDING_MODEL
+from ..config.prompts import SCREEN_PROMPTS
+from ..types.screen import ScreenType
+from .color_histogram import HISTOGRAM_VERSION
+from .layout_fingerprint import MINHASH_VERSION
+from .layout_canonical import canonical_config
+
+# Stored features of a relative_screen row. layout_embedding and layout_minhash are
+# derived from layout_data, so recomputing layout_data recomputes them as well.
+FEATURES = ('layout_data', 'layout_embedding', 'layout_minhash', 'color_histogram')
+
+# Features computed from the screenshot itself, whose provenance records the image hash
+SOURCE_FEATURES = ('layout_data', 'color_histogram')
+
+
+def content_hash(data: Union[str, bytes]) -> str:
+    """SHA-256 of image bytes or text"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def prompt_hash(section: Union[ScreenType, str]) -> str:
+    return content_hash(SCREEN_PROMPTS[ScreenType(section)])[:16]
+
+
+def current_config(feature: str, section: Union[ScreenType, str]) -> Dict[str, str]:
+    """Model/parameter values a freshly computed feature would record"""
+    if feature == 'layout_data':
+        return {'gemini_model': GEMINI_MODEL, 'prompt_hash': prompt_hash(section)}
+    if feature == 'layout_embedding':
+        # Embeddings of raw (pre-canonicalization) HTML are stale
+        return {'model': EMBEDDING_MODEL, 'canonical': canonical_config()}
+    if feature == 'layout_minhash':
+        return {'version': MINHASH_VERSION}
+    if feature == 'color_histogram':
+        return {'version': HISTOGRAM_VERSION}
+    raise ValueError(f"Unknown feature: {feature}")
+
+
+def build_provenance(
+    section: Union[ScreenType, str],
+    features: Iterable[str] = FEATURES,
+    source_sha256: Optional[str] = None,
+    base: Optional[Dict] = None
+) -> Dict:
+    """`base` with the entries of `features` replaced by the current configuration"""
+    provenance = dict(base or {})
+    for feature in features:
+        entry = current_config(feature, section)
+        if feature in SOURCE_FEATURES and source_sha256:
+            entry['source_sha256'] = source_sha256
+        provenance[feature] = entry
+    return provenance
+
+
+def is_stale(
+    provenance: Optional[Dict],
+    feature: str,
+    section: Union[ScreenType, str],
+    source_sha256: Optional[str] = None
+) -> bool:
+    """
+    Whether a stored feature differs from what the current configuration would
+    produce. Rows without provenance are stale. The image hash is compared only
+    when `source_sha256` is given, since that needs a download.
+    """
+    recorded = (provenance or {}).get(feature)
+    if not recorded:
+        return True
+    if any(recorded.get(key) != value for key, value in current_config(feature, section).items()):
+        return True
+    return source_sha256 is not None and recorded.get('source_sha256') != source_sha256
@@ -0,0 +1,258 @@
+import time
+import random
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional
+from ..config.rate_limits import RATE_LIMITS, MAX_CONCURRENCY, INITIAL_CONCURRENCY, MAX_RETRIES
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+OVERLOAD_STATUS = {429, 503}
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    """HTTP status of an OpenAI/Gemini/requests error, if it carries one"""
+    for attr in ('status_code', 'code', 'status'):
+        value = getattr(error, attr, None)
+        if callable(value):
+            continue
+        try:
+            if value is not None:
+                return int(value)
+        except (TypeError, ValueError):
+            continue
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    return int(status) if isinstance(status, int) else None
+
+
+def is_rate_limited(error: Exception) -> bool:
+    if _status_code(error) == 429:
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return 'resourceexhausted' in text or 'rate limit' in text or '429' in text
+
+
+def is_retryable(error: Exception) -> bool:
+    if is_rate_limited(error):
+        return True
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return _status_code(error) in RETRYABLE_STATUS
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read Retry-After (seconds) or retry-after-ms from the error's response headers"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate_per_minute`, holding at most one minute of tokens"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if they are now)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        """Charge (positive) or refund (negative) the difference between estimated and actual usage"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class AdaptiveScheduler:
+    """
+    Client-side scheduler for one API.
+    Requests wait for both token buckets (requests/min and tokens/min) and a
+    concurrency slot. The concurrency limit follows AIMD: +1 per limit's worth
+    of fast successes, halved on 429/503 or when latency degrades. Rate-limited
+    and transient failures are retried with jittered exponential backoff,
+    honoring Retry-After, and pause every caller until the server allows again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        initial_concurrency: int = INITIAL_CONCURRENCY,
+        max_concurrency: int = MAX_CONCURRENCY,
+        max_retries: int = MAX_RETRIES,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        latency_factor: float = 2.0
+    ):
+        self.name = name
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.limit = float(max(1, min(initial_concurrency, max_concurrency)))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.latency_factor = latency_factor
+
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.latency_baseline: Optional[float] = None
+        self.last_decrease = 0.0
+        self._loop = None
+        self._condition: Optional[asyncio.Condition] = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        # asyncio primitives are bound to a loop; scripts may run several loops in turn
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._loop is not loop:
+            self._loop = loop
+            self._condition = asyncio.Condition()
+            self.in_flight = 0
+        return self._condition
+
+    async def _acquire_slot(self):
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def _wait_for_buckets(self, tokens: float):
+        # Wait for the server-imposed pause and both buckets, then take from them together
+        while True:
+            wait = max(
+                self.paused_until - time.monotonic(),
+                self.request_bucket.wait_time(1),
+                self.token_bucket.wait_time(tokens)
+            )
+            if wait <= 0:
+                self.request_bucket.consume(1)
+                self.token_bucket.consume(tokens)
+                return
+            await asyncio.sleep(wait)
+
+    async def _release(self):
+        condition = self._get_condition()
+        # Before awaiting the lock, so a second cancellation cannot skip it
+        self.in_flight -= 1
+        async with condition:
+            condition.notify_all()
+
+    def _decrease(self, reason: str):
+        now = time.monotonic()
+        # One decrease per round-trip, so a burst of 429s from one window counts once
+        window = self.latency_baseline or 1.0
+        if now - self.last_decrease < window:
+            return
+        self.last_decrease = now
+        self.limit = max(1.0, self.limit / 2)
+        logger.warning(f"[{self.name}] {reason}: concurrency limit -> {int(self.limit)}")
+
+    def _on_success(self, latency: float):
+        if self.latency_baseline is None:
+            self.latency_baseline = latency
+        if latency > self.latency_baseline * self.latency_factor:
+            self._decrease(f"latency {latency:.1f}s over baseline {self.latency_baseline:.1f}s")
+        else:
+            self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+        # Slow-moving baseline, so sustained congestion still stands out
+        self.latency_baseline = 0.9 * self.latency_baseline + 0.1 * latency
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.base_delay)
+        # Full jitter
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def run(
+        self,
+        fn: Callable[..., Any],
+        *args,
+        tokens: float = 1,
+        usage: Optional[Callable[[Any], Optional[float]]] = None,
+        **kwargs
+    ) -> Any:
+        """
+        Run blocking fn(*args, **kwargs) in a worker thread under the API's limits.
+        `tokens` is the estimated token cost; `usage(result)` may return the actual
+        count, and the difference is charged to (or refunded from) the bucket.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._acquire_slot()
+            # The slot is released on every exit, cancellation included (wait_for timeouts,
+            # gather cancellation, Ctrl-C); a leaked slot would shrink the limit for good
+            try:
+                await self._wait_for_buckets(tokens)
+                start = time.monotonic()
+                try:
+                    result = await asyncio.to_thread(fn, *args, **kwargs)
+                except Exception as e:
+                    if not is_retryable(e) or attempt == self.max_retries:
+                        raise
+                    if _status_code(e) in OVERLOAD_STATUS or is_rate_limited(e):
+                        self._decrease("rate limited")
+                    delay = self._backoff(attempt, e)
+                    self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                    logger.warning(
+                        f"[{self.name}] attempt {attempt + 1}/{self.max_retries + 1} failed ({e}); retrying in {delay:.1f}s"
+                    )
+                    continue
+                self._on_success(time.monotonic() - start)
+            finally:
+                await self._release()
+
+            if usage is not None:
+                try:
+                    actual = usage(result)
+                    if actual:
+                        self.token_bucket.adjust(actual - tokens)
+                except Exception:
+                    pass
+            return result
+
+
+_schedulers: Dict[str, AdaptiveScheduler] = {}
+
+
+def get_scheduler(name: str) -> AdaptiveScheduler:
+    """Shared scheduler per API ("gemini", "openai"), so every caller draws from one quota"""
+    if name not in _schedulers:
+        limits = RATE_LIMITS[name]
+        _schedulers[name] = AdaptiveScheduler(
+            name,
+            requests_per_minute=limits["requests_per_minute"],
+            tokens_per_minute=limits["tokens_per_minute"]
+        )
+    return _schedulers[name]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token)"""
+    return max(1, len(text) // 4)
@@ -0,0 +1,285 @@
+import sys
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .color_index import DOMINANT_MIN_MASS, ColorBinIndex
+from .layout_fingerprint import NUM_PERM
+from .similarity import combine_scores
+from .sparse_histogram import SparseHistogram, SparseHistogramMatrix, to_sparse
+
+# Everything scoring reads; layout_data stays in the database until a row is returned
+CORPUS_COLUMNS = 'id, screen_id, img_url, site_url, layout_embedding, color_embedding, color_histogram, layout_minhash'
+
+
+def parse_vector(value) -> Optional[np.ndarray]:
+    """float32 array from pgvector text ('[0.1,0.2,...]') or a list"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        # One C-level conversion instead of json.loads building a list of Python floats
+        return np.array(value.strip('[] ').split(','), dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+class SectionCorpus:
+    """
+    Columnar view of one section of relative_screen: id/screen_id arrays,
+    interned URLs, a float32 layout matrix, CSR color histograms and a
+    MinHash matrix. Scoring runs over the arrays; callers fetch full rows
+    (layout_data included) by id only for the results they return.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        screen_ids: np.ndarray,
+        img_urls: np.ndarray,
+        site_urls: np.ndarray,
+        layout: np.ndarray,
+        has_layout: np.ndarray,
+        color: SparseHistogramMatrix,
+        minhash: np.ndarray,
+        has_minhash: np.ndarray,
+        sections: Optional[np.ndarray] = None,
+        layout_norms: Optional[np.ndarray] = None
+    ):
+        self.ids = ids
+        # -1 where the row has no screen_id
+        self.screen_ids = screen_ids
+        self.img_urls = img_urls
+        self.site_urls = site_urls
+        self.layout = layout
+        self.has_layout = has_layout
+        if layout_norms is None:
+            with np.errstate(invalid='ignore'):
+                layout_norms = np.linalg.norm(layout, axis=1) if layout.size else np.zeros(len(ids), np.float32)
+        self.layout_norms = layout_norms
+        self.color = color
+        self.minhash = minhash
+        self.has_minhash = has_minhash
+        # Section of every row (interned); only set on corpora loaded across sections
+        self.sections = sections
+        self._positions = {int(analysis_id): pos for pos, analysis_id in enumerate(ids)}
+        self._color_index: Optional[ColorBinIndex] = None
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict]) -> 'SectionCorpus':
+        """Build from get_screens_by_type rows (CORPUS_COLUMNS is enough)"""
+        n = len(rows)
+        ids = np.array([row['id'] for row in rows], dtype=np.int64)
+        screen_ids = np.array(
+            [row['screen_id'] if row.get('screen_id') is not None else -1 for row in rows], dtype=np.int64
+        )
+        # Interned so rows of the same site share one string object
+        img_urls = np.array([sys.intern(row['img_url']) for row in rows], dtype=object)
+        site_urls = np.array([sys.intern(row.get('site_url') or '') for row in rows], dtype=object)
+        sections = (
+            np.array([sys.intern(row['section']) for row in rows], dtype=object)
+            if rows and 'section' in rows[0] else None
+        )
+
+        layout_vectors = [parse_vector(row.get('layout_embedding')) for row in rows]
+        dims = next((len(v) for v in layout_vectors if v is not None), 0)
+        layout = np.zeros((n, dims), dtype=np.float32)
+        has_layout = np.zeros(n, dtype=bool)
+        for pos, vector in enumerate(layout_vectors):
+            if vector is not None and len(vector) == dims:
+                layout[pos] = vector
+                has_layout[pos] = True
+
+        color = SparseHistogramMatrix([
+            to_sparse(row['color_histogram']) if row.get('color_histogram')
+            else SparseHistogram.from_dense(parse_vector(row['color_embedding']))
+            for row in rows
+        ])
+
+        minhash = np.zeros((n, NUM_PERM), dtype=np.int64)
+        has_minhash = np.zeros(n, dtype=bool)
+        for pos, row in enumerate(rows):
+            signature = row.get('layout_minhash')
+            if signature and len(signature) == NUM_PERM:
+                minhash[pos] = signature
+                has_minhash[pos] = True
+
+        return cls(ids, screen_ids, img_urls, site_urls, layout, has_layout, color, minhash, has_minhash, sections)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the arrays (URL strings excluded)"""
+        return (
+            self.ids.nbytes + self.screen_ids.nbytes + self.img_urls.nbytes + self.site_urls.nbytes
+            + self.layout.nbytes + self.has_layout.nbytes + self.layout_norms.nbytes
+            + self.color.nbytes + self.minhash.nbytes + self.has_minhash.nbytes
+        )
+
+    def slice(self, start: int, end: int) -> 'SectionCorpus':
+        """
+        Rows start..end-1 as a corpus of views into this one (apart from the
+        rebased color offsets, see SparseHistogramMatrix.slice); signatures
+        filled in through it land in this corpus too
+        """
+        return SectionCorpus(
+            self.ids[start:end],
+            self.screen_ids[start:end],
+            self.img_urls[start:end],
+            self.site_urls[start:end],
+            self.layout[start:end],
+            self.has_layout[start:end],
+            self.color.slice(start, end),
+            self.minhash[start:end],
+            self.has_minhash[start:end],
+            self.sections[start:end] if self.sections is not None else None,
+            self.layout_norms[start:end]
+        )
+
+    def position(self, analysis_id: int) -> Optional[int]:
+        return self._positions.get(int(analysis_id))
+
+    def missing_minhash_ids(self) -> List[int]:
+        """Rows whose signature has to be computed from layout_data"""
+        return self.ids[~self.has_minhash].tolist()
+
+    def set_minhash(self, analysis_id: int, signature: Sequence[int]):
+        pos = self.position(analysis_id)
+        if pos is not None and len(signature) == NUM_PERM:
+            self.minhash[pos] = signature
+            self.has_minhash[pos] = True
+
+    def color_index(self, min_mass: float = DOMINANT_MIN_MASS) -> ColorBinIndex:
+        """Inverted index of the dominant color bins, built on first use"""
+        if self._color_index is None or self._color_index.min_mass != min_mass:
+            self._color_index = ColorBinIndex(self.ids, self.color, min_mass)
+        return self._color_index
+
+    def layout_scores(self, query_layout: Optional[Sequence[float]], query_minhash: Optional[Sequence[int]],
+                      use_minhash: bool = False, positions: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Cosine similarity on the layout embeddings; estimated Jaccard of the
+        MinHash signatures for rows without an embedding, or for every row when
+        use_minhash is set or the query has no embedding. With `positions`,
+        only those rows are scored, in that order.
+        """
+        rows = np.arange(len(self)) if positions is None else positions
+        cosine_rows = self.has_layout[rows]
+        if use_minhash or query_layout is None or len(query_layout) != self.layout.shape[1]:
+            cosine_rows[:] = False
+
+        scores = np.zeros(len(rows), dtype=np.float64)
+        if cosine_rows.any():
+            query = np.asarray(query_layout, dtype=np.float32)
+            selected = rows[cosine_rows]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                cosine = (self.layout[selected] @ query) / (self.layout_norms[selected] * np.linalg.norm(query))
+            scores[cosine_rows] = np.nan_to_num(cosine)
+
+        jaccard_rows = ~cosine_rows & self.has_minhash[rows]
+        if jaccard_rows.any() and query_minhash is not None and len(query_minhash) == NUM_PERM:
+            query = np.asarray(query_minhash, dtype=np.int64)
+            scores[jaccard_rows] = (self.minhash[rows[jaccard_rows]] == query).mean(axis=1)
+        return scores
+
+    def score(
+        self,
+        query_layout: Optional[Sequence[float]],
+        query_minhash: Optional[Sequence[int]],
+        query_histogram,
+        search_layout: bool = True,
+        search_color: bool = True,
+        weight_layout: float = 0.5,
+        weight_color: float = 0.5,
+        use_minhash: bool = False,
+        positions: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, Optional[np.ndarray], Optional[np.ndarray]]:
+        """
+        (combined, layout, color) scores of every row (or of the `positions`
+        rows, in that order), combined the way search ranks them
+        """
+        layout_scores = self.layout_scores(query_layout, query_minhash, use_minhash, positions) if search_layout else None
+        color_scores = self.color.similarities(query_histogram, positions) if search_color else None
+        scores = np.asarray(combine_scores(layout_scores, color_scores, weight_layout, weight_color), dtype=np.float64)
+        if scores.ndim == 0:
+            scores = np.full(len(self) if positions is None else len(positions), float(scores))
+        return scores, layout_scores, color_scores
+
+    def top_k(self, scores: np.ndarray, k: int, exclude_img_url: Optional[str] = None,
+              positions: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Indices into `scores` of the k best rows, ties kept in corpus order.
+        Without `positions` these are corpus positions; with it, scores[i] is
+        the score of row positions[i].
+        """
+        urls = self.img_urls if positions is None else self.img_urls[positions]
+        eligible = np.flatnonzero(urls != exclude_img_url) if exclude_img_url else np.arange(len(scores))
+        return eligible[np.argsort(-scores[eligible], kind='stable')[:k]]
+
+
+def merge_matches(shard_matches: Sequence[List[Dict]], limit: int) -> List[Dict]:
+    """
+    Exact global top-`limit` from per-shard top-`limit` lists: every global
+    winner is within the top of its own shard. Ties break on the lower id.
+    """
+    merged = [match for matches in shard_matches for match in matches]
+    merged.sort(key=lambda match: (-match['score'], match['id']))
+    return merged[:limit]
+
+
+class UnifiedCorpus:
+    """
+    Every section in one SectionCorpus, rows sorted by section (in ScreenType
+    order) and id, so each section is a contiguous partition. A query over a
+    set of sections scans the selected partitions, adjacent ones coalesced
+    into one range, as views of the shared arrays.
+    """
+
+    # Cached range views (a view holds its own color index once built)
+    MAX_VIEWS = 64
+
+    def __init__(self, corpus: SectionCorpus, ranges: Dict[str, Tuple[int, int]]):
+        self.corpus = corpus
+        self.ranges = ranges
+        self._views: Dict[Tuple[int, int], SectionCorpus] = {}
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict], section_order: Sequence[str] = ()) -> 'UnifiedCorpus':
+        """Build from relative_screen rows of every section (CORPUS_COLUMNS plus section)"""
+        order = {section: rank for rank, section in enumerate(section_order)}
+        rows = sorted(rows, key=lambda row: (order.get(row['section'], len(order)), row['section'], row['id']))
+        corpus = SectionCorpus.from_rows(rows)
+        ranges: Dict[str, Tuple[int, int]] = {}
+        for pos, row in enumerate(rows):
+            start, _ = ranges.get(row['section'], (pos, pos))
+            ranges[row['section']] = (start, pos + 1)
+        return cls(corpus, ranges)
+
+    def __len__(self) -> int:
+        return len(self.corpus)
+
+    @property
+    def nbytes(self) -> int:
+        return self.corpus.nbytes
+
+    def partition_rows(self, sections: Sequence[str]) -> int:
+        return sum(end - start for section, (start, end) in self.ranges.items() if section in sections)
+
+    def views(self, sections: Sequence[str]) -> List[SectionCorpus]:
+        """Corpora covering exactly the rows of `sections`, one per contiguous run of partitions"""
+        spans = sorted(self.ranges[section] for section in set(sections) if section in self.ranges)
+        merged: List[List[int]] = []
+        for start, end in spans:
+            if merged and merged[-1][1] == start:
+                merged[-1][1] = end
+            else:
+                merged.append([start, end])
+
+        views = []
+        for start, end in merged:
+            key = (start, end)
+            if key not in self._views:
+                if len(self._views) >= self.MAX_VIEWS:
+                    self._views.pop(next(iter(self._views)))
+                self._views[key] = self.corpus if key == (0, len(self.corpus)) else self.corpus.slice(start, end)
+            views.append(self._views[key])
+        return views
@@ -1,5 +1,5 @@
 import numpy as np
-from typing import List
+from typing import Dict, List, Optional
 
 def calculate_cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
     """Calculate cosine similarity between two vectors"""
@@ -25,4 +25,89 @@ def calculate_histogram_similarity(hist1: List[float], hist2: List[float]) -> fl
         
         return float(similarity)
     except Exception as e:
-        return 0.0 
\ No newline at end of file
+        return 0.0 
+
+def calculate_cosine_similarities(vec: List[float], matrix: np.ndarray) -> np.ndarray:
+    """Cosine similarity between one vector and every row of a matrix"""
+    vec = np.asarray(vec, dtype=np.float64)
+    matrix = np.asarray(matrix, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        similarities = matrix @ vec / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(vec))
+    return np.nan_to_num(similarities)
+
+
+def calculate_histogram_similarities(hist: List[float], matrix: np.ndarray) -> np.ndarray:
+    """Chi-Square histogram similarity between one histogram and every row of a matrix"""
+    hist = np.asarray(hist, dtype=np.float64)
+    matrix = np.asarray(matrix, dtype=np.float64)
+    chi_square = np.sum((matrix - hist) ** 2 / (matrix + hist + 1e-10), axis=1)
+    return np.exp(-chi_square / 2)
+
+
+def combine_scores(layout_score, color_score, weight_layout: float, weight_color: float):
+    """
+    Combine layout and color scores the way search results are ranked:
+    weighted sum when both are enabled, otherwise the single enabled score.
+    Works on floats and numpy arrays alike.
+    """
+    if layout_score is not None and color_score is not None:
+        return layout_score * weight_layout + color_score * weight_color
+    if layout_score is not None:
+        return layout_score
+    if color_score is not None:
+        return color_score
+    return 0.0
+
+
+def rank_hybrid(
+    ids: List[int],
+    layout_matrix: Optional[np.ndarray],
+    color_matrix: Optional[np.ndarray],
+    query_layout: Optional[List[float]],
+    query_color: Optional[List[float]],
+    weight_layout: float = 0.5,
+    weight_color: float = 0.5,
+    match_count: int = 5,
+    candidate_count: int = 200,
+    img_urls: Optional[List[str]] = None,
+    exclude_img_url: Optional[str] = None
+) -> List[Dict]:
+    """
+    In-process equivalent of the match_relative_screens RPC (exact nearest
+    candidates instead of ivfflat). Rows with a missing vector must already be
+    filtered out for every query that is given. With `exclude_img_url`, rows
+    whose entry in `img_urls` equals it are never candidates.
+    """
+    ids = np.asarray(ids)
+    if exclude_img_url is not None and img_urls is not None:
+        keep = np.asarray(img_urls, dtype=object) != exclude_img_url
+        ids = ids[keep]
+        if layout_matrix is not None:
+            layout_matrix = np.asarray(layout_matrix)[keep]
+        if color_matrix is not None:
+            color_matrix = np.asarray(color_matrix)[keep]
+    if ids.size == 0:
+        return []
+    candidates = np.arange(ids.size)
+    layout_scores = color_scores = None
+    if query_layout is not None:
+        layout_scores = calculate_cosine_similarities(query_layout, layout_matrix)
+        order = np.lexsort((ids, -layout_scores))
+        candidates = order[:candidate_count]
+        layout_scores = layout_scores[candidates]
+    if query_color is not None:
+        color_scores = calculate_histogram_similarities(query_color, np.asarray(color_matrix)[candidates])
+
+    scores = np.asarray(combine_scores(layout_scores, color_scores, weight_layout, weight_color), dtype=np.float64)
+    if scores.ndim == 0:
+        scores = np.full(candidates.shape, float(scores))
+    top = np.lexsort((ids[candidates], -scores))[:match_count]
+    return [
+        {
+            "id": int(ids[candidates[i]]),
+            "score": float(scores[i]),
+            "layout_score": float(layout_scores[i]) if layout_scores is not None else None,
+            "color_score": float(color_scores[i]) if color_scores is not None else None,
+        }
+        for i in top
+    ]
@@ -0,0 +1,151 @@
+import os
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from ..types.screen import ScreenType
+from .section_corpus import parse_vector
+from .sparse_histogram import to_sparse
+
+# Leading dimensions of each section's layout embedding kept in the site vector
+# (text-embedding-3 embeddings stay useful truncated and renormalized)
+SITE_LAYOUT_DIMS = int(os.getenv("SITE_LAYOUT_DIMS", 256))
+
+# "renormalize": sites are compared on the sections they have; "zero": a missing section counts as dissimilar
+SITE_MISSING_SECTIONS = os.getenv("SITE_MISSING_SECTIONS", "renormalize").lower()
+
+# Relative weight of each section, e.g. "above the fold=2,footer=0.5"; unlisted sections weigh 1
+SITE_SECTION_WEIGHTS = os.getenv("SITE_SECTION_WEIGHTS", "")
+
+# Layout vs color within a section, as in search.py's defaults
+SITE_WEIGHT_LAYOUT = float(os.getenv("SITE_WEIGHT_LAYOUT", 0.7))
+SITE_WEIGHT_COLOR = float(os.getenv("SITE_WEIGHT_COLOR", 0.3))
+
+MISSING_MODES = ('renormalize', 'zero')
+
+# The 8x8x8 HSV histogram pooled to 4x4x4 bins per section
+_COLOR_BINS = 64
+
+# Columns a site vector is built from
+SITE_COLUMNS = 'id, section, site_url, layout_embedding, color_embedding, color_histogram'
+
+
+def parse_section_weights(spec: str) -> Dict[str, float]:
+    """{section: weight} from "section=weight,..." (sections not listed weigh 1)"""
+    weights = {section.value: 1.0 for section in ScreenType}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        section, _, weight = item.rpartition('=')
+        weights[ScreenType(section.strip()).value] = float(weight)
+    return weights
+
+
+def _unit(vector: np.ndarray) -> Optional[np.ndarray]:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else None
+
+
+def _pooled_color(row: Dict) -> Optional[np.ndarray]:
+    source = row.get('color_histogram') or row.get('color_embedding')
+    if source is None:
+        return None
+    dense = to_sparse(source).to_dense().astype(np.float32)
+    if dense.size != 512:
+        return None
+    return _unit(dense.reshape(4, 2, 4, 2, 4, 2).sum(axis=(1, 3, 5)).ravel())
+
+
+class SiteVectorBuilder:
+    """
+    One vector per site from the layout and color embeddings of its sections.
+    The vector is a block per section (truncated unit layout embedding, then
+    a pooled unit color histogram), each scaled by the square root of its
+    weight, so the dot product of two site vectors is the weighted sum of
+    their per-section layout and color cosines.
+    """
+
+    def __init__(
+        self,
+        section_weights: Optional[Dict[str, float]] = None,
+        weight_layout: float = SITE_WEIGHT_LAYOUT,
+        weight_color: float = SITE_WEIGHT_COLOR,
+        layout_dims: int = SITE_LAYOUT_DIMS,
+        missing: str = SITE_MISSING_SECTIONS
+    ):
+        if missing not in MISSING_MODES:
+            raise ValueError(f"Unknown missing-section handling: {missing}")
+        self.section_weights = section_weights or parse_section_weights(SITE_SECTION_WEIGHTS)
+        total = weight_layout + weight_color
+        self.weight_layout = weight_layout / total
+        self.weight_color = weight_color / total
+        self.layout_dims = layout_dims
+        self.missing = missing
+        self.sections = [section.value for section in ScreenType]
+        self.block_size = layout_dims + _COLOR_BINS
+
+    @property
+    def dims(self) -> int:
+        return len(self.sections) * self.block_size
+
+    @property
+    def config(self) -> str:
+        """Stored with every site vector; vectors built under another config are rebuilt"""
+        weights = ','.join(f"{self.section_weights.get(section, 1.0):g}" for section in self.sections)
+        return (
+            f"site-v1-d{self.layout_dims}-{self.missing}"
+            f"-l{self.weight_layout:g}-c{self.weight_color:g}-w{weights}"
+        )
+
+    def build(self, rows: Sequence[Dict]) -> Tuple[Optional[np.ndarray], Dict[str, List[int]]]:
+        """
+        (vector, {section: relative_screen ids}) of one site's rows. Several
+        rows of a section are averaged. None when no row has any embedding.
+        """
+        grouped: Dict[str, List[Dict]] = {}
+        for row in rows:
+            grouped.setdefault(row['section'], []).append(row)
+
+        vector = np.zeros(self.dims, dtype=np.float32)
+        weights = {}
+        sections = {}
+        for index, section in enumerate(self.sections):
+            section_rows = grouped.get(section)
+            weight = self.section_weights.get(section, 1.0)
+            if not section_rows or weight <= 0:
+                continue
+            layouts = [parse_vector(row.get('layout_embedding')) for row in section_rows]
+            layouts = [_unit(layout[:self.layout_dims]) for layout in layouts if layout is not None]
+            layouts = [layout for layout in layouts if layout is not None and len(layout) == self.layout_dims]
+            colors = [color for color in (_pooled_color(row) for row in section_rows) if color is not None]
+            layout = _unit(np.mean(layouts, axis=0)) if layouts else None
+            color = _unit(np.mean(colors, axis=0)) if colors else None
+            if layout is None and color is None:
+                continue
+
+            start = index * self.block_size
+            if layout is not None:
+                vector[start:start + self.layout_dims] = np.sqrt(self.weight_layout) * layout
+            if color is not None:
+                vector[start + self.layout_dims:start + self.block_size] = np.sqrt(self.weight_color) * color
+            weights[section] = weight
+            sections[section] = sorted(row['id'] for row in section_rows)
+
+        if not weights:
+            return None, {}
+        # Weights sum to 1 over the sections the site has (renormalize) or over every section (zero)
+        total = sum(weights.values()) if self.missing == 'renormalize' else sum(
+            max(self.section_weights.get(section, 1.0), 0.0) for section in self.sections
+        )
+        for index, section in enumerate(self.sections):
+            if section in weights:
+                start = index * self.block_size
+                vector[start:start + self.block_size] *= np.sqrt(weights[section] / total)
+        return vector, sections
+
+    def section_scores(self, a: np.ndarray, b: np.ndarray) -> Dict[str, float]:
+        """Per-section contributions to the dot product of two site vectors"""
+        blocks_a = a.reshape(len(self.sections), self.block_size)
+        blocks_b = b.reshape(len(self.sections), self.block_size)
+        shared = blocks_a.any(axis=1) & blocks_b.any(axis=1)
+        contributions = (blocks_a * blocks_b).sum(axis=1)
+        return {
+            section: float(contributions[index]) for index, section in enumerate(self.sections) if shared[index]
+        }
@@ -0,0 +1,160 @@
+import json
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+# 8x8x8 HSV bins from get_color_histogram_embedding
+HISTOGRAM_SIZE = 512
+_EPS = 1e-10
+
+
+def _self_terms(values: np.ndarray) -> np.ndarray:
+    # Chi-square contribution of a bin that is zero in the other histogram
+    return values ** 2 / (values + _EPS)
+
+
+class SparseHistogram:
+    """Non-zero bins of a color histogram, plus the precomputed chi-square self term"""
+
+    __slots__ = ('indices', 'values', 'size', 'self_term')
+
+    def __init__(self, indices: Sequence[int], values: Sequence[float], size: int = HISTOGRAM_SIZE):
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.size = size
+        self.self_term = float(_self_terms(self.values).sum())
+
+    @classmethod
+    def from_dense(cls, hist: Sequence[float]) -> 'SparseHistogram':
+        hist = np.asarray(hist, dtype=np.float64)
+        indices = np.flatnonzero(hist)
+        return cls(indices, hist[indices], size=hist.size)
+
+    @classmethod
+    def from_dict(cls, data: Union[Dict, str]) -> 'SparseHistogram':
+        """Inverse of to_dict; accepts the JSON text PostgREST may return"""
+        if isinstance(data, str):
+            data = json.loads(data)
+        return cls(data['indices'], data['values'], size=data.get('size', HISTOGRAM_SIZE))
+
+    def to_dict(self) -> Dict:
+        """JSON form stored in relative_screen.color_histogram"""
+        return {"size": self.size, "indices": self.indices.tolist(), "values": self.values.tolist()}
+
+    def to_dense(self) -> np.ndarray:
+        dense = np.zeros(self.size, dtype=np.float64)
+        dense[self.indices] = self.values
+        return dense
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+
+def to_sparse(hist: Union[SparseHistogram, Dict, str, Sequence[float]]) -> SparseHistogram:
+    """Sparse histogram from a stored dict/JSON, a dense list, or a SparseHistogram"""
+    if isinstance(hist, SparseHistogram):
+        return hist
+    if isinstance(hist, dict):
+        return SparseHistogram.from_dict(hist)
+    if isinstance(hist, str):
+        data = json.loads(hist)
+        return SparseHistogram.from_dict(data) if isinstance(data, dict) else SparseHistogram.from_dense(data)
+    return SparseHistogram.from_dense(hist)
+
+
+def _chi_square(a: SparseHistogram, b: SparseHistogram) -> float:
+    """
+    Chi-square distance touching only the bins both histograms share.
+    Bins present in one histogram only contribute x^2/(x+eps), which is
+    covered by the self terms; shared bins swap their two self terms for
+    the actual (a-b)^2/(a+b+eps) term.
+    """
+    _, ia, ib = np.intersect1d(a.indices, b.indices, assume_unique=True, return_indices=True)
+    va, vb = a.values[ia], b.values[ib]
+    shared = _self_terms(va) + _self_terms(vb) - (va - vb) ** 2 / (va + vb + _EPS)
+    return a.self_term + b.self_term - float(shared.sum())
+
+
+def sparse_histogram_similarity(hist1, hist2) -> float:
+    """Sparse equivalent of calculate_histogram_similarity"""
+    try:
+        return float(np.exp(-_chi_square(to_sparse(hist1), to_sparse(hist2)) / 2))
+    except Exception:
+        return 0.0
+
+
+class SparseHistogramMatrix:
+    """
+    Histograms of a corpus in CSR layout (concatenated non-zero bins plus row
+    offsets). Scoring a query against every row costs one pass over the
+    stored non-zeros instead of rows x 512.
+    """
+
+    def __init__(self, histograms: List[SparseHistogram], size: int = HISTOGRAM_SIZE):
+        self.size = size
+        lengths = np.array([len(h) for h in histograms], dtype=np.int64)
+        self.indptr = np.concatenate([[0], np.cumsum(lengths)])
+        self.indices = np.concatenate([h.indices for h in histograms]) if histograms else np.zeros(0, np.int32)
+        self.values = np.concatenate([h.values for h in histograms]) if histograms else np.zeros(0)
+        self.rows = np.repeat(np.arange(len(histograms)), lengths)
+        self.self_terms = np.array([h.self_term for h in histograms], dtype=np.float64)
+        self._value_terms = _self_terms(self.values)
+
+    @classmethod
+    def from_histograms(cls, histograms: List) -> 'SparseHistogramMatrix':
+        return cls([to_sparse(h) for h in histograms])
+
+    def __len__(self) -> int:
+        return len(self.self_terms)
+
+    def row(self, pos: int) -> SparseHistogram:
+        start, end = self.indptr[pos], self.indptr[pos + 1]
+        return SparseHistogram(self.indices[start:end], self.values[start:end], self.size)
+
+    def slice(self, start: int, end: int) -> 'SparseHistogramMatrix':
+        """
+        Rows start..end-1 as a matrix sharing this one's bins (indices, values
+        and self terms are views). Row offsets and per-bin row ids are rebased
+        to the slice, so those two arrays are new: one int64 per row and one
+        per stored bin of the slice.
+        """
+        lo, hi = int(self.indptr[start]), int(self.indptr[end])
+        part = SparseHistogramMatrix.__new__(SparseHistogramMatrix)
+        part.size = self.size
+        part.indptr = self.indptr[start:end + 1] - lo
+        part.indices = self.indices[lo:hi]
+        part.values = self.values[lo:hi]
+        part.rows = self.rows[lo:hi] - start
+        part.self_terms = self.self_terms[start:end]
+        part._value_terms = self._value_terms[lo:hi]
+        return part
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.indices.nbytes + self.values.nbytes + self.self_terms.nbytes
+
+    def _row_elements(self, targets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Positions in indices/values of the stored bins of the `targets` rows, and their row lengths"""
+        starts = self.indptr[targets]
+        lengths = self.indptr[targets + 1] - starts
+        # Shift a running counter back to each row's start in the CSR arrays
+        shifts = starts - np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        return np.arange(int(lengths.sum())) + np.repeat(shifts, lengths), lengths
+
+    def similarities(self, hist, targets: Optional[np.ndarray] = None) -> np.ndarray:
+        """Chi-square similarity of `hist` against every row (or only the `targets` rows)"""
+        query = to_sparse(hist)
+        dense_query = query.to_dense()
+        if targets is None:
+            indices, values, value_terms, rows = self.indices, self.values, self._value_terms, self.rows
+            self_terms = self.self_terms
+        else:
+            targets = np.asarray(targets, dtype=np.int64)
+            elements, lengths = self._row_elements(targets)
+            indices, values, value_terms = self.indices[elements], self.values[elements], self._value_terms[elements]
+            rows = np.repeat(np.arange(len(targets)), lengths)
+            self_terms = self.self_terms[targets]
+        q = dense_query[indices]
+        # Zero wherever the query bin is empty, so no masking is needed
+        shared = value_terms + _self_terms(q) - (values - q) ** 2 / (values + q + _EPS)
+        chi_square = self_terms + query.self_term - np.bincount(rows, weights=shared, minlength=len(self_terms))
+        return np.exp(-chi_square / 2)
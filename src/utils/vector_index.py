@@ -0,0 +1,94 @@
+import math
+import numpy as np
+from typing import Dict, List, Optional, Sequence
+
+# Embedding columns served by an approximate index, and the operator class of the queries using them
+VECTOR_INDEXES = {
+    ("relative_screen", "layout_embedding"): "vector_cosine_ops",
+    ("screen_analysis", "embedding"): "vector_cosine_ops",
+}
+
+# Below this many rows an exact scan is fast enough and always has recall 1
+MIN_INDEXED_ROWS = 5000
+
+
+def index_name(table: str, column: str) -> str:
+    return f"{table}_{column}_idx"
+
+
+def recommend_index(row_count: int, method: str = "ivfflat", top_k: int = 10) -> Dict:
+    """
+    Build and query parameters for an index over `row_count` vectors, following
+    the pgvector guidance: ivfflat lists = rows / 1000 up to 1M rows and
+    sqrt(rows) beyond, probes = sqrt(lists); HNSW m = 16 (24 past 1M rows),
+    ef_construction >= 2 * m, ef_search >= 2 * top_k.
+    """
+    if row_count < MIN_INDEXED_ROWS:
+        return {"method": "none", "row_count": row_count}
+    if method == "ivfflat":
+        lists = row_count // 1000 if row_count <= 1_000_000 else int(math.sqrt(row_count))
+        lists = max(lists, 10)
+        return {
+            "method": "ivfflat",
+            "row_count": row_count,
+            "lists": lists,
+            "probes": max(1, int(math.ceil(math.sqrt(lists)))),
+        }
+    if method == "hnsw":
+        m = 16 if row_count <= 1_000_000 else 24
+        return {
+            "method": "hnsw",
+            "row_count": row_count,
+            "m": m,
+            "ef_construction": 64 if row_count <= 100_000 else 128,
+            "ef_search": max(40, 2 * top_k),
+        }
+    raise ValueError(f"Unknown index method: {method}")
+
+
+def rebuild_statements(table: str, column: str, plan: Dict, opclass: str = "vector_cosine_ops") -> List[str]:
+    """
+    Statements that replace the column's index without blocking writes:
+    build the new index concurrently under a temporary name, drop the old one
+    concurrently, rename, and record the query-time setting the RPCs read.
+    Each statement must run outside a transaction block.
+    """
+    name = index_name(table, column)
+    statements = []
+    if plan["method"] == "none":
+        statements.append(f"drop index concurrently if exists {name}")
+    else:
+        if plan["method"] == "ivfflat":
+            options = f"lists = {plan['lists']}"
+        else:
+            options = f"m = {plan['m']}, ef_construction = {plan['ef_construction']}"
+        statements += [
+            f"drop index concurrently if exists {name}_new",
+            f"create index concurrently {name}_new on {table} "
+            f"using {plan['method']} ({column} {opclass}) with ({options})",
+            f"drop index concurrently if exists {name}",
+            f"alter index {name}_new rename to {name}",
+        ]
+    statements.append(
+        "insert into vector_index_settings (table_name, column_name, method, probes, ef_search) "
+        f"values ('{table}', '{column}', '{plan['method']}', {plan.get('probes') or 'null'}, {plan.get('ef_search') or 'null'}) "
+        "on conflict (table_name, column_name) do update set "
+        "method = excluded.method, probes = excluded.probes, ef_search = excluded.ef_search, updated_at = now()"
+    )
+    return statements
+
+
+def exact_top_k(query: Sequence[float], ids: Sequence, matrix: np.ndarray, k: int) -> List:
+    """Ground-truth neighbours by cosine similarity"""
+    query = np.asarray(query, dtype=np.float64)
+    matrix = np.asarray(matrix, dtype=np.float64)
+    similarity = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+    top = np.argsort(-similarity, kind="stable")[:k]
+    return [ids[i] for i in top]
+
+
+def recall_at_k(expected: Sequence, actual: Sequence, k: Optional[int] = None) -> float:
+    expected = list(expected)[:k] if k else list(expected)
+    if not expected:
+        return 1.0
+    return len(set(expected) & set(actual)) / len(expected)
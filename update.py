@@ -3,19 +3,23 @@ import sys
 import asyncio
 import logging
 from dotenv import load_dotenv
-from supabase import create_client
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional
 import argparse
 import json
+import time
 import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 # Add parent directory to path to import from src
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.services.db_service import DatabaseService
-from src.services.gemini_service import GeminiService
+from src.services.base_db_service import BaseDatabaseService
 from src.services.service_factory import ServiceFactory
 from src.types.screen import ScreenType, SearchOptions, ScreenAnalysis
+from src.config.storage import storage_configured
+from src.utils.section_corpus import CORPUS_COLUMNS, SectionCorpus
+from src.utils.knn_graph import NNDescent, PairScorer, graph_recall
 
 # Configure logging
 logging.basicConfig(
@@ -27,16 +31,12 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Configuration
-PUBLIC_SUPABASE_URL = os.getenv('PUBLIC_SUPABASE_URL')
-SUPABASE_SERVICE_ROLE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-
-if not all([PUBLIC_SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, GEMINI_API_KEY]):
+# Related ids are ranked from stored embeddings, so only storage has to be configured
+if not storage_configured():
     logger.error("Missing required environment variables")
     sys.exit(1)
 
-async def get_related_screens(db_service: DatabaseService, service, target_url: str, section: str, options: SearchOptions, limit: int = 5) -> tuple[List[int], List[float]]:
+async def get_related_screens(db_service: BaseDatabaseService, service, target_url: str, section: str, options: SearchOptions, limit: int = 5) -> tuple[List[int], List[float]]:
     """Get related screen IDs using search logic"""
     try:
         # Get target screen analysis
@@ -62,13 +62,8 @@ async def get_related_screens(db_service: DatabaseService, service, target_url:
         for result in results[:limit]:
             if result.screen.screen_id:
                 related_ids.append(result.screen.screen_id)
-                # Tính tổng điểm từ layout_score và color_score
-                total_score = 0
-                if hasattr(result, 'layout_score') and result.layout_score is not None:
-                    total_score += result.layout_score * options.weight_layout
-                if hasattr(result, 'color_score') and result.color_score is not None:
-                    total_score += result.color_score * options.weight_color
-                scores.append(total_score)
+                # Keep the ranking score so incremental updates can compare against it
+                scores.append(result.score)
                 
         return related_ids, scores
         
@@ -77,21 +72,16 @@ async def get_related_screens(db_service: DatabaseService, service, target_url:
         logger.debug(traceback.format_exc())  # Thêm log chi tiết để debug
         return [], []
 
-async def get_related_screens_general(db_service: DatabaseService, target_url: str, section: str, limit: int = 5) -> tuple[List[int], List[float]]:
+async def get_related_screens_general(db_service: BaseDatabaseService, target_url: str, section: str, limit: int = 5) -> tuple[List[int], List[float]]:
     """Get related screen IDs using general search"""
     try:
         # Get target screen analysis from screen_analysis table
-        query = db_service.supabase.table('screen_analysis')\
-            .select('*')\
-            .eq('webp_url', target_url)\
-            .eq('section', section)\
-            .execute()
+        target_analysis = await db_service.get_screen_analysis(target_url, section)
             
-        if not query.data:
+        if not target_analysis:
             logger.error(f"Analysis not found for webp_url: {target_url} and section: {section}")
             return [], []
             
-        target_analysis = query.data[0]
         # print("===========")
         # print(target_analysis)
         # print("===========")
@@ -109,17 +99,12 @@ async def get_related_screens_general(db_service: DatabaseService, target_url: s
             target_embedding = json.loads(target_embedding)
 
         # Search for similar sections using vector similarity
-        query = db_service.supabase.rpc(
-            'match_screen_embeddings',
-            {
-                'query_embedding': target_embedding,
-                'section_type': section,
-                'match_threshold': 0.5,  # Giảm ngưỡng xuống để có nhiều kết quả hơn
-                'match_count': limit + 1
-            }
-        ).execute()
-
-        results = query.data
+        results = await db_service.match_screen_embeddings(
+            query_embedding=target_embedding,
+            section_type=section,
+            match_threshold=0.5,  # Giảm ngưỡng xuống để có nhiều kết quả hơn
+            match_count=limit + 1
+        )
         
         # Skip the first result and get screen IDs with scores
         related_ids = []
@@ -142,103 +127,420 @@ async def get_related_screens_general(db_service: DatabaseService, target_url: s
         logger.debug(traceback.format_exc())  # Thêm traceback để debug
         return [], []
 
+def _section_scorer(rows: List[Dict], options: SearchOptions):
+    """
+    Build score(pos) -> combined similarity of row `pos` against every row of
+    the section, computed by SectionCorpus.score as search does: cosine of the
+    layout embeddings, MinHash Jaccard where either row has no embedding, and
+    chi-square color similarity
+    """
+    corpus = SectionCorpus.from_rows(rows)
+
+    def score(pos: int, targets: Optional[np.ndarray] = None) -> np.ndarray:
+        scores, _, _ = corpus.score(
+            corpus.layout[pos] if corpus.has_layout[pos] else None,
+            corpus.minhash[pos] if corpus.has_minhash[pos] else None,
+            corpus.color.row(pos),
+            search_layout=options.search_layout,
+            search_color=options.search_color,
+            weight_layout=options.weight_layout,
+            weight_color=options.weight_color,
+            positions=targets
+        )
+        return scores
+
+    return score
+
+async def update_related_screens_incremental(
+    db_service: BaseDatabaseService,
+    options: SearchOptions,
+    limit: int = 5
+):
+    """
+    Fill related ids for newly labeled relative_screen rows and push each
+    new row into the stored top-k of existing rows it now beats.
+    Scores are symmetric, so the scan that ranks a new row also gives its
+    score against every existing row (the reverse candidates); an existing
+    row changes only when that score exceeds the lowest of its stored top-k.
+    Only new rows and existing rows whose top-k changed are written.
+    """
+    new_records = await db_service.get_analyses_without_related_ids()
+    if not new_records:
+        logger.info("No new records in relative_screen")
+        return
+
+    logger.info(f"Found {len(new_records)} new records")
+    new_by_section: Dict[str, set] = {}
+    for record in new_records:
+        new_by_section.setdefault(record['section'], set()).add(record['id'])
+
+    for section, new_ids in new_by_section.items():
+        try:
+            # Scoring never reads layout_data, so leave it in the database
+            rows = await db_service.get_all_rows(
+                'relative_screen', columns=f"{CORPUS_COLUMNS}, screen_related_ids, screen_related_scores", section=section
+            )
+            score = _section_scorer(rows, options)
+            img_urls = np.array([row['img_url'] for row in rows])
+            has_screen_id = np.array([row.get('screen_id') is not None for row in rows])
+            position_by_screen_id = {row['screen_id']: pos for pos, row in enumerate(rows) if row.get('screen_id')}
+            new_positions = [pos for pos, row in enumerate(rows) if row['id'] in new_ids]
+
+            # Top-k of every new row; keep the full score rows for the reverse pass
+            new_scores = np.empty((len(new_positions), len(rows)))
+            for i, pos in enumerate(new_positions):
+                scores = score(pos)
+                new_scores[i] = scores
+
+                eligible = np.flatnonzero(has_screen_id & (img_urls != img_urls[pos]))
+                top = eligible[np.argsort(-scores[eligible], kind='stable')[:limit]]
+                related_ids = [rows[j]['screen_id'] for j in top]
+                if related_ids:
+                    await db_service.update_screen_related_ids(
+                        rows[pos]['id'], related_ids, [float(scores[j]) for j in top]
+                    )
+                else:
+                    logger.warning(f"No related screen IDs found for {rows[pos]['img_url']}")
+
+            # Reverse pass: offer the new rows to existing rows that they beat
+            new_mask = np.zeros(len(rows), dtype=bool)
+            new_mask[new_positions] = True
+            changed = 0
+            for pos, row in enumerate(rows):
+                current_ids = row.get('screen_related_ids') or []
+                if new_mask[pos] or not current_ids:
+                    continue
+
+                current_scores = row.get('screen_related_scores') or []
+                if len(current_scores) != len(current_ids):
+                    # Rows written before scores were stored: rescore their current top-k
+                    known = [position_by_screen_id[sid] for sid in current_ids if sid in position_by_screen_id]
+                    current_ids = [rows[j]['screen_id'] for j in known]
+                    current_scores = score(pos, np.array(known, dtype=int)).tolist() if known else []
+
+                threshold = min(current_scores) if len(current_ids) >= limit else -np.inf
+                winners = [
+                    i for i in np.flatnonzero(new_scores[:, pos] > threshold)
+                    if has_screen_id[new_positions[i]]
+                    and img_urls[new_positions[i]] != row['img_url']
+                    and rows[new_positions[i]]['screen_id'] not in current_ids
+                ]
+                if not winners:
+                    continue
+
+                merged = list(zip(current_scores, current_ids)) + [
+                    (float(new_scores[i, pos]), rows[new_positions[i]]['screen_id']) for i in winners
+                ]
+                merged.sort(key=lambda item: item[0], reverse=True)
+                merged = merged[:limit]
+                await db_service.update_screen_related_ids(
+                    row['id'], [sid for _, sid in merged], [s for s, _ in merged]
+                )
+                changed += 1
+
+            logger.info(f"✓ Section {section}: {len(new_positions)} new rows, {changed} existing rows updated")
+
+        except Exception as e:
+            logger.error(f"Error updating section {section}: {str(e)}")
+            logger.debug(traceback.format_exc())
+            continue
+
+async def update_related_screens_knn(
+    db_service: BaseDatabaseService,
+    options: SearchOptions,
+    knn: NNDescent,
+    recall_sample: int = 100
+):
+    """
+    Recompute the related ids of every relative_screen row from an
+    approximate kNN graph per section (NN-descent) instead of scoring every
+    row against the whole section. Same score and exclusions as the exact
+    path; only rows whose related ids or scores changed are written.
+    """
+    for section in ScreenType:
+        try:
+            rows = await db_service.get_all_rows(
+                'relative_screen', columns=f"{CORPUS_COLUMNS}, screen_related_ids, screen_related_scores",
+                section=section.value
+            )
+            if len(rows) < 2:
+                continue
+
+            start = time.perf_counter()
+            scorer = PairScorer.from_rows(
+                rows, options.search_layout, options.search_color, options.weight_layout, options.weight_color
+            )
+            eligible = np.array([row.get('screen_id') is not None for row in rows])
+            _, groups = np.unique(np.array([row['img_url'] for row in rows]), return_inverse=True)
+            graph = knn.build(
+                scorer, eligible=eligible, groups=groups,
+                progress=lambda iteration, updates, comparisons: logger.info(
+                    f"  {section.value}: iteration {iteration}, {updates} list updates, {comparisons} comparisons"
+                )
+            )
+            elapsed = time.perf_counter() - start
+
+            changed = 0
+            for pos, row in enumerate(rows):
+                top = graph.neighbors[pos][graph.neighbors[pos] >= 0]
+                related_ids = [rows[j]['screen_id'] for j in top]
+                scores = [round(float(s), 6) for s in graph.scores[pos][:len(top)]]
+                if not related_ids:
+                    continue
+                stored_scores = [round(float(s), 6) for s in (row.get('screen_related_scores') or [])]
+                if related_ids == (row.get('screen_related_ids') or []) and scores == stored_scores:
+                    continue
+                await db_service.update_screen_related_ids(row['id'], related_ids, scores)
+                changed += 1
+
+            n = len(rows)
+            comparisons = graph.stats['comparisons']
+            message = (
+                f"✓ Section {section.value}: {n} rows, {graph.stats['iterations']} iterations, "
+                f"{comparisons} comparisons ({comparisons / (n * (n - 1) / 2):.1%} of all pairs), "
+                f"{elapsed:.1f}s, {changed} rows updated"
+            )
+            if recall_sample:
+                recall = graph_recall(graph, scorer, recall_sample, eligible=eligible, groups=groups)
+                message += f", recall@{knn.k} {recall:.3f} on {min(recall_sample, n)} rows"
+            logger.info(message)
+
+        except Exception as e:
+            logger.error(f"Error updating section {section.value}: {str(e)}")
+            logger.debug(traceback.format_exc())
+            continue
+
+async def process_specific_record(
+    db_service: BaseDatabaseService,
+    service,
+    record: Dict,
+    options: SearchOptions,
+    limit: int
+) -> str:
+    """Update related ids of one relative_screen row; returns 'updated', 'empty' or 'errors'"""
+    try:
+        related_ids, scores = await get_related_screens(
+            db_service,
+            service,
+            record['img_url'],
+            record['section'],
+            options,
+            limit=limit
+        )
+        
+        # Update relative_screen record
+        if related_ids:
+            logger.info("Related screens found with scores:")
+            for idx, (screen_id, score) in enumerate(zip(related_ids, scores), 1):
+                logger.info(f"  {idx}. Screen ID: {screen_id}, Score: {score:.4f}")
+                
+            await db_service.update_screen_related_ids(record['id'], related_ids, scores)
+            
+            logger.info(f"✓ Updated relative_screen with {len(related_ids)} related screens")
+            return 'updated'
+
+        logger.warning("No related screen IDs found")
+        return 'empty'
+            
+    except Exception as e:
+        logger.error(f"Error processing record {record['id']}: {str(e)}")
+        return 'errors'
+
+def plan_shards(records: List[Dict], shard_size: int) -> List[Dict]:
+    """
+    Split records into shards: one per section, with sections larger than
+    shard_size cut into row ranges. Largest sections come first so the
+    pool is not left waiting on one big shard at the end.
+    """
+    by_section: Dict[str, List[Dict]] = {}
+    for record in records:
+        by_section.setdefault(record['section'], []).append(
+            {'id': record['id'], 'img_url': record['img_url'], 'section': record['section']}
+        )
+
+    shards = []
+    for section, rows in sorted(by_section.items(), key=lambda item: -len(item[1])):
+        for start in range(0, len(rows), shard_size):
+            shards.append({'section': section, 'start': start, 'records': rows[start:start + shard_size]})
+    return shards
+
+async def _update_shard(
+    shard: Dict,
+    options: SearchOptions,
+    limit: int,
+    db_factory: Callable[[], BaseDatabaseService]
+) -> Dict:
+    db_service = db_factory()
+    service = ServiceFactory.get_service(ScreenType(shard['section']), db_service=db_service)
+
+    summary = {'section': shard['section'], 'start': shard['start'], 'records': len(shard['records']),
+               'updated': 0, 'empty': 0, 'errors': 0}
+    started = time.monotonic()
+    for record in shard['records']:
+        status = await process_specific_record(db_service, service, record, options, limit)
+        summary[status] += 1
+    summary['seconds'] = time.monotonic() - started
+    return summary
+
+def run_shard(
+    shard: Dict,
+    options: SearchOptions,
+    limit: int,
+    db_factory: Callable[[], BaseDatabaseService] = ServiceFactory.create_db_service
+) -> Dict:
+    """Process-pool entry point: each worker opens its own storage connection with db_factory"""
+    # Per-record logs from many processes interleave; workers report through their summary
+    logging.getLogger().setLevel(logging.WARNING)
+    return asyncio.run(_update_shard(shard, options, limit, db_factory))
+
+async def update_related_screens_parallel(
+    records: List[Dict],
+    options: SearchOptions,
+    limit: int,
+    workers: int,
+    shard_size: int,
+    db_factory: Callable[[], BaseDatabaseService] = ServiceFactory.create_db_service
+):
+    """
+    Specific mode over a process pool, sharded by section and row range.
+    db_factory must be picklable (a module-level function or class method).
+    """
+    shards = plan_shards(records, shard_size)
+    logger.info(f"Running {len(shards)} shards on {workers} worker processes")
+
+    loop = asyncio.get_running_loop()
+    totals: Dict[str, Dict] = {}
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            loop.run_in_executor(pool, run_shard, shard, options, limit, db_factory): shard
+            for shard in shards
+        }
+        for finished, future in enumerate(asyncio.as_completed(list(futures)), 1):
+            try:
+                summary = await future
+            except Exception as e:
+                logger.error(f"Shard failed: {str(e)}")
+                continue
+
+            section_total = totals.setdefault(
+                summary['section'], {'records': 0, 'updated': 0, 'empty': 0, 'errors': 0, 'seconds': 0.0}
+            )
+            for key in section_total:
+                section_total[key] += summary[key]
+            done += summary['records']
+            end = summary['start'] + summary['records']
+            logger.info(
+                f"[{finished}/{len(shards)} shards, {done}/{len(records)} records] "
+                f"{summary['section']} rows {summary['start']}-{end}: {summary['updated']} updated, "
+                f"{summary['empty']} without results, {summary['errors']} errors ({summary['seconds']:.1f}s)"
+            )
+
+    # Records of shards that crashed are not in the totals
+    failed = len(records) - done
+    logger.info("Per-section summary:")
+    for section, total in sorted(totals.items()):
+        logger.info(
+            f"  {section}: {total['records']} records, {total['updated']} updated, "
+            f"{total['empty']} without results, {total['errors']} errors, {total['seconds']:.1f}s worker time"
+        )
+    if failed:
+        logger.error(f"{failed} records were in shards that failed")
+
 async def update_related_screens(
     mode: str = 'specific',
     search_layout: bool = True,
     search_color: bool = True,
     weight_layout: float = 0.5,
     weight_color: float = 0.5,
-    limit: int = 5
+    limit: int = 5,
+    db_service: Optional[BaseDatabaseService] = None,
+    incremental: bool = False,
+    workers: int = 1,
+    shard_size: int = 1000,
+    knn: Optional[NNDescent] = None,
+    recall_sample: int = 100,
+    db_factory: Optional[Callable[[], BaseDatabaseService]] = None
 ):
-    """Update related screens for all records based on mode"""
+    """
+    Update related screens for all records based on mode.
+    With workers > 1, specific mode runs on a process pool; each worker
+    opens its own storage connection with db_factory (default: the
+    environment configuration). An injected db_service cannot be shared
+    with the workers, so it needs a db_factory for the same storage.
+    With knn, specific mode rebuilds every row's related ids from an
+    approximate kNN graph per section.
+    """
+    if workers > 1 and db_service is not None and db_factory is None:
+        raise ValueError("workers > 1 with an injected db_service needs a db_factory for the worker processes")
     try:
         # Initialize services
-        supabase = create_client(PUBLIC_SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-        db_service = DatabaseService(supabase)
-        gemini_service = GeminiService(GEMINI_API_KEY)
+        db_service = db_service or ServiceFactory.create_db_service()
         
         # Create search options for specific mode
         options = SearchOptions(
             search_layout=search_layout,
             search_color=search_color,
             weight_layout=weight_layout,
-            weight_color=weight_color
+            weight_color=weight_color,
+            limit=limit
         )
         
         # Get records based on mode
-        if mode == 'specific':
+        if mode == 'specific' and knn is not None:
+            logger.info(
+                f"Mode: {mode} (kNN graph: iterations={knn.iterations}, sample rate={knn.sample_rate}, "
+                f"delta={knn.delta}, list size={knn.list_size})"
+            )
+            await update_related_screens_knn(db_service, options, knn, recall_sample)
+
+        elif mode == 'specific' and incremental:
+            logger.info(f"Mode: {mode} (incremental)")
+            await update_related_screens_incremental(db_service, options, limit=limit)
+
+        elif mode == 'specific':
             # For specific mode, get records from relative_screen
-            result = supabase.table('relative_screen')\
-                .select('*')\
-                .eq('screen_related_ids', [])\
-                .execute()
+            records = await db_service.get_analyses_without_related_ids()
                 
-            if not result.data:
+            if not records:
                 logger.info("No records to update in relative_screen")
                 return
                 
             # Process each record
-            total = len(result.data)
+            total = len(records)
             logger.info(f"Found {total} records to update")
             logger.info(f"Mode: {mode}")
             logger.info(f"Search config: layout={search_layout}, color={search_color}, "
                        f"weights=({weight_layout:.1f}, {weight_color:.1f}), limit={limit}")
             
-            for idx, record in enumerate(result.data, 1):
-                try:
-                    logger.info(f"Processing {idx}/{total}: {record['img_url']}")
-                    
-                    section_type = ScreenType(record['section'])
-                    service = ServiceFactory.get_service(
-                        section_type,
-                        gemini_service=gemini_service,
-                        db_service=db_service
-                    )
-                    related_ids, scores = await get_related_screens(
-                        db_service,
-                        service,
-                        record['img_url'],
-                        record['section'],
-                        options,
-                        limit=limit
-                    )
-                    
-                    # Update relative_screen record
-                    if related_ids:
-                        logger.info("Related screens found with scores:")
-                        for idx, (screen_id, score) in enumerate(zip(related_ids, scores), 1):
-                            logger.info(f"  {idx}. Screen ID: {screen_id}, Score: {score:.4f}")
-                            
-                        supabase.table('relative_screen')\
-                            .update({'screen_related_ids': related_ids})\
-                            .eq('id', record['id'])\
-                            .execute()
-                        
-                        logger.info(f"✓ Updated relative_screen with {len(related_ids)} related screens")
-                    else:
-                        logger.warning("No related screen IDs found")
-                        
-                except Exception as e:
-                    logger.error(f"Error processing record {record['id']}: {str(e)}")
-                    continue
+            if workers > 1:
+                await update_related_screens_parallel(
+                    records, options, limit, workers, shard_size,
+                    db_factory=db_factory or ServiceFactory.create_db_service
+                )
+                return
+
+            for idx, record in enumerate(records, 1):
+                logger.info(f"Processing {idx}/{total}: {record['img_url']}")
+                
+                section_type = ScreenType(record['section'])
+                service = ServiceFactory.get_service(section_type, db_service=db_service)
+                await process_specific_record(db_service, service, record, options, limit)
                     
         else:  # general mode
             # For general mode, get records from screen_analysis
-            result = supabase.table('screen_analysis')\
-                .select('*')\
-                .eq('screen_related_ids', [])\
-                .execute()
+            records = await db_service.get_screen_analyses_without_related_ids()
                 
-            if not result.data:
+            if not records:
                 logger.info("No records to update in screen_analysis")
                 return
                 
             # Process each record
-            total = len(result.data)
+            total = len(records)
             logger.info(f"Found {total} records to update")
             logger.info(f"Mode: {mode}")
             
-            for idx, record in enumerate(result.data, 1):
+            for idx, record in enumerate(records, 1):
                 try:
                     logger.info(f"Processing {idx}/{total}: {record['webp_url']}")
                     
@@ -255,10 +557,7 @@ async def update_related_screens(
                         for idx, (screen_id, score) in enumerate(zip(related_ids, scores), 1):
                             logger.info(f"  {idx}. Screen ID: {screen_id}, Score: {score:.4f}")
                             
-                        supabase.table('screen_analysis')\
-                            .update({'screen_related_ids': related_ids})\
-                            .eq('id', record['id'])\
-                            .execute()
+                        await db_service.update_screen_analysis_related_ids(record['id'], related_ids)
                             
                         logger.info(f"✓ Updated screen_analysis with {len(related_ids)} related screens")
                     else:
@@ -286,6 +585,24 @@ def parse_args():
                        help='Weight for color similarity (default: 0.5)')
     parser.add_argument('--limit', type=int, default=5,
                        help='Maximum number of related screens per record (default: 5)')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Specific mode: worker processes, sharded by section (default: 1)')
+    parser.add_argument('--shard-size', type=int, default=1000,
+                       help='Specific mode: maximum records per shard with --workers (default: 1000)')
+    parser.add_argument('--incremental', action='store_true',
+                       help='Specific mode: also insert new rows into the related ids of existing rows')
+    parser.add_argument('--knn-graph', action='store_true',
+                       help='Specific mode: rebuild every row from an approximate kNN graph (NN-descent)')
+    parser.add_argument('--knn-iterations', type=int, default=10,
+                       help='kNN graph: maximum NN-descent iterations (default: 10)')
+    parser.add_argument('--knn-sample-rate', type=float, default=0.5,
+                       help='kNN graph: share of new neighbors joined per iteration (default: 0.5)')
+    parser.add_argument('--knn-list-size', type=int, default=20,
+                       help='kNN graph: neighbors kept per row while building, at least --limit (default: 20)')
+    parser.add_argument('--knn-delta', type=float, default=0.001,
+                       help='kNN graph: stop when fewer than delta * rows * list size entries change (default: 0.001)')
+    parser.add_argument('--knn-recall-sample', type=int, default=100,
+                       help='kNN graph: rows checked against exact top-k to report recall, 0 to skip (default: 100)')
     return parser.parse_args()
 
 if __name__ == "__main__":
@@ -297,5 +614,16 @@ if __name__ == "__main__":
         search_color=not args.no_color,
         weight_layout=args.weight_layout,
         weight_color=args.weight_color,
-        limit=args.limit
+        limit=args.limit,
+        incremental=args.incremental,
+        workers=args.workers,
+        shard_size=args.shard_size,
+        knn=NNDescent(
+            k=args.limit,
+            iterations=args.knn_iterations,
+            sample_rate=args.knn_sample_rate,
+            delta=args.knn_delta,
+            list_size=args.knn_list_size
+        ) if args.knn_graph else None,
+        recall_sample=args.knn_recall_sample
     )) 
\ No newline at end of file